@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+Account Cube Module
+
+A transaction file's P&L as a persisted account x month cube, with every
+level of the chart of accounts rolled up ahead of time, so reports and
+drill-up/drill-down questions are answered without touching transactions.
+
+The hierarchy comes from PNL_ACCOUNTS: each account rolls up into its
+subcategory, each subcategory into its category (accounts without a
+subcategory roll straight up into their category, except expenses, which
+go to Other Operating Expenses - see rollup_group() in pnl_generator.py).
+On top of the categories sit the summary lines of the report (Gross
+Profit, Net Operating Income, Net Other Income, Net Income).
+
+The cube is one row of monthly totals (cents) per member, stored as a
+single .npy column in a cube/ directory in the file's snapshot directory
+(see ledger_snapshot.py), with cube.json listing the members, their level
+and parent, and the first month. cube.json goes last and records the
+file's size, modification time and the parser digest, like a snapshot's
+meta.json. The pipeline writes each step's cube from the matrix it has
+already built; a missing or stale cube is rebuilt from all of the file's
+month partitions (see ledger_partitions.py) by load_cube(). A period
+report reads it through load_cube_window() instead, which falls back to
+the partitions of the report's window without rebuilding the cube.
+
+Usage: python3 account_cube.py SOURCE [MEMBER] [--from YYYY-MM] [--to YYYY-MM] [--by-month]
+       (SOURCE is a pipeline step, e.g. step6, or a transaction file)
+"""
+
+import argparse
+import json
+from array import array
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from ledger_partitions import load_catalog, load_window_matrix
+from ledger_snapshot import map_npy, parser_digest, snapshot_dir, source_stamp, write_npy
+from pnl_generator import (
+    FIRST_MONTH, LAST_MONTH, MONTHS, PNL_ACCOUNTS, AccountMonthMatrix, format_number, month_key, parse_month,
+    pipeline_step_files, rollup_group,
+)
+
+CUBE_VERSION = 1
+
+LEVEL_ACCOUNT = "account"
+LEVEL_SUBCATEGORY = "subcategory"
+LEVEL_CATEGORY = "category"
+LEVEL_SUMMARY = "summary"
+
+# Summary lines, in report order, as signed sums of categories and earlier lines
+SUMMARY_LINES: Dict[str, Dict[str, int]] = {
+    "Gross Profit": {"Income": 1, "Cost of Goods Sold": -1},
+    "Net Operating Income": {"Gross Profit": 1, "Expenses": -1},
+    "Net Other Income": {"Other Income": 1, "Other Expenses": -1},
+    "Net Income": {"Net Operating Income": 1, "Net Other Income": 1},
+}
+
+# (name, level, parent) for every member, children before their parents
+Member = Tuple[str, str, Optional[str]]
+
+
+def cube_members() -> List[Member]:
+    """Every member of the hierarchy PNL_ACCOUNTS defines, accounts in report order."""
+    accounts = sorted(PNL_ACCOUNTS.items(), key=lambda item: item[1].order)
+    members: List[Member] = []
+    subcategories: Dict[str, str] = {}
+    categories: List[str] = []
+    for code, config in accounts:
+        group = rollup_group(config)
+        if group != config.category:
+            subcategories.setdefault(group, config.category)
+        if config.category not in categories:
+            categories.append(config.category)
+        members.append((code, LEVEL_ACCOUNT, group))
+    members.extend((name, LEVEL_SUBCATEGORY, category) for name, category in subcategories.items())
+    members.extend((name, LEVEL_CATEGORY, None) for name in categories)
+    members.extend((name, LEVEL_SUMMARY, None) for name in SUMMARY_LINES)
+    return members
+
+
+class AccountCube:
+    """Monthly totals of every member of the account hierarchy over a run of months."""
+
+    def __init__(self, members: List[Member], first_key: int, months: int, values: Sequence[int]):
+        self.members = members
+        self.first_key = first_key
+        self.months = months
+        self.values = values  # row-major: members x months, in cents
+        self.rows = {name: row for row, (name, _, _) in enumerate(members)}
+
+    @classmethod
+    def from_matrix(cls, matrix: AccountMonthMatrix) -> "AccountCube":
+        """Roll an account x month matrix up through every level."""
+        keys = [key for row in matrix.cells.values() for key in row]
+        first_key = min(keys, default=month_key(*FIRST_MONTH))
+        last_key = max(keys, default=month_key(*LAST_MONTH))
+        months = last_key - first_key + 1
+
+        members = cube_members()
+        series: Dict[str, List[int]] = {}
+        for name, level, parent in members:
+            if level == LEVEL_ACCOUNT:
+                row = matrix.cells.get(name, {})
+                series[name] = [row.get(key, 0) for key in range(first_key, last_key + 1)]
+            elif level == LEVEL_SUMMARY:
+                series[name] = [0] * months
+                for part, sign in SUMMARY_LINES[name].items():
+                    series[name] = [x + sign * y for x, y in zip(series[name], series[part])]
+            else:
+                series.setdefault(name, [0] * months)
+            # Children come before their parents, so a member is complete when it is added up
+            if parent is not None:
+                total = series.setdefault(parent, [0] * months)
+                series[parent] = [x + y for x, y in zip(total, series[name])]
+
+        values = array("q")
+        for name, _, _ in members:
+            values.extend(series[name])
+        return cls(members, first_key, months, values)
+
+    def _member(self, name: str) -> int:
+        row = self.rows.get(name)
+        if row is None:
+            raise KeyError(f"{name!r} is not an account code, subcategory, category or summary line")
+        return row
+
+    def level(self, name: str) -> str:
+        return self.members[self._member(name)][1]
+
+    def parent(self, name: str) -> Optional[str]:
+        """The member name rolls up into (drill up), or None at the top."""
+        return self.members[self._member(name)][2]
+
+    def children(self, name: str) -> List[str]:
+        """The members that roll up into name (drill down); the parts of a summary line."""
+        self._member(name)
+        if name in SUMMARY_LINES:
+            return list(SUMMARY_LINES[name])
+        return [child for child, _, parent in self.members if parent == name]
+
+    def series(self, name: str, first: Optional[Tuple[int, int]] = None,
+               last: Optional[Tuple[int, int]] = None) -> List[int]:
+        """Monthly totals in cents of first..last inclusive (default: every month of the cube)."""
+        first_key = self.first_key if first is None else month_key(*first)
+        last_key = self.first_key + self.months - 1 if last is None else month_key(*last)
+        base = self._member(name) * self.months - self.first_key
+        # Months outside the cube have no activity
+        return [
+            self.values[base + key] if self.first_key <= key < self.first_key + self.months else 0
+            for key in range(first_key, last_key + 1)
+        ]
+
+    def total(self, name: str, first: Optional[Tuple[int, int]] = None,
+              last: Optional[Tuple[int, int]] = None) -> int:
+        """Total in cents of first..last inclusive."""
+        return sum(self.series(name, first, last))
+
+    def matrix(self) -> AccountMonthMatrix:
+        """The account level as an account x month matrix, which every report renders from."""
+        keys = range(self.first_key, self.first_key + self.months)
+        return AccountMonthMatrix({
+            code: {key: cents for key, cents in zip(keys, self.series(code)) if cents}
+            for code in PNL_ACCOUNTS
+        })
+
+
+def cube_dir(csv_file: Path) -> Path:
+    """Where the cube of a transaction file lives."""
+    return snapshot_dir(csv_file) / "cube"
+
+
+def save_cube(csv_file: Path, matrix: AccountMonthMatrix) -> AccountCube:
+    """Roll up and persist the P&L of a transaction file that has just been written."""
+    cube = AccountCube.from_matrix(matrix)
+    directory = cube_dir(csv_file)
+    directory.mkdir(parents=True, exist_ok=True)
+    meta_file = directory / "cube.json"
+    # cube.json goes last, so a cube written half way is never fresh
+    meta_file.unlink(missing_ok=True)
+
+    write_npy(directory / "values.npy", cube.values)
+    meta = {
+        "version": CUBE_VERSION,
+        "parser": parser_digest(),
+        **source_stamp(csv_file),
+        "first_month": f"{cube.first_key // 12}-{cube.first_key % 12 + 1:02d}",
+        "months": cube.months,
+        "members": [list(member) for member in cube.members],
+    }
+    with open(meta_file, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2)
+    return cube
+
+
+def _fresh_cube(csv_file: Path) -> Optional[AccountCube]:
+    """The persisted cube if it still describes csv_file and the current PNL_ACCOUNTS."""
+    directory = cube_dir(csv_file)
+    try:
+        with open(directory / "cube.json", 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        stamp = source_stamp(csv_file)
+        values = map_npy(directory / "values.npy")
+    except (OSError, ValueError):
+        return None
+    if meta.get("version") != CUBE_VERSION or meta.get("parser") != parser_digest():
+        return None
+    if any(meta.get(name) != value for name, value in stamp.items()):
+        return None
+    members = [tuple(member) for member in meta["members"]]
+    if members != cube_members() or values is None or len(values) != len(members) * meta["months"]:
+        return None
+    return AccountCube(members, month_key(*parse_month(meta["first_month"])), meta["months"], values)
+
+
+def load_cube(csv_file: Path) -> AccountCube:
+    """The cube of a transaction file, building it from the file's month partitions if needed."""
+    cube = _fresh_cube(csv_file)
+    if cube is not None:
+        return cube
+    labels = list(load_catalog(csv_file)["months"])
+    if labels:
+        matrix = load_window_matrix(csv_file, parse_month(min(labels)), parse_month(max(labels)))
+    else:
+        matrix = AccountMonthMatrix({code: {} for code in PNL_ACCOUNTS})
+    return save_cube(csv_file, matrix)
+
+
+def load_cube_window(csv_file: Path, first: Tuple[int, int], last: Tuple[int, int]) -> AccountMonthMatrix:
+    """
+    The account x month matrix a report over first..last inclusive needs.
+
+    A fresh cube answers it; without one only the window's month partitions
+    are read, and no cube is built, so a 2024 report on a file that has no
+    cube yet never touches 2025 data.
+    """
+    cube = _fresh_cube(csv_file)
+    if cube is not None:
+        return cube.matrix()
+    return load_window_matrix(csv_file, first, last)
+
+
+def member_label(name: str) -> str:
+    """Display name of a member (account codes show their account's name)."""
+    config = PNL_ACCOUNTS.get(name)
+    return config.display_name if config is not None else name
+
+
+def format_total(cents: int) -> str:
+    formatted = format_number(abs(cents)) or "0.00"
+    return f"-${formatted}" if cents < 0 else f"${formatted}"
+
+
+def resolve_source(source: str) -> Path:
+    """A pipeline step's transaction file, or source itself as a path."""
+    base_dir = Path(__file__).parent.parent
+    for step_name, input_file, _ in pipeline_step_files(base_dir):
+        if step_name == source:
+            return input_file
+    return Path(source)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Drill up and down a transaction file's P&L cube.")
+    parser.add_argument("source", help="Pipeline step (step0-step6) or transaction file")
+    parser.add_argument("member", nargs="?", help="Account code, subcategory, category or summary line "
+                                                  "(default: the categories and Net Income)")
+    parser.add_argument("--from", dest="first", type=parse_month, default=FIRST_MONTH,
+                        help="First month (default 2024-01)")
+    parser.add_argument("--to", dest="last", type=parse_month, default=LAST_MONTH,
+                        help="Last month (default 2025-11)")
+    parser.add_argument("--by-month", action="store_true", help="Also show the member's monthly totals")
+    args = parser.parse_args()
+    if month_key(*args.first) > month_key(*args.last):
+        parser.error("--from must not be after --to")
+    return args
+
+
+def main():
+    args = parse_args()
+    cube = load_cube(resolve_source(args.source))
+    try:
+        level = cube.level(args.member) if args.member is not None else None
+    except KeyError as e:
+        raise SystemExit(e.args[0])
+
+    first_year, first_month = args.first
+    last_year, last_month = args.last
+    print(f"{MONTHS[first_month - 1][:3]} {first_year} - {MONTHS[last_month - 1][:3]} {last_year}\n")
+
+    if args.member is None:
+        names = [name for name, member_level, _ in cube.members if member_level == LEVEL_CATEGORY] + ["Net Income"]
+        for name in names:
+            print(f"  {member_label(name):<45} {format_total(cube.total(name, args.first, args.last)):>16}")
+        return
+
+    path = [args.member]
+    while cube.parent(path[-1]) is not None:
+        path.append(cube.parent(path[-1]))
+    print(" > ".join(member_label(name) for name in reversed(path)) + f"  ({level})")
+    print(f"  {'Total':<45} {format_total(cube.total(args.member, args.first, args.last)):>16}")
+
+    for child in cube.children(args.member):
+        print(f"    {member_label(child):<43} {format_total(cube.total(child, args.first, args.last)):>16}")
+
+    if args.by_month:
+        print()
+        keys = range(month_key(*args.first), month_key(*args.last) + 1)
+        for key, cents in zip(keys, cube.series(args.member, args.first, args.last)):
+            print(f"  {MONTHS[key % 12][:3]} {key // 12}  {format_total(cents):>16}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Benchmark the pure-Python and NumPy P&L aggregation backends.
+
+Builds a large ledger by repeating the rows of the input export until it has
+at least --rows rows, aggregates it with both backends, checks that every
+account x month total is bit-for-bit identical, and reports the speedup.
+
+Usage: python3 benchmark_aggregation.py [--rows N] [--repeat N]
+"""
+
+import argparse
+import math
+import time
+from pathlib import Path
+
+import pnl_generator
+from ledger import load_ledger
+
+SCRIPT_DIR = Path(__file__).parent
+BASE_DIR = SCRIPT_DIR.parent
+INPUT_FILE = BASE_DIR / "input-data" / "all-txn-2024-2025.csv"
+
+
+def time_backend(backend: str, ledger, repeat: int):
+    """Best wall time over repeat runs, and the matrix from the last run."""
+    pnl_generator.AGGREGATION_BACKEND = backend
+    best = math.inf
+    matrix = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        matrix = pnl_generator.aggregate_ledger(ledger)
+        best = min(best, time.perf_counter() - start)
+    return best, matrix
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the P&L aggregation backends.")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="Minimum ledger size (default 1,000,000)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per backend; the best time is reported")
+    args = parser.parse_args()
+
+    if pnl_generator.aggregate_ledger_numpy is None:
+        raise SystemExit("NumPy is not installed - nothing to compare against")
+
+    base = load_ledger(INPUT_FILE)
+    copies = -(-args.rows // len(base))
+    ledger = base.select(list(range(len(base))) * copies)
+    print(f"Ledger: {len(ledger):,} rows ({copies} copies of {INPUT_FILE.name})")
+
+    python_time, python_matrix = time_backend("python", ledger, args.repeat)
+    numpy_time, numpy_matrix = time_backend("numpy", ledger, args.repeat)
+
+    if python_matrix.cells != numpy_matrix.cells:
+        raise SystemExit("MISMATCH: the backends produced different totals")
+
+    print(f"  python: {python_time:8.3f}s")
+    print(f"  numpy:  {numpy_time:8.3f}s")
+    print(f"  speedup: {python_time / numpy_time:.1f}x (totals identical)")
+
+
+if __name__ == "__main__":
+    main()
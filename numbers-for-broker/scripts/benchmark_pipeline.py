@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Benchmark the pipeline on synthetic exports of increasing size.
+
+For each size a synthetic export is generated (see synthetic_export.py) and
+timed end to end: loading it, every pipeline step's transform on the
+in-memory ledger, writing the final ledger with its snapshot and reading
+its P&L back from the snapshot, generate_pnl on the export, and each report
+generator. The report generators read the export's account cube, or the
+month partitions of their window when it has none (see account_cube.py
+and ledger_partitions.py), which the first of them would otherwise leave
+behind for the rest: each one is timed cold, with those cleared first,
+and then warm, reading what the cold run wrote (the "_warm" timings).
+Each timing is the best of --repeat runs. The results are written as JSON;
+with --baseline (an earlier results file) every timing is compared with its
+baseline figure and the run fails if any is more than --max-regression
+times slower (ignoring differences under MIN_REGRESSION_SECONDS, which are
+noise).
+
+Exports are kept in output/.benchmark/ and reused by later runs with the
+same size and seed. The in-memory pipeline needs a few GB at 10M rows.
+
+Usage: python3 benchmark_pipeline.py [--sizes 10k,100k,1M] [--repeat N] [--seed N]
+                                    [--output FILE] [--baseline FILE] [--max-regression R]
+"""
+
+import argparse
+import contextlib
+import importlib
+import json
+import math
+import os
+import platform
+import shutil
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+import pnl_generator
+from account_cube import cube_dir
+from ledger import load_ledger
+from ledger_partitions import partitions_dir
+from ledger_snapshot import save_ledger
+from generate_ttm_pnl import generate_ttm_pnl
+from generate_annual_pnls import generate_annual_pnl
+from generate_oct_pnls import generate_pnl_oct
+from generate_rolling_ttm import generate_rolling_ttm
+from run_pipeline import STEPS
+from synthetic_export import SYNTHETIC_DIR, format_size, generate_export, parse_size
+
+DEFAULT_SIZES = "10k,100k"
+RESULTS_FILE = SYNTHETIC_DIR / "results.json"
+
+# A timing regresses when it is this many times its baseline...
+REGRESSION_RATIO = 1.5
+# ...and at least this much slower in absolute terms
+MIN_REGRESSION_SECONDS = 0.05
+
+# (timing name, generator, report file name, extra arguments)
+REPORT_GENERATORS: List[Tuple[str, Callable, str, tuple]] = [
+    ("generate_ttm_pnl", generate_ttm_pnl, "pnl-ttm.csv", ()),
+    ("generate_annual_pnl_2024", generate_annual_pnl, "pnl-2024.csv", (2024, 12)),
+    ("generate_annual_pnl_2025", generate_annual_pnl, "pnl-2025.csv", (2025, 11)),
+    ("generate_pnl_oct", generate_pnl_oct, "pnl-oct.csv", ()),
+    ("generate_rolling_ttm", generate_rolling_ttm, "pnl-rolling-ttm.csv", ()),
+]
+
+
+def timed(timings: Dict[str, float], name: str, func: Callable, *args):
+    """Call func(*args) with its output silenced, keeping the best time under name."""
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+    timings[name] = min(timings.get(name, math.inf), elapsed)
+    return result
+
+
+def clear_report_caches(csv_file: Path) -> None:
+    """Remove the month partitions and account cube the report generators persist for a file."""
+    shutil.rmtree(partitions_dir(csv_file), ignore_errors=True)
+    shutil.rmtree(cube_dir(csv_file), ignore_errors=True)
+
+
+def benchmark_export(input_file: Path, report_dir: Path, timings: Dict[str, float]) -> None:
+    """One timed run of the pipeline steps and report generators over an export."""
+    ledger = timed(timings, "load", load_ledger, input_file)
+    for module_name, _ in STEPS:
+        step = importlib.import_module(module_name)
+        if hasattr(step, "transform"):
+            ledger = timed(timings, module_name.split("_")[0], step.transform, ledger)
+
+    # The final output with its snapshot, as the pipeline writes it, then the P&L read back from the snapshot
+    final_file = report_dir / "final.csv"
+    timed(timings, "save_ledger", save_ledger, final_file, ledger)
+    timed(timings, "generate_pnl_snapshot", pnl_generator.generate_pnl, final_file, report_dir / "pnl-final.csv")
+
+    timed(timings, "generate_pnl", pnl_generator.generate_pnl, input_file, report_dir / "pnl.csv")
+    for name, generate, report_name, extra in REPORT_GENERATORS:
+        clear_report_caches(input_file)
+        timed(timings, name, generate, input_file, report_dir / report_name, *extra)
+        timed(timings, f"{name}_warm", generate, input_file, report_dir / report_name, *extra)
+
+
+def benchmark_size(rows: int, seed: int, repeat: int) -> Dict:
+    """Generate (or reuse) the export for one size and time it."""
+    size = format_size(rows)
+    input_file = SYNTHETIC_DIR / f"synthetic-{size}-seed{seed}.csv"
+    if not input_file.exists():
+        print(f"Generating {input_file.name}...")
+        generate_export(input_file, rows, seed)
+
+    report_dir = SYNTHETIC_DIR / f"reports-{size}"
+    timings: Dict[str, float] = {}
+    for _ in range(repeat):
+        benchmark_export(input_file, report_dir, timings)
+
+    return {
+        "size": size,
+        "rows": rows,
+        "bytes": input_file.stat().st_size,
+        "timings": {name: round(seconds, 4) for name, seconds in timings.items()},
+    }
+
+
+def print_results(results: Dict) -> None:
+    names = list(results["sizes"][0]["timings"])
+    sizes = [entry["size"] for entry in results["sizes"]]
+    print(f"\n{'timing (s)':<32}" + "".join(f"{size:>10}" for size in sizes))
+    for name in names:
+        row = "".join(f"{entry['timings'].get(name, math.nan):>10.3f}" for entry in results["sizes"])
+        print(f"{name:<32}{row}")
+
+
+def find_regressions(results: Dict, baseline: Dict, max_ratio: float) -> List[str]:
+    """Describe every timing that regressed past max_ratio against the baseline."""
+    baseline_sizes = {entry["size"]: entry["timings"] for entry in baseline.get("sizes", [])}
+    regressions = []
+    for entry in results["sizes"]:
+        before = baseline_sizes.get(entry["size"])
+        if before is None:
+            continue
+        for name, seconds in entry["timings"].items():
+            if name not in before:
+                continue
+            limit = before[name] * max_ratio
+            if seconds > limit and seconds - before[name] >= MIN_REGRESSION_SECONDS:
+                regressions.append(
+                    f"{entry['size']} {name}: {seconds:.3f}s vs baseline {before[name]:.3f}s "
+                    f"({seconds / before[name]:.2f}x, limit {max_ratio:.2f}x)"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline on synthetic exports.")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help=f"Comma-separated export sizes (default {DEFAULT_SIZES})")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per size; the best time is kept (default 1)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the synthetic exports (default 0)")
+    parser.add_argument("--output", type=Path, default=RESULTS_FILE, help="Results JSON file")
+    parser.add_argument("--baseline", type=Path, help="Earlier results JSON to check for regressions against")
+    parser.add_argument(
+        "--max-regression", type=float, default=REGRESSION_RATIO,
+        help=f"Fail if a timing exceeds this multiple of its baseline (default {REGRESSION_RATIO})",
+    )
+    args = parser.parse_args()
+
+    results = {
+        "python": platform.python_version(),
+        "numpy": pnl_generator.aggregate_ledger_numpy is not None,
+        "backend": pnl_generator.AGGREGATION_BACKEND,
+        "seed": args.seed,
+        "repeat": args.repeat,
+        "sizes": [],
+    }
+    for size in args.sizes.split(","):
+        rows = parse_size(size.strip())
+        print(f"Benchmarking {format_size(rows)} rows...")
+        results["sizes"].append(benchmark_size(rows, args.seed, args.repeat))
+
+    print_results(results)
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+        f.write('\n')
+    print(f"\nResults written to: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = find_regressions(results, baseline, args.max_regression)
+        if regressions:
+            print(f"\nREGRESSIONS against {args.baseline}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            raise SystemExit(1)
+        print(f"No regressions against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
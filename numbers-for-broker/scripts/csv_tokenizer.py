@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+CSV Tokenizer Module
+
+Shared line tokenizer for the QuickBooks export and the reference CSVs.
+
+The exports are tokenized with simple quote toggling rather than RFC 4180
+rules: a double quote flips "inside quotes" and is dropped, commas only
+split fields outside quotes, and every field is whitespace-stripped. So
+'"1,234.56"' gives '1234.56'-style text without the quotes, and a doubled
+quote ("") simply disappears. The stdlib csv reader handles those cases
+differently, so the fast path below works on str.split instead: splitting
+on '"' gives alternating outside/inside runs, and only the outside runs
+are split on ','.
+
+tests/test_csv_tokenizer.py checks the fast path against the original
+character-by-character tokenizer on edge cases and on every line of the
+input and reference files.
+"""
+
+from typing import List
+
+
+def parse_csv_line(line: str) -> List[str]:
+    """Parse a CSV line handling quoted fields."""
+    if '"' not in line:
+        return [field.strip() for field in line.split(',')]
+
+    result = []
+    current = []
+    for i, run in enumerate(line.split('"')):
+        if i % 2:
+            # Inside quotes: commas are literal
+            current.append(run)
+            continue
+        parts = run.split(',')
+        current.append(parts[0])
+        if len(parts) > 1:
+            result.append(''.join(current).strip())
+            result.extend(part.strip() for part in parts[1:-1])
+            current = [parts[-1]]
+    result.append(''.join(current).strip())
+    return result
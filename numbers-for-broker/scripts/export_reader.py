@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Export Reader Module
+
+Memory-mapped reader that aggregates a transaction export straight into the
+P&L account x month cells, for exports that have no snapshot.
+
+The export is memory-mapped and scanned as bytes. One regex pass over the
+mapping finds the section headers and Total lines (SECTION_OR_TOTAL_RE
+from section_index.py), and only the rows of P&L account sections are
+walked. Each of their transaction lines is sliced out of the mapping and
+split with bytes.split, toggling on quotes the way csv_tokenizer does only
+when the line has any. Nothing but the date and amount is decoded, and
+dates go through a cache keyed by the raw bytes, so each distinct date is
+decoded once. No line string, field list of strings or ledger column is
+ever built.
+
+The cells are the same as aggregating a loaded ledger gives. Run this
+module directly to check that on the input export and every step output.
+
+Usage: python3 export_reader.py
+"""
+
+import mmap
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from ledger import DATES, parse_cents
+from section_index import SECTION_OR_TOTAL_RE
+
+SCRIPT_DIR = Path(__file__).parent
+BASE_DIR = SCRIPT_DIR.parent
+
+COMMA = ord(',')
+# Export columns (after the leading empty column), as in ledger.py
+DATE_FIELD = 1
+AMOUNT_FIELD = 8
+
+
+def split_fields(line: bytes, count: int) -> List[bytes]:
+    """
+    Split a line into fields the way csv_tokenizer does, quotes dropped.
+
+    Only the first count separators are split at when the line has no
+    quotes, so the last field then holds the rest of the line.
+    """
+    if b'"' not in line:
+        return line.split(b',', count)
+    # Quotes toggle: commas in every other run are literal
+    fields = [b'']
+    for index, run in enumerate(line.split(b'"')):
+        if index % 2:
+            fields[-1] += run
+            continue
+        pieces = run.split(b',')
+        fields[-1] += pieces[0]
+        fields.extend(pieces[1:])
+    return fields
+
+
+def aggregate_export(input_file: Path, account_codes: Iterable[str]) -> Dict[str, Dict[int, int]]:
+    """Sum an export's P&L transactions into account code -> month key -> total in cents."""
+    cells: Dict[str, Dict[int, int]] = {code: {} for code in account_codes}
+    cells_by_code = {int(code): row_cells for code, row_cells in cells.items()}
+
+    with open(input_file, 'rb') as f:
+        if not f.seek(0, 2):
+            return cells
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    # Raw date field bytes -> month key, None for anything that is not a date
+    month_by_date: Dict[bytes, Optional[int]] = {}
+    try:
+        # A section's rows run from its header line up to its Total line or the next header
+        open_section = None
+        for match in SECTION_OR_TOTAL_RE.finditer(mapped):
+            if open_section is not None:
+                code, start = open_section
+                _add_section_rows(mapped, start, match.start(), cells_by_code[code], month_by_date)
+            open_section = None
+            code = match.group(1)
+            if code is not None and int(code) in cells_by_code:
+                header_end = mapped.find(b'\n', match.end())
+                if header_end != -1:
+                    open_section = (int(code), header_end + 1)
+        if open_section is not None:
+            code, start = open_section
+            _add_section_rows(mapped, start, len(mapped), cells_by_code[code], month_by_date)
+    finally:
+        mapped.close()
+    return cells
+
+
+def _add_section_rows(
+    mapped: mmap.mmap,
+    start: int,
+    end: int,
+    row_cells: Dict[int, int],
+    month_by_date: Dict[bytes, Optional[int]],
+) -> None:
+    """Add the transaction lines in mapped[start:end] to one account's cells."""
+    position = start
+    while position < end:
+        line_end = mapped.find(b'\n', position, end)
+        if line_end == -1:
+            line_end = end
+        line_start = position
+        position = line_end + 1
+
+        # Transaction lines start with "," and have the amount as their ninth field
+        if mapped[line_start] != COMMA:
+            continue
+        fields = split_fields(mapped[line_start:line_end], AMOUNT_FIELD + 1)
+        if len(fields) <= AMOUNT_FIELD:
+            continue
+
+        date_field = fields[DATE_FIELD]
+        key = month_by_date.get(date_field, -1)
+        if key == -1:
+            ordinal = DATES.ordinal(date_field.decode('utf-8').strip())
+            key = DATES.by_ordinal[ordinal].month_index if ordinal else None
+            month_by_date[date_field] = key
+        if key is None:
+            continue
+
+        cents = parse_cents(fields[AMOUNT_FIELD].decode('utf-8').strip())
+        row_cells[key] = row_cells.get(key, 0) + cents
+
+
+def check_against_ledger() -> int:
+    """Compare aggregate_export with aggregating the loaded ledger; return the mismatch count."""
+    from pnl_generator import PNL_ACCOUNTS, aggregate_ledger, pipeline_step_files
+    from ledger import load_ledger
+
+    mismatches = 0
+    for step_name, input_file, _ in pipeline_step_files(BASE_DIR):
+        if not input_file.exists():
+            continue
+        expected = aggregate_ledger(load_ledger(input_file)).cells
+        actual = aggregate_export(input_file, PNL_ACCOUNTS)
+        status = "ok" if actual == expected else "MISMATCH"
+        mismatches += actual != expected
+        print(f"  {step_name}: {input_file.name} {status}")
+    return mismatches
+
+
+if __name__ == "__main__":
+    raise SystemExit(1 if check_against_ledger() else 0)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Generate every P&L report family for each pipeline step in one pass.
+
+Each step's account x month matrix is read from the step file's account
+cube (see account_cube.py) once; all period views are sliced from it:
+- pnl_stepN.csv:  January 2024 - November 2025 (full range)
+- pnl-ttm-nov/:   December 2024 - November 2025 (TTM)
+- pnl-2024/:      January 2024 - December 2024
+- pnl-2025-ytd/:  January 2025 - November 2025
+- pnl-thru-oct/:  January 2024 - October 2025
+- pnl-rolling-ttm/: TTM as of every month-end, December 2024 - November 2025
+
+Usage: python3 generate_reports.py [--workers N]
+"""
+
+import argparse
+from functools import partial
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+from account_cube import load_cube
+from pnl_generator import AccountMonthMatrix, render_pnl_full, pipeline_step_files
+from generate_ttm_pnl import render_ttm_pnl
+from generate_annual_pnls import render_annual_pnl
+from generate_oct_pnls import render_pnl_oct
+from generate_rolling_ttm import render_rolling_ttm
+from parallel_reports import add_workers_argument, exit_if_failed, print_step_outcomes, run_step_tasks
+
+# (output subdirectory, renderer); "" is the output directory itself
+REPORT_FAMILIES: List[Tuple[str, Callable[[AccountMonthMatrix, Path], object]]] = [
+    ("", lambda matrix, output_file: render_pnl_full(matrix, output_file, silent=True)),
+    ("pnl-ttm-nov", lambda matrix, output_file: render_ttm_pnl(matrix, output_file, silent=True)),
+    ("pnl-2024", lambda matrix, output_file: render_annual_pnl(matrix, output_file, year=2024, end_month=12, silent=True)),
+    ("pnl-2025-ytd", lambda matrix, output_file: render_annual_pnl(matrix, output_file, year=2025, end_month=11, silent=True)),
+    ("pnl-thru-oct", lambda matrix, output_file: render_pnl_oct(matrix, output_file, silent=True)),
+    ("pnl-rolling-ttm", lambda matrix, output_file: render_rolling_ttm(matrix, output_file, silent=True)),
+]
+
+
+def render_step_reports(
+    matrix: AccountMonthMatrix, step_name: str, output_dir: Path, silent: bool = False
+) -> List[Tuple[str, Dict[str, float]]]:
+    """Render every report family for one step from its matrix; returns (label, summary) per family."""
+    summaries = []
+    for subdir, render in REPORT_FAMILIES:
+        output_file = output_dir / subdir / f"pnl_{step_name}.csv"
+        summaries.append((subdir or "full range", render(matrix, output_file)))
+    if not silent:
+        print_report_summaries(summaries)
+    return summaries
+
+
+def print_report_summaries(summaries: List[Tuple[str, Dict[str, float]]]) -> None:
+    for label, summary in summaries:
+        print(f"  {label:<14} Net Income: ${summary['net_income']:,.2f}")
+
+
+def step_reports(output_dir: Path, step_name: str, input_file: Path) -> List[Tuple[str, Dict[str, float]]]:
+    """Worker task: render every report family for one step silently."""
+    return render_step_reports(load_cube(input_file).matrix(), step_name, output_dir, silent=True)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Generate every P&L report family for each pipeline step.")
+    add_workers_argument(parser)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    print("=" * 80)
+    print("GENERATING ALL P&L REPORTS")
+    print("=" * 80)
+
+    script_dir = Path(__file__).parent
+    base_dir = script_dir.parent
+    output_dir = base_dir / "output"
+
+    print(f"\nOutput directory: {output_dir}\n")
+
+    steps = pipeline_step_files(base_dir)
+    outcomes = run_step_tasks(partial(step_reports, output_dir), steps, args.workers)
+    print_step_outcomes(steps, outcomes, print_report_summaries)
+
+    print(f"\n{'=' * 80}")
+    print(f"All P&L reports generated in: {output_dir}")
+    print("=" * 80)
+
+    exit_if_failed(outcomes)
+
+
+if __name__ == "__main__":
+    main()
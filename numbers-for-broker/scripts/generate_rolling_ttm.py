@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Generate rolling TTM (Trailing Twelve Months) P&L reports.
+
+Each column is the twelve months to one month-end, from December 2024
+(the first month-end with twelve months of data) to November 2025, so
+every account, Gross Profit and Net Income can be read as of any of
+them. The totals come from a prefix-sum period engine (period_engine.py).
+
+Usage: python3 generate_rolling_ttm.py [--from YYYY-MM] [--to YYYY-MM] [--workers N]
+"""
+
+import argparse
+from functools import partial
+from pathlib import Path
+from typing import Dict, Tuple
+
+from account_cube import load_cube_window
+from period_engine import PeriodEngine
+from pnl_generator import (
+    AccountMonthMatrix, LAST_MONTH, MONTHS, month_end_description, month_key, parse_month, render_pnl,
+    pipeline_step_files,
+)
+from parallel_reports import (
+    add_workers_argument, exit_if_failed, print_generated, print_step_outcomes, run_step_tasks,
+)
+
+TTM_LENGTH = 12
+
+# TTM as of every month-end from Dec 2024 to Nov 2025
+ROLLING_FIRST_AS_OF = (2024, 12)
+ROLLING_LAST_AS_OF = LAST_MONTH
+
+
+def months_before(month: Tuple[int, int], count: int) -> Tuple[int, int]:
+    """The (year, month) count months before month."""
+    key = month_key(*month) - count
+    return key // 12, key % 12 + 1
+
+
+def render_rolling_ttm(
+    matrix: AccountMonthMatrix,
+    output_file: Path,
+    first_as_of: Tuple[int, int] = ROLLING_FIRST_AS_OF,
+    last_as_of: Tuple[int, int] = ROLLING_LAST_AS_OF,
+    silent: bool = False,
+) -> Dict[str, float]:
+    """
+    Render the rolling TTM P&L from an account x month matrix.
+
+    The summary is the TTM as of the last month-end.
+    """
+    engine = PeriodEngine(matrix, months_before(first_as_of, TTM_LENGTH - 1), last_as_of)
+    columns = [
+        f"TTM {MONTHS[key % 12][:3]} {key // 12}"
+        for key in range(month_key(*first_as_of), month_key(*last_as_of) + 1)
+    ]
+    summary = render_pnl(
+        engine.rolling(first_as_of, last_as_of, TTM_LENGTH),
+        columns,
+        "Profit and Loss - Rolling TTM (Trailing Twelve Months)",
+        f"Twelve months ending {month_end_description(*first_as_of)} - {month_end_description(*last_as_of)}",
+        output_file,
+        total_column=False,
+    )
+
+    if not silent:
+        print(f"  Generated: {output_file.name} (TTM Net Income as of {columns[-1][4:]}: ${summary['net_income']:,.2f})")
+
+    return summary
+
+
+def generate_rolling_ttm(
+    input_file: Path,
+    output_file: Path,
+    first_as_of: Tuple[int, int] = ROLLING_FIRST_AS_OF,
+    last_as_of: Tuple[int, int] = ROLLING_LAST_AS_OF,
+    silent: bool = False,
+) -> Dict[str, float]:
+    """
+    Generate the rolling TTM P&L from transaction data.
+
+    The totals come from the file's account cube, or when it has none
+    from the month partitions the twelve months to each month-end span alone.
+    """
+    matrix = load_cube_window(input_file, months_before(first_as_of, TTM_LENGTH - 1), last_as_of)
+    return render_rolling_ttm(matrix, output_file, first_as_of, last_as_of, silent)
+
+
+def rolling_step_report(
+    output_dir: Path, first_as_of: Tuple[int, int], last_as_of: Tuple[int, int], step_name: str, input_file: Path
+) -> Tuple[str, Dict[str, float]]:
+    """Worker task: generate one step's report silently."""
+    output_file = output_dir / f"pnl_{step_name}.csv"
+    return output_file.name, generate_rolling_ttm(input_file, output_file, first_as_of, last_as_of, silent=True)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Generate the rolling TTM P&L report for each pipeline step.")
+    parser.add_argument("--from", dest="first_as_of", type=parse_month, default=ROLLING_FIRST_AS_OF,
+                        help="First month-end to show the TTM as of (default 2024-12)")
+    parser.add_argument("--to", dest="last_as_of", type=parse_month, default=ROLLING_LAST_AS_OF,
+                        help="Last month-end to show the TTM as of (default 2025-11)")
+    add_workers_argument(parser)
+    args = parser.parse_args()
+    if month_key(*args.first_as_of) > month_key(*args.last_as_of):
+        parser.error("--from must not be after --to")
+    return args
+
+
+def main():
+    args = parse_args()
+
+    print("=" * 80)
+    print("GENERATING ROLLING TTM P&L REPORTS")
+    print("=" * 80)
+
+    script_dir = Path(__file__).parent
+    base_dir = script_dir.parent
+    output_dir = base_dir / "output" / "pnl-rolling-ttm"
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    steps = pipeline_step_files(base_dir)
+
+    print(f"\nOutput directory: {output_dir}\n")
+
+    task = partial(rolling_step_report, output_dir, args.first_as_of, args.last_as_of)
+    outcomes = run_step_tasks(task, steps, args.workers)
+    print_step_outcomes(steps, outcomes, print_generated)
+
+    print(f"\n{'=' * 80}")
+    print(f"All rolling TTM P&L reports generated in: {output_dir}")
+    print("=" * 80)
+
+    exit_if_failed(outcomes)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,528 @@
+#!/usr/bin/env python3
+"""
+Ledger Module
+
+Columnar in-memory model of the QuickBooks "Transaction Detail by Account"
+export. Every line of the export is one row; the typed fields each step needs
+(line kind, account section, date, amount, name/memo/type/class) are parsed
+once at load time and stored as parallel array-backed columns, so the steps
+and the P&L generator never re-tokenize or regex-match a line.
+
+Dates are stored as ordinals; their parts, month index and text come from
+the shared date table (DATES), which parses each distinct date only once.
+
+Amounts are held as integer cents, so sums are exact; they only become
+decimal strings again when a report or a new line is written.
+
+The raw text of every row is kept as well, which lets the serializer
+reproduce the export layout byte for byte.
+
+A ledger can also keep a change journal (PostingDelta): while one is
+attached, every row that stops or starts posting to an account month is
+recorded as it happens, so a step's effect on the P&L is known without
+aggregating its output again.
+"""
+
+import re
+from array import array
+from bisect import bisect_right
+from datetime import date
+from decimal import Decimal, InvalidOperation
+from operator import itemgetter
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from csv_tokenizer import parse_csv_line
+
+
+# Row kinds
+LINE_OTHER = 0      # report header, blank line, footer, memo continuation
+LINE_SECTION = 1    # account section header, e.g. "6120 Affiliate Marketing Expense,,,,,,,,,"
+LINE_TOTAL = 2      # "Total for ..." line closing a section
+LINE_FRAGMENT = 3   # starts with "," but has fewer than 9 fields (first half of a multi-line memo)
+LINE_TXN = 4        # transaction line
+
+NO_ACCOUNT = -1
+
+SECTION_KIND_BYTE = bytes([LINE_SECTION])
+
+SECTION_RE = re.compile(r'^(\d{4})\s+[^,]*,,,,,,,,,')
+DATE_RE = re.compile(r'^(\d{2})/(\d{2})/(\d{4})$')
+AMOUNT_RE = re.compile(r'^(-?)(\d*)(?:\.(\d{1,2}))?$')
+AMOUNT_JUNK = str.maketrans("", "", '"$,')
+
+# Export columns (after the leading empty column)
+COL_DATE = 1
+COL_TYPE = 2
+COL_NAME = 4
+COL_CLASS = 5
+COL_MEMO = 6
+COL_AMOUNT = 8
+
+
+def parse_cents(amount_str: str) -> int:
+    """Parse an amount string such as '"-1,234.56"' or '$12.5' to whole cents."""
+    cleaned = amount_str.translate(AMOUNT_JUNK).strip()
+    if not cleaned:
+        return 0
+    match = AMOUNT_RE.match(cleaned)
+    if match and (match.group(2) or match.group(3)):
+        cents = int(match.group(2) or 0) * 100 + int((match.group(3) or "0").ljust(2, "0"))
+        return -cents if match.group(1) else cents
+    # Anything unusual (exponents, more than two decimals) goes through Decimal
+    try:
+        return round(Decimal(cleaned) * 100)
+    except (InvalidOperation, OverflowError, ValueError):
+        return 0
+
+
+def format_cents(cents: int, grouped: bool = False) -> str:
+    """Format whole cents as a decimal amount, e.g. -123456 -> '-1234.56' ('-1,234.56' if grouped)."""
+    dollars, remainder = divmod(abs(cents), 100)
+    sign = "-" if cents < 0 else ""
+    if grouped:
+        return f"{sign}{dollars:,}.{remainder:02d}"
+    return f"{sign}{dollars}.{remainder:02d}"
+
+
+class DateInfo(NamedTuple):
+    """One date of the date table."""
+    ordinal: int
+    year: int
+    month: int         # 1-12
+    day: int
+    month_index: int   # year * 12 + month - 1, the month key of the P&L matrix
+    text: str          # MM/DD/YYYY
+
+
+class _DatesByOrdinal(dict):
+    """ordinal -> DateInfo, filling in each ordinal the first time it is looked up."""
+
+    def __missing__(self, ordinal: int) -> DateInfo:
+        d = date.fromordinal(ordinal)
+        info = DateInfo(ordinal, d.year, d.month, d.day, d.year * 12 + d.month - 1, d.strftime("%m/%d/%Y"))
+        self[ordinal] = info
+        return info
+
+
+class DateTable:
+    """
+    Interned dates shared by every ledger, step and report in the process.
+
+    An export only holds a few hundred distinct dates, so each date string
+    is parsed and each ordinal broken into its parts once; every later row
+    with that date is a dict lookup.
+    """
+
+    def __init__(self):
+        self.ordinals: Dict[str, int] = {}  # date text -> ordinal, 0 if not a date
+        self.by_ordinal: Dict[int, DateInfo] = _DatesByOrdinal()
+
+    def ordinal(self, date_str: str) -> int:
+        """Ordinal of a MM/DD/YYYY date string, or 0 if invalid."""
+        ordinal = self.ordinals.get(date_str)
+        if ordinal is None:
+            ordinal = self.ordinals[date_str] = _parse_date_text(date_str)
+        return ordinal
+
+    def info(self, ordinal: int) -> DateInfo:
+        return self.by_ordinal[ordinal]
+
+
+def _parse_date_text(date_str: str) -> int:
+    match = DATE_RE.match(date_str)
+    if not match:
+        return 0
+    try:
+        return date(int(match.group(3)), int(match.group(1)), int(match.group(2))).toordinal()
+    except ValueError:
+        return 0
+
+
+DATES = DateTable()
+
+
+def parse_date_ordinal(date_str: str) -> int:
+    """Parse MM/DD/YYYY date string to a proleptic ordinal, or 0 if invalid."""
+    return DATES.ordinal(date_str)
+
+
+def date_parts(ordinal: int) -> Tuple[int, int, int]:
+    """Return (year, month, day) for a date ordinal, month 1-12."""
+    info = DATES.by_ordinal[ordinal]
+    return info.year, info.month, info.day
+
+
+def format_ordinal(ordinal: int) -> str:
+    """Format a date ordinal as MM/DD/YYYY."""
+    return DATES.by_ordinal[ordinal].text
+
+
+def read_lines(input_file: Path) -> List[str]:
+    """Read a transaction export into a list of raw lines."""
+    with open(input_file, 'r', encoding='utf-8') as f:
+        content = f.read()
+    return content.split('\n')
+
+
+def write_lines(output_file: Path, lines: List[str]) -> None:
+    """Write raw lines back out in the export layout."""
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_file, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines))
+
+
+class StringPool:
+    """Dictionary encoding for repeated string fields."""
+
+    def __init__(self):
+        self.strings: List[str] = [""]
+        self._ids: Dict[str, int] = {"": 0}
+
+    @classmethod
+    def from_strings(cls, strings: List[str]) -> "StringPool":
+        """Rebuild a pool from its strings list, keeping every string's id."""
+        pool = cls()
+        pool.strings = list(strings)
+        pool._ids = {s: string_id for string_id, s in enumerate(pool.strings)}
+        return pool
+
+    def intern(self, s: str) -> int:
+        string_id = self._ids.get(s)
+        if string_id is None:
+            string_id = len(self.strings)
+            self._ids[s] = string_id
+            self.strings.append(s)
+        return string_id
+
+
+def _gather(column: array, rows: List[int]) -> array:
+    """Build a new column holding column[r] for each r in rows."""
+    if not rows:
+        return array(column.typecode)
+    if len(rows) == 1:
+        return array(column.typecode, [column[rows[0]]])
+    return array(column.typecode, itemgetter(*rows)(column))
+
+
+# Rows compared at a time when looking for rows whose section changed
+CHANGE_SCAN_BLOCK = 1024
+
+
+class PostingDelta:
+    """
+    The postings a step added and removed, as (account code, month index, cents).
+
+    A posting is a dated transaction row inside an account section, i.e. a
+    row the P&L aggregation counts if the account is a P&L account. A row
+    that changes section or date is one removed and one added posting.
+    """
+
+    def __init__(self):
+        self.added: List[Tuple[int, int, int]] = []
+        self.removed: List[Tuple[int, int, int]] = []
+
+    @staticmethod
+    def posting(ledger: "Ledger", row: int) -> Optional[Tuple[int, int, int]]:
+        """The row's posting, None if it does not post."""
+        ordinal = ledger.date[row]
+        if ledger.kind[row] != LINE_TXN or not ledger.in_section[row] or not ordinal:
+            return None
+        return ledger.account[row], DATES.by_ordinal[ordinal].month_index, ledger.amount[row]
+
+    def add(self, ledger: "Ledger", row: int) -> None:
+        posting = self.posting(ledger, row)
+        if posting is not None:
+            self.added.append(posting)
+
+    def remove(self, ledger: "Ledger", row: int) -> None:
+        posting = self.posting(ledger, row)
+        if posting is not None:
+            self.removed.append(posting)
+
+    def net(self) -> Dict[Tuple[int, int], int]:
+        """(account code, month index) -> net change in cents, for the cells that changed."""
+        net: Dict[Tuple[int, int], int] = {}
+        for account, month, cents in self.added:
+            net[account, month] = net.get((account, month), 0) + cents
+        for account, month, cents in self.removed:
+            net[account, month] = net.get((account, month), 0) - cents
+        return {cell: cents for cell, cents in net.items() if cents}
+
+
+def _changed_rows(before: array, after: array) -> Iterable[int]:
+    """Positions where two equally long columns differ, comparing whole blocks first."""
+    for start in range(0, len(after), CHANGE_SCAN_BLOCK):
+        end = start + CHANGE_SCAN_BLOCK
+        if before[start:end] != after[start:end]:
+            yield from (row for row in range(start, min(end, len(after))) if before[row] != after[row])
+
+
+class Ledger:
+    """
+    Parallel columns for every line of a transaction export.
+
+    Columns (one entry per row):
+        kind       LINE_* constant
+        account    account code of the section the row sits in (NO_ACCOUNT before
+                   the first section); for section headers, the header's own code
+        in_section 1 between a section header and its "Total for" line
+        date       date ordinal of the transaction date, 0 if none
+        amount     transaction amount in cents
+        txn_type, name, txn_class, memo
+                   ids into the shared string pool
+        raw        the original line text
+
+    changes, when set, is the PostingDelta that select() and set_date()
+    record into; ledgers built by select() share it.
+
+    A ledger loaded from a snapshot for aggregation only (see
+    ledger_snapshot.py) has read-only memoryview columns and no raw lines.
+    """
+
+    def __init__(self, pool: Optional[StringPool] = None):
+        self.pool = pool if pool is not None else StringPool()
+        # Section context in effect before the first row; set when the ledger
+        # is one chunk of a longer export (see streaming.py)
+        self.start_account = NO_ACCOUNT
+        self.start_in_section = 0
+        self.kind = array('b')
+        self.account = array('h')
+        self.in_section = array('b')
+        self.date = array('i')
+        self.amount = array('q')
+        self.txn_type = array('i')
+        self.name = array('i')
+        self.txn_class = array('i')
+        self.memo = array('i')
+        self.raw: List[str] = []
+        self.changes: Optional[PostingDelta] = None
+
+    @classmethod
+    def from_lines(cls, lines: Iterable[str], start_context: Tuple[int, int] = (NO_ACCOUNT, 0)) -> "Ledger":
+        """Build a ledger from raw export lines, optionally continuing a section context."""
+        ledger = cls()
+        ledger.start_account, ledger.start_in_section = start_context
+        for line in lines:
+            ledger.append_line(line)
+        ledger._rebuild_context()
+        return ledger
+
+    def __len__(self) -> int:
+        return len(self.kind)
+
+    def append_line(self, line: str) -> int:
+        """
+        Parse a raw line into a new row and return its index.
+
+        The row's section context is only assigned once the ledger is
+        re-ordered with select(), so appended rows are normally passed to
+        select() together with the rows they should sit between.
+        """
+        pool = self.pool
+        trimmed = line.strip()
+        kind = LINE_OTHER
+        account = NO_ACCOUNT
+        txn_date = 0
+        amount = 0
+        txn_type = name = txn_class = memo = 0
+
+        section_match = SECTION_RE.match(trimmed)
+        if section_match:
+            kind = LINE_SECTION
+            account = int(section_match.group(1))
+        elif trimmed.startswith("Total for "):
+            kind = LINE_TOTAL
+        elif line.startswith(","):
+            fields = parse_csv_line(line)
+            txn_date = DATES.ordinal(fields[COL_DATE]) if len(fields) > COL_DATE else 0
+            if len(fields) > COL_AMOUNT:
+                kind = LINE_TXN
+                amount = parse_cents(fields[COL_AMOUNT])
+                txn_type = pool.intern(fields[COL_TYPE])
+                name = pool.intern(fields[COL_NAME])
+                txn_class = pool.intern(fields[COL_CLASS])
+                memo = pool.intern(fields[COL_MEMO])
+            else:
+                kind = LINE_FRAGMENT
+
+        self.kind.append(kind)
+        self.account.append(account)
+        self.in_section.append(0)
+        self.date.append(txn_date)
+        self.amount.append(amount)
+        self.txn_type.append(txn_type)
+        self.name.append(name)
+        self.txn_class.append(txn_class)
+        self.memo.append(memo)
+        self.raw.append(line)
+        return len(self.raw) - 1
+
+    def _rebuild_context(self) -> None:
+        """Assign every row the section it falls under, from the header rows."""
+        kind = self.kind
+        account = self.account
+        in_section = self.in_section
+        current = self.start_account
+        inside = self.start_in_section
+        for row in range(len(kind)):
+            row_kind = kind[row]
+            if row_kind == LINE_SECTION:
+                current = account[row]
+                inside = 1
+            elif row_kind == LINE_TOTAL:
+                inside = 0
+            account[row] = current
+            in_section[row] = inside
+
+    def select(self, rows: List[int]) -> "Ledger":
+        """Return a new ledger holding the given rows in the given order."""
+        selected = Ledger(self.pool)
+        selected.start_account = self.start_account
+        selected.start_in_section = self.start_in_section
+        selected.kind = _gather(self.kind, rows)
+        selected.account = _gather(self.account, rows)
+        selected.in_section = array('b', bytes(len(rows)))
+        selected.date = _gather(self.date, rows)
+        selected.amount = _gather(self.amount, rows)
+        selected.txn_type = _gather(self.txn_type, rows)
+        selected.name = _gather(self.name, rows)
+        selected.txn_class = _gather(self.txn_class, rows)
+        selected.memo = _gather(self.memo, rows)
+        selected.raw = [self.raw[row] for row in rows]
+        if self.changes is None:
+            selected._rebuild_context()
+            return selected
+
+        # Rows keep their kind, date and amount; only their section can change
+        before_account = array(selected.account.typecode, selected.account)
+        before_in_section = _gather(self.in_section, rows)
+        selected._rebuild_context()
+        selected.changes = changes = self.changes
+        for row in sorted(set(range(len(self))).difference(rows)):
+            changes.remove(self, row)
+        moved = set(_changed_rows(before_account, selected.account))
+        moved.update(_changed_rows(before_in_section, selected.in_section))
+        for row in sorted(moved):
+            changes.remove(self, rows[row])
+            changes.add(selected, row)
+        return selected
+
+    def section_ranges(self) -> Dict[int, List[Tuple[int, int]]]:
+        """
+        Account code -> the [start, end) row ranges that sit in that account's section.
+
+        A range runs from a section header up to the next one, so it covers
+        exactly the rows whose account column holds the code (the Total line
+        included). Headers are found by searching the kind column's bytes,
+        so no row is visited in Python.
+        """
+        kinds = bytes(self.kind)
+        headers = []
+        pos = kinds.find(SECTION_KIND_BYTE)
+        while pos != -1:
+            headers.append(pos)
+            pos = kinds.find(SECTION_KIND_BYTE, pos + 1)
+
+        ranges: Dict[int, List[Tuple[int, int]]] = {}
+        first_header = headers[0] if headers else len(kinds)
+        # A chunk of a longer export can start inside a section
+        if first_header and self.start_account != NO_ACCOUNT:
+            ranges[self.start_account] = [(0, first_header)]
+        for start, end in zip(headers, headers[1:] + [len(kinds)]):
+            ranges.setdefault(self.account[start], []).append((start, end))
+        return ranges
+
+    def splice(self, removed: List[int], insert_after: Optional[int] = None, lines: Iterable[str] = ()) -> "Ledger":
+        """
+        Return a new ledger without the removed rows, with lines added after row insert_after.
+
+        removed must be in ascending order. Nothing is added when
+        insert_after is None.
+        """
+        rows = []
+        start = 0
+        for row in removed:
+            rows.extend(range(start, row))
+            start = row + 1
+        rows.extend(range(start, len(self)))
+        if insert_after is not None:
+            position = bisect_right(rows, insert_after)
+            rows[position:position] = [self.append_line(line) for line in lines]
+        return self.select(rows)
+
+    def end_context(self) -> Tuple[int, int]:
+        """(account, in_section) in effect after the last row."""
+        if not self.raw:
+            return self.start_account, self.start_in_section
+        return self.account[-1], self.in_section[-1]
+
+    def section_code(self, row: int) -> str:
+        """Account code of the row's section as a string, "" if none."""
+        code = self.account[row]
+        return "" if code == NO_ACCOUNT else str(code)
+
+    def date_str(self, row: int) -> str:
+        """Transaction date as MM/DD/YYYY, "" if the row has none."""
+        ordinal = self.date[row]
+        return format_ordinal(ordinal) if ordinal else ""
+
+    def string(self, column: array, row: int) -> str:
+        """Decode a dictionary-encoded field, e.g. ledger.string(ledger.memo, row)."""
+        return self.pool.strings[column[row]]
+
+    def set_date(self, row: int, ordinal: int) -> None:
+        """Change a transaction's date, rewriting its line the same way."""
+        old_str = self.date_str(row)
+        new_str = format_ordinal(ordinal)
+        self.raw[row] = self.raw[row].replace(f",{old_str},", f",{new_str},", 1)
+        if self.changes is not None:
+            self.changes.remove(self, row)
+        self.date[row] = ordinal
+        if self.changes is not None:
+            self.changes.add(self, row)
+
+    def set_dates(self, rows: Sequence[int], ordinals: Sequence[int]) -> None:
+        """
+        Change the dates of many transactions at once, rewriting their lines the same way.
+
+        A transaction line starts with its date field, so the line is
+        respliced after the old date instead of searched for it; the moved
+        postings are recorded in the same pass.
+        """
+        changes = self.changes
+        raw = self.raw
+        date = self.date
+        kind = self.kind
+        in_section = self.in_section
+        by_ordinal = DATES.by_ordinal
+        for row, ordinal in zip(rows, ordinals):
+            old = date[row]
+            old_str = by_ordinal[old].text if old else ""
+            new_str = by_ordinal[ordinal].text
+            line = raw[row]
+            end = len(old_str) + 1
+            if line[:1] == "," and line.startswith(old_str, 1) and line[end:end + 1] == ",":
+                raw[row] = f",{new_str}{line[end:]}"
+            else:
+                raw[row] = line.replace(f",{old_str},", f",{new_str},", 1)
+            date[row] = ordinal
+            if changes is not None and kind[row] == LINE_TXN and in_section[row]:
+                account, cents = self.account[row], self.amount[row]
+                if old:
+                    changes.removed.append((account, by_ordinal[old].month_index, cents))
+                changes.added.append((account, by_ordinal[ordinal].month_index, cents))
+
+    def to_lines(self) -> List[str]:
+        """Serialize back to raw export lines."""
+        return list(self.raw)
+
+
+def load_ledger(input_file: Path) -> Ledger:
+    """Load a transaction export into a Ledger."""
+    return Ledger.from_lines(read_lines(input_file))
+
+
+def write_ledger(output_file: Path, ledger: Ledger) -> None:
+    """Write a Ledger out in the export layout."""
+    write_lines(output_file, ledger.raw)
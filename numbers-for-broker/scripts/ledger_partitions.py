@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Ledger Partitions Module
+
+Month partitions of a transaction file's postings, so a period report
+reads only the months in its window instead of every row of the export.
+
+A posting is a dated transaction row inside an account section (see
+PostingDelta in ledger.py). The postings of each month are stored as
+three .npy columns (account, date, amount) named after the month, in a
+partitions/ directory in the file's snapshot directory (see
+ledger_snapshot.py), with catalog.json listing every month and its row
+count. The catalog goes last and records the file's size, modification
+time and the parser digest, like a snapshot's meta.json: partitions of a
+changed file are rebuilt on the next read.
+
+load_window_matrix() maps only the partitions between the first and last
+month asked for, so a 2024 report never touches 2025 data and a TTM
+report over a long history reads twelve months. The period reports read
+a file's account cube (see account_cube.py) when it has a fresh one and
+their window's partitions otherwise; a stale cube is only rebuilt, from
+every partition, when the whole history is asked for (generate_reports.py
+and the cube's drill-downs).
+
+Usage: python3 ledger_partitions.py FILE   (lists the file's partitions)
+"""
+
+import argparse
+import json
+import shutil
+from array import array
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from ledger import DATES, Ledger, LINE_TXN, load_ledger
+from ledger_snapshot import load_snapshot, map_npy, parser_digest, snapshot_dir, source_stamp, write_npy
+from pnl_generator import PNL_ACCOUNTS, AccountMonthMatrix, month_key
+
+PARTITIONS_VERSION = 1
+PARTITION_COLUMNS = {"account": "h", "date": "i", "amount": "q"}
+
+
+def partitions_dir(csv_file: Path) -> Path:
+    """Where the month partitions of a transaction file live."""
+    return snapshot_dir(csv_file) / "partitions"
+
+
+def partition_label(key: int) -> str:
+    """YYYY-MM for a month key."""
+    return f"{key // 12}-{key % 12 + 1:02d}"
+
+
+def write_partitions(csv_file: Path, ledger: Ledger) -> Dict:
+    """Split a ledger's postings into month partitions; returns the catalog."""
+    by_month: Dict[int, Dict[str, array]] = {}
+    dates_by_ordinal = DATES.by_ordinal
+    kind = ledger.kind
+    account = ledger.account
+    in_section = ledger.in_section
+    dates = ledger.date
+    amounts = ledger.amount
+    for row in range(len(ledger)):
+        ordinal = dates[row]
+        if kind[row] != LINE_TXN or not in_section[row] or not ordinal:
+            continue
+        key = dates_by_ordinal[ordinal].month_index
+        columns = by_month.get(key)
+        if columns is None:
+            columns = by_month[key] = {name: array(typecode) for name, typecode in PARTITION_COLUMNS.items()}
+        columns["account"].append(account[row])
+        columns["date"].append(ordinal)
+        columns["amount"].append(amounts[row])
+
+    directory = partitions_dir(csv_file)
+    # The catalog goes last, so partitions written half way are never read
+    shutil.rmtree(directory, ignore_errors=True)
+    directory.mkdir(parents=True)
+    for key, columns in by_month.items():
+        for name, column in columns.items():
+            write_npy(directory / f"{partition_label(key)}.{name}.npy", column)
+
+    catalog = {
+        "version": PARTITIONS_VERSION,
+        "parser": parser_digest(),
+        **source_stamp(csv_file),
+        "months": {partition_label(key): len(by_month[key]["date"]) for key in sorted(by_month)},
+    }
+    with open(directory / "catalog.json", 'w', encoding='utf-8') as f:
+        json.dump(catalog, f, indent=2)
+    return catalog
+
+
+def _fresh_catalog(csv_file: Path) -> Optional[Dict]:
+    """The partitions' catalog if they still describe csv_file."""
+    try:
+        with open(partitions_dir(csv_file) / "catalog.json", 'r', encoding='utf-8') as f:
+            catalog = json.load(f)
+        stamp = source_stamp(csv_file)
+    except (OSError, ValueError):
+        return None
+    if catalog.get("version") != PARTITIONS_VERSION or catalog.get("parser") != parser_digest():
+        return None
+    if any(catalog.get(name) != value for name, value in stamp.items()):
+        return None
+    return catalog
+
+
+def load_catalog(csv_file: Path) -> Dict:
+    """The partition catalog of a transaction file, partitioning it first if needed."""
+    catalog = _fresh_catalog(csv_file)
+    if catalog is not None:
+        return catalog
+    ledger = load_snapshot(csv_file)
+    if ledger is None:
+        ledger = load_ledger(csv_file)
+    return write_partitions(csv_file, ledger)
+
+
+def load_window_matrix(csv_file: Path, first: Tuple[int, int], last: Tuple[int, int]) -> AccountMonthMatrix:
+    """
+    Aggregate the P&L postings of first..last inclusive, reading only those months' partitions.
+
+    The matrix has no cells outside the window.
+    """
+    catalog = load_catalog(csv_file)
+    directory = partitions_dir(csv_file)
+    cells: Dict[str, Dict[int, int]] = {code: {} for code in PNL_ACCOUNTS}
+    cells_by_code = {int(code): row for code, row in cells.items()}
+
+    for key in range(month_key(*first), month_key(*last) + 1):
+        label = partition_label(key)
+        if label not in catalog["months"]:
+            continue
+        accounts = map_npy(directory / f"{label}.account.npy")
+        amounts = map_npy(directory / f"{label}.amount.npy")
+        if accounts is None or amounts is None or len(accounts) != catalog["months"][label]:
+            # A damaged partition: rebuild them all and start over
+            write_partitions(csv_file, load_ledger(csv_file))
+            return load_window_matrix(csv_file, first, last)
+
+        for code, cents in zip(accounts, amounts):
+            row_cells = cells_by_code.get(code)
+            if row_cells is not None:
+                row_cells[key] = row_cells.get(key, 0) + cents
+    return AccountMonthMatrix(cells)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="List the month partitions of a transaction export.")
+    parser.add_argument("input_file", type=Path)
+    args = parser.parse_args()
+
+    catalog = load_catalog(args.input_file)
+    print(f"{partitions_dir(args.input_file)}")
+    for label, rows in catalog["months"].items():
+        print(f"  {label}: {rows} postings")
+
+
+if __name__ == "__main__":
+    main()
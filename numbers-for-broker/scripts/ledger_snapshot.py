@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Ledger Snapshot Module
+
+Binary columnar snapshots of the transaction files the pipeline writes.
+Next to every step output CSV, save_ledger() writes a snapshot directory
+(.snapshots/<file name>/ beside the CSV) holding:
+- one .npy file per ledger column (kind, account, in_section, date,
+  amount, txn_type, name, txn_class, memo)
+- strings.json, the string dictionary the txn_type/name/txn_class/memo ids
+  point into
+- meta.json, recording which CSV the snapshot was taken of
+
+The .npy files are written without NumPy, in its version 1 format, so they
+open with numpy.load(path, mmap_mode='r'); load_snapshot() maps them with
+mmap and hands the columns out as memoryviews, so nothing is parsed or
+copied. The CSVs stay the artifacts the broker gets; the snapshots only
+spare the report generators from tokenizing them again.
+
+A snapshot is fresh while its CSV has the size and modification time
+recorded in meta.json and the parsing code (ledger.py, csv_tokenizer.py)
+is unchanged. Readers fall back to the CSV for anything else.
+
+A ledger that is never written out as a CSV (the step cache's resume
+points) gets a standalone snapshot instead: the same columns plus its raw
+lines, which the steps need to rewrite rows, as raw.npy ids into the lines
+of the file it was derived from (new_lines.json holds the few that are
+not there), with meta.json recording the cache key it was produced under
+rather than a CSV's stamp.
+"""
+
+import ast
+import hashlib
+import json
+import mmap
+import shutil
+import struct
+import sys
+from array import array
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from ledger import Ledger, StringPool, read_lines, write_ledger
+from step_cache import file_digest
+
+SCRIPT_DIR = Path(__file__).parent
+
+SNAPSHOT_VERSION = 1
+SNAPSHOT_COLUMNS = ["kind", "account", "in_section", "date", "amount", "txn_type", "name", "txn_class", "memo"]
+
+# Code whose parsing the snapshot columns capture
+PARSER_FILES = [SCRIPT_DIR / "csv_tokenizer.py", SCRIPT_DIR / "ledger.py"]
+
+NPY_MAGIC = b"\x93NUMPY\x01\x00"
+NPY_BYTE_ORDER = "<" if sys.byteorder == "little" else ">"
+# array typecode for each signed integer width
+TYPECODE_BY_SIZE = {1: "b", 2: "h", 4: "i", 8: "q"}
+
+
+def snapshot_dir(csv_file: Path) -> Path:
+    """Where the snapshot of a transaction file lives."""
+    return csv_file.parent / ".snapshots" / csv_file.name
+
+
+def parser_digest() -> str:
+    digest = hashlib.sha256()
+    for path in PARSER_FILES:
+        digest.update(file_digest(path).encode())
+    return digest.hexdigest()
+
+
+def source_stamp(csv_file: Path) -> Dict[str, int]:
+    """Size and modification time of a file, which a cache built from it records."""
+    stat = csv_file.stat()
+    return {"source_bytes": stat.st_size, "source_mtime_ns": stat.st_mtime_ns}
+
+
+def write_npy(path: Path, column: array) -> None:
+    """Write an array column as a one-dimensional .npy file."""
+    header = f"{{'descr': '{NPY_BYTE_ORDER}i{column.itemsize}', 'fortran_order': False, 'shape': ({len(column)},), }}"
+    # Magic, version and header length take 10 bytes; the header is padded so the data is 64-byte aligned
+    padding = -(len(NPY_MAGIC) + 2 + len(header) + 1) % 64
+    header = (header + " " * padding + "\n").encode("latin1")
+    with open(path, 'wb') as f:
+        f.write(NPY_MAGIC)
+        f.write(struct.pack("<H", len(header)))
+        f.write(header)
+        column.tofile(f)
+
+
+def map_npy(path: Path) -> Optional[memoryview]:
+    """Map a .npy column written by write_npy, or None if it is not one."""
+    with open(path, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if mapped[:len(NPY_MAGIC)] != NPY_MAGIC:
+        return None
+    header_len = struct.unpack("<H", mapped[8:10])[0]
+    data_start = 10 + header_len
+    header = ast.literal_eval(mapped[10:data_start].decode("latin1"))
+    descr = header["descr"]
+    typecode = TYPECODE_BY_SIZE.get(int(descr[2:])) if descr[:2] == f"{NPY_BYTE_ORDER}i" else None
+    if typecode is None or header["fortran_order"]:
+        return None
+    view = memoryview(mapped)[data_start:].cast(typecode)
+    return view if len(view) == header["shape"][0] else None
+
+
+def _write_columns(directory: Path, ledger: Ledger, meta: Dict) -> None:
+    """Write a ledger's columns and string dictionary, then meta.json with meta."""
+    directory.mkdir(parents=True, exist_ok=True)
+    meta_file = directory / "meta.json"
+    # meta.json goes last, so a snapshot interrupted half way is never fresh
+    meta_file.unlink(missing_ok=True)
+
+    for name in SNAPSHOT_COLUMNS:
+        write_npy(directory / f"{name}.npy", getattr(ledger, name))
+    with open(directory / "strings.json", 'w', encoding='utf-8') as f:
+        json.dump(ledger.pool.strings, f, ensure_ascii=False)
+
+    meta = {
+        "version": SNAPSHOT_VERSION,
+        "rows": len(ledger),
+        "start_context": [ledger.start_account, ledger.start_in_section],
+        "parser": parser_digest(),
+        **meta,
+    }
+    with open(meta_file, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2)
+
+
+def write_snapshot(csv_file: Path, ledger: Ledger) -> None:
+    """Snapshot a ledger that has just been written to csv_file."""
+    _write_columns(snapshot_dir(csv_file), ledger, source_stamp(csv_file))
+
+
+def discard_snapshot(csv_file: Path) -> None:
+    """Remove a transaction file's snapshot, e.g. before the file is rewritten without one."""
+    shutil.rmtree(snapshot_dir(csv_file), ignore_errors=True)
+
+
+def _fresh_meta(csv_file: Path) -> Optional[Dict]:
+    """The snapshot's meta.json if the snapshot still describes csv_file."""
+    try:
+        with open(snapshot_dir(csv_file) / "meta.json", 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        stamp = source_stamp(csv_file)
+    except (OSError, ValueError):
+        return None
+    if meta.get("version") != SNAPSHOT_VERSION or meta.get("parser") != parser_digest():
+        return None
+    if any(meta.get(name) != value for name, value in stamp.items()):
+        return None
+    return meta
+
+
+def _read_columns(directory: Path, meta: Dict, with_raw: bool) -> Optional[Ledger]:
+    """The ledger whose columns a snapshot directory holds, without its raw lines."""
+    columns = {}
+    for name in SNAPSHOT_COLUMNS:
+        try:
+            view = map_npy(directory / f"{name}.npy")
+        except (OSError, ValueError, SyntaxError, KeyError):
+            return None
+        if view is None or len(view) != meta["rows"]:
+            return None
+        if with_raw:
+            column = array(view.format)
+            column.frombytes(view.cast("B"))
+            view = column
+        columns[name] = view
+
+    with open(directory / "strings.json", 'r', encoding='utf-8') as f:
+        ledger = Ledger(StringPool.from_strings(json.load(f)))
+    ledger.start_account, ledger.start_in_section = meta["start_context"]
+    for name, column in columns.items():
+        setattr(ledger, name, column)
+    return ledger
+
+
+def load_snapshot(csv_file: Path, with_raw: bool = False) -> Optional[Ledger]:
+    """
+    Load the ledger of a transaction file from its snapshot, or None if it has no fresh one.
+
+    By default the columns are read-only memoryviews over the mapped column
+    files and the ledger has no raw lines: enough to aggregate, which is all
+    the report generators do. With with_raw the columns are copied into
+    ordinary arrays and the lines are read from the CSV, giving a ledger the
+    steps can transform.
+    """
+    meta = _fresh_meta(csv_file)
+    if meta is None:
+        return None
+    ledger = _read_columns(snapshot_dir(csv_file), meta, with_raw)
+    if ledger is None:
+        return None
+    if with_raw:
+        ledger.raw = read_lines(csv_file)
+        if len(ledger.raw) != meta["rows"]:
+            return None
+    return ledger
+
+
+def save_standalone_snapshot(directory: Path, ledger: Ledger, key: str, base_ids: Dict[str, int]) -> None:
+    """
+    Snapshot a ledger that is not written out anywhere, raw lines included.
+
+    The raw lines are stored as ids into a base file's lines (base_ids maps
+    each line to its row, see line_ids()), so only lines the base file does
+    not have are kept as text. key identifies what the ledger was produced
+    from (a step's cache key, which also covers the base file);
+    load_standalone_snapshot() only hands the ledger back for the same key.
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    (directory / "meta.json").unlink(missing_ok=True)
+    raw = array("i")
+    new_lines: List[str] = []
+    for line in ledger.raw:
+        row = base_ids.get(line)
+        if row is None:
+            new_lines.append(line)
+            row = -len(new_lines)
+        raw.append(row)
+    write_npy(directory / "raw.npy", raw)
+    with open(directory / "new_lines.json", 'w', encoding='utf-8') as f:
+        json.dump(new_lines, f, ensure_ascii=False)
+    _write_columns(directory, ledger, {"key": key})
+
+
+def load_standalone_snapshot(directory: Path, key: str, base_lines: List[str]) -> Optional[Ledger]:
+    """The ledger save_standalone_snapshot() wrote under key, ready to transform; None if there is none."""
+    try:
+        with open(directory / "meta.json", 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get("version") != SNAPSHOT_VERSION or meta.get("parser") != parser_digest():
+            return None
+        if meta.get("key") != key:
+            return None
+        ledger = _read_columns(directory, meta, with_raw=True)
+        raw = map_npy(directory / "raw.npy")
+        with open(directory / "new_lines.json", 'r', encoding='utf-8') as f:
+            new_lines = json.load(f)
+        if ledger is None or raw is None or len(raw) != meta["rows"]:
+            return None
+        ledger.raw = [base_lines[row] if row >= 0 else new_lines[-row - 1] for row in raw]
+    except (OSError, ValueError, SyntaxError, KeyError, IndexError):
+        return None
+    return ledger
+
+
+def line_ids(lines: List[str]) -> Dict[str, int]:
+    """Each distinct line of a file and a row it is on, for save_standalone_snapshot()."""
+    return {line: row for row, line in enumerate(lines)}
+
+
+def save_ledger(output_file: Path, ledger: Ledger) -> None:
+    """Write a ledger out in the export layout, with its snapshot beside it."""
+    write_ledger(output_file, ledger)
+    write_snapshot(output_file, ledger)
@@ -0,0 +1,416 @@
+#!/usr/bin/env python3
+"""
+Monthly Ingest Module
+
+Adds a month-end QuickBooks export to the P&L without reprocessing the
+months before it.
+
+The store (output/monthly-store/) starts from a full export: --init runs
+it through every pipeline step once and freezes each step's account x
+month matrix as the history block. After that, a month is ingested from
+a single-month export. Its rows are the month's partition; they are run
+through the steps that touch the month, and each step's matrix of the
+partition is kept as the month's block. Steps that work row by row touch
+every month. A step that adjusts fixed months as a whole (ADJUSTED_MONTHS
+in the step module) is skipped for other months; for a month it adjusts,
+it is run on the partition when its adjustments are separable month by
+month (ADJUSTED_MONTHS_SEPARABLE, e.g. step 3's December 2025 payout
+replacement), and whatever it adds for other months is dropped. A month
+adjusted by a step whose adjustment spans several months (step 5's
+shipping smoothing) can only come in through --init. A step's P&L is the
+history block plus the month blocks, so a month-end refresh costs one
+month of data.
+
+Ingesting a month again (a refreshed export before the books close)
+replaces its partition and block. --close freezes every month up to the
+given one: closed months are never reprocessed and cannot be ingested
+again. A month's block can still post to an earlier month where a step
+moves rows back (step 4 shifts affiliate payments to the month before).
+Into an open month that is part of the block; what it posts into a
+closed month is split off as the month's explicit adjustment block
+(months/YYYY-MM.adjustments.json, listed in the catalog), with a
+warning, so the closed months' own blocks never change. The adjustments
+are included in the P&L, as the full pipeline would have them.
+
+The store's transactions are the history export plus the month
+partitions; --merged writes them out as one export, each month's rows
+added at the end of their account sections.
+
+Usage: python3 monthly_ingest.py --init [EXPORT]
+       python3 monthly_ingest.py MONTH_EXPORT
+       python3 monthly_ingest.py --close YYYY-MM
+       python3 monthly_ingest.py --merged FILE
+"""
+
+import argparse
+import importlib
+import json
+import shutil
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from ledger import (
+    DATES, Ledger, LINE_FRAGMENT, LINE_SECTION, LINE_TOTAL, PostingDelta, format_cents, load_ledger, write_ledger,
+)
+from ledger_snapshot import save_ledger
+from pnl_generator import PNL_ACCOUNTS, AccountMonthMatrix, aggregate_ledger, month_key, render_pnl_full
+from run_pipeline import INPUT_FILE, OUTPUT_DIR, STEPS, run_transform
+
+STORE_DIR = OUTPUT_DIR / "monthly-store"
+CATALOG_VERSION = 1
+
+Cells = Dict[str, Dict[int, int]]
+
+
+def month_label(key: int) -> str:
+    """YYYY-MM for a month key."""
+    return f"{key // 12}-{key % 12 + 1:02d}"
+
+
+def parse_month_label(label: str) -> int:
+    """Month key for YYYY-MM."""
+    year, month = label.split("-")
+    return month_key(int(year), int(month))
+
+
+def month_tuple(key: int) -> Tuple[int, int]:
+    """(year, month 1-12) for a month key."""
+    return key // 12, key % 12 + 1
+
+
+def ledger_months(ledger: Ledger) -> List[int]:
+    """Month keys of a ledger's dated transaction rows, in order."""
+    kind = ledger.kind
+    dates = ledger.date
+    ordinals = {dates[row] for row in range(len(ledger)) if kind[row] >= LINE_FRAGMENT and dates[row]}
+    return sorted({DATES.by_ordinal[ordinal].month_index for ordinal in ordinals})
+
+
+def adjusted_month_keys(step) -> Optional[List[int]]:
+    """Month keys a step adjusts as a whole, None if it works row by row."""
+    adjusted = getattr(step, "ADJUSTED_MONTHS", None)
+    return None if adjusted is None else [month_key(*month) for month in adjusted]
+
+
+def separable(step) -> bool:
+    """Whether a step's whole-month adjustments can be run one month at a time."""
+    return getattr(step, "ADJUSTED_MONTHS_SEPARABLE", False)
+
+
+def drop_other_months(ledger: Ledger, months: Sequence[int], changes: PostingDelta) -> Ledger:
+    """The ledger without its dated rows outside months, recorded in changes as removed postings."""
+    by_ordinal = DATES.by_ordinal
+    kind = ledger.kind
+    dates = ledger.date
+    keep = set(months)
+    rows = [
+        row for row in range(len(ledger))
+        if kind[row] < LINE_FRAGMENT or not dates[row] or by_ordinal[dates[row]].month_index in keep
+    ]
+    if len(rows) == len(ledger):
+        return ledger
+    ledger.changes = changes
+    try:
+        result = ledger.select(rows)
+    finally:
+        ledger.changes = None
+    result.changes = None
+    return result
+
+
+def runs_on(step, months: Sequence[int]) -> bool:
+    """Whether a step touches a ledger covering months: it works row by row or adjusts one of them."""
+    adjusted = adjusted_month_keys(step)
+    return adjusted is None or any(key in months for key in adjusted)
+
+
+def step_matrices(ledger: Ledger, months: Sequence[int]) -> Dict[str, AccountMonthMatrix]:
+    """
+    Each step's matrix of a ledger covering months run through the pipeline.
+
+    Steps that adjust only other months are skipped, and a separable step
+    keeps only what it does to the covered months (a step that is not
+    separable runs as a whole). The ledger's rows are changed in place.
+    """
+    matrices = {}
+    matrix = aggregate_ledger(ledger)
+    for module_name, _ in STEPS:
+        step = importlib.import_module(module_name)
+        if hasattr(step, "transform") and runs_on(step, months):
+            ledger, changes = run_transform(step, ledger)
+            if separable(step):
+                ledger = drop_other_months(ledger, months, changes)
+            matrix = matrix.apply(changes)
+        matrices[module_name.split("_")[0]] = matrix
+    return matrices
+
+
+def split_closed(matrices: Dict[str, AccountMonthMatrix],
+                 closed_through: int) -> Tuple[Dict[str, AccountMonthMatrix], Dict[str, AccountMonthMatrix]]:
+    """Each step's matrix split into its open months and, for the steps that post to them, its closed months."""
+    open_months = {}
+    closed = {}
+    for step_name, matrix in matrices.items():
+        open_cells = {}
+        closed_cells = {}
+        for code, row in matrix.cells.items():
+            open_cells[code] = {key: cents for key, cents in row.items() if key > closed_through}
+            moved = {key: cents for key, cents in row.items() if key <= closed_through and cents}
+            if moved:
+                closed_cells[code] = moved
+        open_months[step_name] = AccountMonthMatrix(open_cells)
+        if closed_cells:
+            closed[step_name] = AccountMonthMatrix(closed_cells)
+    return open_months, closed
+
+
+def merge_month(ledger: Ledger, month: Ledger) -> Ledger:
+    """
+    The ledger with a month export's rows added at the end of the matching sections.
+
+    An account the ledger has no section for gets the month's section,
+    header and Total line included, before the first section with a
+    higher code.
+    """
+    sections = ledger.section_ranges()
+    headers = sorted((start, code) for code, ranges in sections.items() for start, _ in ranges if ledger.kind[start] == LINE_SECTION)
+    added: Dict[int, List[str]] = {}  # row -> lines to add after it
+
+    for code, ranges in month.section_ranges().items():
+        month_headers = [start for start, _ in ranges if month.kind[start] == LINE_SECTION]
+        rows = [row for start, end in ranges for row in range(start + 1, end) if month.in_section[row]]
+        if not month_headers or not rows:
+            continue
+        lines = [month.raw[row] for row in rows]
+
+        if code in sections:
+            # Before the Total line of the account's last section
+            start, end = sections[code][-1]
+            total = next((row for row in range(start, end) if ledger.kind[row] == LINE_TOTAL), end)
+            added.setdefault(total - 1, []).extend(lines)
+            continue
+
+        header = month_headers[-1]
+        total = next((row for row in range(header, len(month)) if month.kind[row] == LINE_TOTAL), None)
+        section_lines = [month.raw[header]] + lines + ([month.raw[total]] if total is not None else [])
+        following = [start for start, other in headers if other > code]
+        if following:
+            after = following[0] - 1
+        else:
+            after = max((end for ranges in sections.values() for _, end in ranges), default=len(ledger)) - 1
+        added.setdefault(after, []).extend(section_lines)
+
+    rows = []
+    for row in range(len(ledger)):
+        rows.append(row)
+        rows.extend(ledger.append_line(line) for line in added.get(row, []))
+    return ledger.select(rows)
+
+
+def cells_to_json(cells: Cells) -> Dict:
+    return {code: {str(key): cents for key, cents in row.items() if cents} for code, row in cells.items()}
+
+
+def cells_from_json(data: Dict) -> Cells:
+    return {code: {int(key): cents for key, cents in row.items()} for code, row in data.items()}
+
+
+class MonthlyStore:
+    """The history block, the month partitions and their blocks, and the catalog listing them."""
+
+    def __init__(self, store_dir: Path = STORE_DIR):
+        self.store_dir = store_dir
+        self.catalog_file = store_dir / "catalog.json"
+        self.history_file = store_dir / "history.csv"
+        self.catalog: Optional[Dict] = None
+        try:
+            with open(self.catalog_file, 'r', encoding='utf-8') as f:
+                catalog = json.load(f)
+            if catalog["version"] == CATALOG_VERSION:
+                self.catalog = catalog
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    def partition_file(self, label: str) -> Path:
+        return self.store_dir / "months" / f"{label}.csv"
+
+    def block_file(self, label: Optional[str], adjustments: bool = False) -> Path:
+        """Where the history block (label None), a month's block or its closed-month adjustments are kept."""
+        if label is None:
+            return self.store_dir / "history.json"
+        return self.store_dir / "months" / (f"{label}.adjustments.json" if adjustments else f"{label}.json")
+
+    def _require_catalog(self) -> Dict:
+        if self.catalog is None:
+            raise ValueError(f"no monthly store in {self.store_dir} - run with --init first")
+        return self.catalog
+
+    def _write_catalog(self) -> None:
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        with open(self.catalog_file, 'w', encoding='utf-8') as f:
+            json.dump(self.catalog, f, indent=2)
+
+    def _write_block(self, label: Optional[str], matrices: Dict[str, AccountMonthMatrix], adjustments: bool = False) -> None:
+        block_file = self.block_file(label, adjustments)
+        block_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(block_file, 'w', encoding='utf-8') as f:
+            json.dump({step_name: cells_to_json(matrix.cells) for step_name, matrix in matrices.items()}, f)
+
+    def _read_block(self, label: Optional[str], adjustments: bool = False) -> Dict[str, Cells]:
+        with open(self.block_file(label, adjustments), 'r', encoding='utf-8') as f:
+            return {step_name: cells_from_json(cells) for step_name, cells in json.load(f).items()}
+
+    def init(self, export: Path) -> None:
+        """Start the store from a full export, freezing every month in it."""
+        ledger = load_ledger(export)
+        months = ledger_months(ledger)
+        if not months:
+            raise ValueError(f"{export} has no dated transactions")
+
+        # A new history replaces every month ingested on top of the old one
+        shutil.rmtree(self.store_dir / "months", ignore_errors=True)
+        save_ledger(self.history_file, ledger)
+        self._write_block(None, step_matrices(ledger, range(months[0], months[-1] + 1)))
+        self.catalog = {
+            "version": CATALOG_VERSION,
+            "history": {"export": str(export), "first": month_label(months[0]), "last": month_label(months[-1])},
+            "closed_through": month_label(months[-1]),
+            "months": {},
+        }
+        self._write_catalog()
+        print(f"History: {months_summary(months)} from {export}, closed")
+
+    def ingest(self, export: Path) -> str:
+        """Add or refresh one month from its export; returns the month's YYYY-MM label."""
+        catalog = self._require_catalog()
+        ledger = load_ledger(export)
+        months = ledger_months(ledger)
+        if len(months) != 1:
+            raise ValueError(f"{export} is not a single-month export ({months_summary(months)})")
+        month = months[0]
+        label = month_label(month)
+
+        closed_through = parse_month_label(catalog["closed_through"])
+        if month <= closed_through:
+            raise ValueError(f"{label} is closed (the store is closed through {catalog['closed_through']})")
+        for module_name, _ in STEPS:
+            step = importlib.import_module(module_name)
+            adjusted = adjusted_month_keys(step)
+            if adjusted is not None and month in adjusted and not separable(step):
+                raise ValueError(f"{label} is adjusted as a whole by {module_name} - re-run --init with an export that includes it")
+
+        save_ledger(self.partition_file(label), ledger)
+        rows = len(ledger)
+        matrices, adjustments = split_closed(step_matrices(ledger, [month]), closed_through)
+        self._write_block(label, matrices)
+        self.block_file(label, adjustments=True).unlink(missing_ok=True)
+        refreshed = label in catalog["months"]
+        catalog["months"][label] = {"rows": rows}
+        if adjustments:
+            self._write_block(label, adjustments, adjustments=True)
+            adjusted_months = sorted({
+                key for matrix in adjustments.values() for row in matrix.cells.values() for key in row
+            })
+            catalog["months"][label]["closed_adjustments"] = [month_label(key) for key in adjusted_months]
+            # Each step's matrix includes the earlier steps', so only warn where the adjustment changes
+            before = 0
+            for step_name, matrix in adjustments.items():
+                cents = sum(sum(row.values()) for row in matrix.cells.values())
+                if cents != before:
+                    print(f"Warning: {step_name} posts ${format_cents(cents - before, grouped=True)} from {label} "
+                          f"into closed {', '.join(month_label(key) for key in adjusted_months)}; kept as an "
+                          f"explicit adjustment in {self.block_file(label, adjustments=True).name}")
+                before = cents
+        self._write_catalog()
+        print(f"{'Refreshed' if refreshed else 'Ingested'} {label}: {rows} lines from {export}")
+        return label
+
+    def close(self, label: str) -> None:
+        """Freeze every month up to and including label."""
+        catalog = self._require_catalog()
+        if parse_month_label(label) <= parse_month_label(catalog["closed_through"]):
+            raise ValueError(f"{label} is already closed")
+        catalog["closed_through"] = month_label(parse_month_label(label))
+        self._write_catalog()
+        print(f"Closed through {catalog['closed_through']}")
+
+    def report_range(self) -> List[int]:
+        """First and last month key covered by the history and the ingested months."""
+        catalog = self._require_catalog()
+        keys = [parse_month_label(catalog["history"]["first"]), parse_month_label(catalog["history"]["last"])]
+        keys.extend(parse_month_label(label) for label in catalog["months"])
+        return [min(keys), max(keys)]
+
+    def matrices(self) -> Dict[str, AccountMonthMatrix]:
+        """Each step's matrix: the history block plus every month's block."""
+        catalog = self._require_catalog()
+        blocks = [self._read_block(None)]
+        for label, entry in sorted(catalog["months"].items()):
+            blocks.append(self._read_block(label))
+            if entry.get("closed_adjustments"):
+                blocks.append(self._read_block(label, adjustments=True))
+        matrices = {}
+        for step_name in blocks[0]:
+            cells: Cells = {code: {} for code in PNL_ACCOUNTS}
+            for block in blocks:
+                for code, row in block.get(step_name, {}).items():
+                    target = cells[code]
+                    for key, cents in row.items():
+                        target[key] = target.get(key, 0) + cents
+            matrices[step_name] = AccountMonthMatrix(cells)
+        return matrices
+
+    def render(self) -> None:
+        """Write every step's P&L over the store's whole range to the store directory."""
+        first, last = self.report_range()
+        print(f"\nP&L by step, {month_label(first)} to {month_label(last)}:")
+        for step_name, matrix in self.matrices().items():
+            output_file = self.store_dir / f"pnl_{step_name}.csv"
+            summary = render_pnl_full(matrix, output_file, True, month_tuple(first), month_tuple(last))
+            print(f"  {output_file.name}: Net Income ${summary['net_income']:,.2f}")
+
+    def merged_ledger(self) -> Ledger:
+        """The history export with every month partition merged in, in month order."""
+        catalog = self._require_catalog()
+        ledger = load_ledger(self.history_file)
+        for label in sorted(catalog["months"]):
+            ledger = merge_month(ledger, load_ledger(self.partition_file(label)))
+        return ledger
+
+
+def months_summary(months: List[int]) -> str:
+    if not months:
+        return "no months"
+    if len(months) == 1:
+        return month_label(months[0])
+    return f"{len(months)} months, {month_label(months[0])} to {month_label(months[-1])}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest single-month exports into the monthly P&L store.")
+    parser.add_argument("export", nargs="?", type=Path, help="Single-month export to ingest (or refresh)")
+    parser.add_argument("--init", nargs="?", type=Path, const=INPUT_FILE, metavar="EXPORT",
+                        help=f"Start the store from a full export (default {INPUT_FILE.name})")
+    parser.add_argument("--close", metavar="YYYY-MM", help="Freeze every month up to and including this one")
+    parser.add_argument("--merged", type=Path, metavar="FILE", help="Write the history and every month as one export")
+    parser.add_argument("--store", type=Path, default=STORE_DIR, help="Store directory (default output/monthly-store)")
+    args = parser.parse_args()
+
+    store = MonthlyStore(args.store)
+    try:
+        if args.init is not None:
+            store.init(args.init)
+        if args.export is not None:
+            store.ingest(args.export)
+        if args.close is not None:
+            store.close(args.close)
+        if args.merged is not None:
+            write_ledger(args.merged, store.merged_ledger())
+            print(f"Merged export written to: {args.merged}")
+        store.render()
+    except ValueError as e:
+        raise SystemExit(f"Error: {e}")
+
+
+if __name__ == "__main__":
+    main()
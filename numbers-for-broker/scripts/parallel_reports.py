@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Parallel Reports Module
+
+Fans the per-step report work of the generate_* scripts out over a process
+pool. Every step's reports only depend on that step's transaction file, so
+the steps are independent: each worker parses one step file, renders its
+reports silently and hands back the summaries. The parent prints them in
+step order once all steps are done, so the console output is the same for
+any worker count.
+
+A step that raises does not stop the others; its traceback is reported
+under the step and the script exits nonzero at the end.
+"""
+
+import argparse
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# task(step_name, input_file) -> value; must be picklable (module-level)
+StepTask = Callable[[str, Path], Any]
+
+
+@dataclass
+class StepOutcome:
+    """Result of one step's task: its value, or the traceback if it failed."""
+    value: Any = None
+    error: Optional[str] = None
+
+
+def add_workers_argument(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--workers", type=int, default=1, metavar="N",
+        help="Generate the steps' reports in N worker processes (0 = one per CPU; default 1)",
+    )
+
+
+def worker_count(workers: int, jobs: int) -> int:
+    """Processes to use for jobs tasks: 0 means one per CPU, never more than there are jobs."""
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    return max(1, min(workers, jobs))
+
+
+def _run_task(task: StepTask, step_name: str, input_file: Path) -> StepOutcome:
+    try:
+        return StepOutcome(value=task(step_name, input_file))
+    except Exception:
+        return StepOutcome(error=traceback.format_exc())
+
+
+def run_step_tasks(
+    task: StepTask,
+    steps: List[Tuple[str, Path, str]],
+    workers: int = 1,
+) -> Dict[str, StepOutcome]:
+    """
+    Run task for every step whose input file exists.
+
+    Returns step name -> outcome; steps with a missing input are left out.
+    """
+    present = [(step_name, input_file) for step_name, input_file, _ in steps if input_file.exists()]
+    workers = worker_count(workers, len(present))
+
+    if workers == 1:
+        return {step_name: _run_task(task, step_name, input_file) for step_name, input_file in present}
+
+    outcomes: Dict[str, StepOutcome] = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            step_name: pool.submit(_run_task, task, step_name, input_file)
+            for step_name, input_file in present
+        }
+        for step_name, future in futures.items():
+            try:
+                outcomes[step_name] = future.result()
+            except Exception as e:
+                # The worker died (or the task could not be sent to it)
+                outcomes[step_name] = StepOutcome(error=f"{type(e).__name__}: {e}\n")
+    return outcomes
+
+
+def print_step_outcomes(
+    steps: List[Tuple[str, Path, str]],
+    outcomes: Dict[str, StepOutcome],
+    print_value: Callable[[Any], None],
+) -> None:
+    """Print every step's outcome in step order, in the generators' usual layout."""
+    for step_name, input_file, description in steps:
+        outcome = outcomes.get(step_name)
+        if outcome is None:
+            print(f"  SKIPPED: {step_name} - input file not found: {input_file.name}")
+            continue
+
+        print(f"{step_name}: {description}")
+        if outcome.error is not None:
+            print(f"  FAILED: {step_name}")
+            for line in outcome.error.rstrip().split('\n'):
+                print(f"    {line}")
+        else:
+            print_value(outcome.value)
+
+
+def exit_if_failed(outcomes: Dict[str, StepOutcome]) -> None:
+    """Exit nonzero, naming the steps, if any step's task failed."""
+    failed = [step_name for step_name, outcome in outcomes.items() if outcome.error is not None]
+    if failed:
+        raise SystemExit(f"\nFAILED: {len(failed)} step(s) did not generate: {', '.join(failed)}")
+
+
+def print_generated(generated: Tuple[str, Dict[str, float]]) -> None:
+    """print_value for tasks returning (output file name, summary)."""
+    output_name, summary = generated
+    print(f"  Generated: {output_name} (Net Income: ${summary['net_income']:,.2f})")
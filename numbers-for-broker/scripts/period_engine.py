@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Period Engine Module
+
+Cumulative (prefix-sum) account x month totals, so the totals of any
+window of months cost one subtraction per account however long the
+window is.
+
+For every account the engine keeps the running total through each month
+of its range; the window first..last is then
+cumulative[last] - cumulative[first - 1]. Trailing windows (e.g. the
+twelve months to any month-end) and rolling series of them are built on
+that.
+"""
+
+from itertools import accumulate
+from typing import Dict, List, Tuple
+
+from pnl_generator import AccountMonthMatrix, month_key
+
+
+class PeriodEngine:
+    """Running account totals over the months first..last of a matrix."""
+
+    def __init__(self, matrix: AccountMonthMatrix, first: Tuple[int, int], last: Tuple[int, int]):
+        self.first_key = month_key(*first)
+        self.last_key = month_key(*last)
+        keys = range(self.first_key, self.last_key + 1)
+        # cumulative[code][i] is the total of the months before first + i
+        self.cumulative: Dict[str, List[int]] = {
+            code: list(accumulate((row.get(key, 0) for key in keys), initial=0))
+            for code, row in matrix.cells.items()
+        }
+
+    def _offsets(self, first_key: int, last_key: int) -> Tuple[int, int]:
+        if not self.first_key <= first_key <= last_key <= self.last_key:
+            raise ValueError(f"months {first_key}..{last_key} are outside the engine's range {self.first_key}..{self.last_key}")
+        return first_key - self.first_key, last_key - self.first_key + 1
+
+    def totals(self, first: Tuple[int, int], last: Tuple[int, int]) -> Dict[str, int]:
+        """Account code -> total in cents over first..last inclusive."""
+        start, end = self._offsets(month_key(*first), month_key(*last))
+        return {code: running[end] - running[start] for code, running in self.cumulative.items()}
+
+    def trailing(self, as_of: Tuple[int, int], months: int = 12) -> Dict[str, int]:
+        """Account code -> total over the months months-long window ending with as_of."""
+        last_key = month_key(*as_of)
+        start, end = self._offsets(last_key - months + 1, last_key)
+        return {code: running[end] - running[start] for code, running in self.cumulative.items()}
+
+    def rolling(self, first_as_of: Tuple[int, int], last_as_of: Tuple[int, int], months: int = 12) -> Dict[str, List[int]]:
+        """Account code -> trailing totals as of every month-end from first_as_of to last_as_of."""
+        first_key, last_key = month_key(*first_as_of), month_key(*last_as_of)
+        start, _ = self._offsets(first_key - months + 1, last_key)
+        count = last_key - first_key + 1
+        return {
+            code: [running[start + months + i] - running[start + i] for i in range(count)]
+            for code, running in self.cumulative.items()
+        }
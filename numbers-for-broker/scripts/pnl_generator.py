@@ -6,12 +6,23 @@ Shared module for generating P&L reports from transaction data.
 Used by all pipeline steps to generate intermediate P&L reports.
 """
 
-import re
+import argparse
+import calendar
+import os
 from pathlib import Path
 from datetime import datetime
 from typing import List, Dict, Optional, Tuple
 from dataclasses import dataclass
 
+from export_reader import aggregate_export
+from ledger import DATES, Ledger, LINE_TXN, PostingDelta, format_cents
+from ledger_snapshot import load_snapshot
+
+try:
+    from pnl_numpy import aggregate_ledger_numpy, rollup_totals_numpy
+except ImportError:  # NumPy is optional
+    aggregate_ledger_numpy = rollup_totals_numpy = None
+
 
 @dataclass
 class AccountConfig:
@@ -84,83 +95,88 @@ PNL_ACCOUNTS: Dict[str, AccountConfig] = {
     "8005": AccountConfig("8005 Depreciation", "Other Expenses", 70),
 }
 
+# Expense accounts without a subcategory are totalled together under this name
+OTHER_OPERATING_EXPENSES = "Other Operating Expenses"
+
+
+def rollup_group(config: AccountConfig) -> str:
+    """
+    The total an account is rolled up into: its subcategory, else its category.
+
+    Expense accounts without a subcategory go to Other Operating Expenses.
+    """
+    if config.subcategory is not None:
+        return config.subcategory
+    if config.category == "Expenses":
+        return OTHER_OPERATING_EXPENSES
+    return config.category
+
+
+def build_rollup_groups(accounts: Dict[str, AccountConfig]) -> Dict[str, List[str]]:
+    """Group name -> account codes for every rollup_group() of the accounts, in report order."""
+    groups: Dict[str, List[str]] = {}
+    for code, config in sorted(accounts.items(), key=lambda item: item[1].order):
+        groups.setdefault(rollup_group(config), []).append(code)
+    return groups
+
+
+# Accounts rolled up into each category total, in report order
+ROLLUP_GROUPS: Dict[str, List[str]] = build_rollup_groups(PNL_ACCOUNTS)
+
+# "python", "numpy", or "auto" (NumPy when installed and the ledger is large)
+AGGREGATION_BACKEND = os.environ.get("PNL_BACKEND", "auto")
+NUMPY_MIN_ROWS = 50000
+
 MONTHS = [
     "January", "February", "March", "April", "May", "June",
     "July", "August", "September", "October", "November", "December"
 ]
 
 
-def get_month_columns() -> List[str]:
-    """Generate month column headers for 2024 and 2025."""
-    cols = []
-    for m in range(12):
-        cols.append(f"{MONTHS[m]} 2024")
-    for m in range(11):
-        cols.append(f"{MONTHS[m]} 2025")
-    return cols
+# Full report range: January 2024 - November 2025
+FIRST_MONTH = (2024, 1)
+LAST_MONTH = (2025, 11)
 
 
-def parse_csv_line(line: str) -> List[str]:
-    """Parse a CSV line handling quoted fields."""
-    result = []
-    current = ""
-    in_quotes = False
+def month_key(year: int, month: int) -> int:
+    """Absolute month number for (year, month 1-12), used to index the matrix."""
+    return year * 12 + month - 1
 
-    for char in line:
-        if char == '"':
-            in_quotes = not in_quotes
-        elif char == ',' and not in_quotes:
-            result.append(current.strip())
-            current = ""
-        else:
-            current += char
-    result.append(current.strip())
-    return result
-
-
-def parse_date(date_str: str) -> Optional[Tuple[int, int]]:
-    """Parse MM/DD/YYYY date string, return (year, month) or None."""
-    match = re.match(r'^(\d{2})/(\d{2})/(\d{4})$', date_str)
-    if not match:
-        return None
-    month = int(match.group(1)) - 1
-    year = int(match.group(3))
-    return (year, month)
-
-
-def get_month_index(year: int, month: int) -> Optional[int]:
-    """Get month column index (0-22) for Jan 2024 - Nov 2025."""
-    if year == 2024:
-        return month
-    if year == 2025 and month <= 10:
-        return 12 + month
-    return None
-
-
-def parse_amount(amount_str: str) -> float:
-    """Parse amount string to float."""
-    if not amount_str or amount_str.strip() == "":
-        return 0.0
-    cleaned = re.sub(r'["$,]', '', amount_str).strip()
+
+def parse_month(text: str) -> Tuple[int, int]:
+    """(year, month) from YYYY-MM, for a command line argument."""
     try:
-        return float(cleaned)
+        year, month = (int(part) for part in text.split("-"))
     except ValueError:
-        return 0.0
+        raise argparse.ArgumentTypeError(f"expected YYYY-MM, got {text!r}")
+    if not 1 <= month <= 12:
+        raise argparse.ArgumentTypeError(f"expected YYYY-MM, got {text!r}")
+    return year, month
 
 
-def format_number(num: float) -> str:
-    """Format number for display."""
-    if num == 0:
+def month_columns(first: Tuple[int, int], last: Tuple[int, int]) -> List[str]:
+    """Month column headers ("January 2024", ...) from first to last inclusive."""
+    cols = []
+    for key in range(month_key(*first), month_key(*last) + 1):
+        cols.append(f"{MONTHS[key % 12]} {key // 12}")
+    return cols
+
+
+def get_month_columns() -> List[str]:
+    """Generate month column headers for 2024 and 2025."""
+    return month_columns(FIRST_MONTH, LAST_MONTH)
+
+
+def format_number(cents: int) -> str:
+    """Format an amount in cents for display."""
+    if cents == 0:
         return ""
-    is_negative = num < 0
-    abs_num = abs(num)
-    formatted = f"{abs_num:,.2f}"
-    return f"-{formatted}" if is_negative else formatted
+    return format_cents(cents, grouped=True)
 
 
-def format_for_csv(num: float) -> str:
-    """Format number for CSV output."""
-    formatted = format_number(num)
+def format_for_csv(cents: int) -> str:
+    """Format an amount in cents for CSV output."""
+    formatted = format_number(cents)
     if formatted == "":
         return ""
     if "," in formatted:
@@ -168,81 +184,228 @@ def format_for_csv(num: float) -> str:
     return formatted
 
 
+@dataclass
+class AccountMonthMatrix:
+    """Per-account monthly totals for every month that has P&L activity."""
+    cells: Dict[str, Dict[int, int]]  # account code -> month key -> total in cents
+
+    def window(self, first: Tuple[int, int], last: Tuple[int, int]) -> Dict[str, List[int]]:
+        """Slice out account -> monthly amounts (cents) for first..last inclusive."""
+        keys = range(month_key(*first), month_key(*last) + 1)
+        return {code: [row.get(key, 0) for key in keys] for code, row in self.cells.items()}
+
+    def apply(self, delta: PostingDelta) -> "AccountMonthMatrix":
+        """
+        The matrix after a step's change set, leaving this one as it was.
+
+        Postings to accounts outside the P&L are ignored, as the aggregation
+        ignores their rows.
+        """
+        cells = {code: dict(row) for code, row in self.cells.items()}
+        cells_by_code = {int(code): row for code, row in cells.items()}
+        for (account, key), cents in delta.net().items():
+            row_cells = cells_by_code.get(account)
+            if row_cells is not None:
+                row_cells[key] = row_cells.get(key, 0) + cents
+        return AccountMonthMatrix(cells)
+
+
+def use_numpy(rows: int) -> bool:
+    """Whether the NumPy backend should handle a ledger of this many rows."""
+    if aggregate_ledger_numpy is None or AGGREGATION_BACKEND == "python":
+        return False
+    return AGGREGATION_BACKEND == "numpy" or rows >= NUMPY_MIN_ROWS
+
+
+def aggregate_ledger(ledger: Ledger) -> AccountMonthMatrix:
+    """
+    Sum P&L transactions into an account x month matrix in one pass.
+
+    Every report period is a window of this matrix, so a ledger only needs
+    to be aggregated once however many reports are rendered from it.
+    """
+    if use_numpy(len(ledger)):
+        return AccountMonthMatrix(aggregate_ledger_numpy(ledger, list(PNL_ACCOUNTS)))
+
+    cells: Dict[str, Dict[int, int]] = {code: {} for code in PNL_ACCOUNTS}
+    accumulate_ledger(cells, ledger)
+    return AccountMonthMatrix(cells)
+
+
+def accumulate_ledger(cells: Dict[str, Dict[int, int]], ledger: Ledger) -> None:
+    """
+    Add a ledger's P&L transactions into account code -> month key -> total.
+
+    Totals are integer cents, so accumulating the chunks of a stream one
+    after another gives exactly the totals of aggregating the whole export.
+    """
+    # Rows are only counted inside a P&L account section (before its Total line)
+    cells_by_code = {int(code): cells[code] for code in PNL_ACCOUNTS}
+    dates_by_ordinal = DATES.by_ordinal
+    kind = ledger.kind
+    account = ledger.account
+    in_section = ledger.in_section
+    dates = ledger.date
+    amounts = ledger.amount
+
+    for row in range(len(ledger)):
+        if kind[row] != LINE_TXN or not in_section[row]:
+            continue
+        row_cells = cells_by_code.get(account[row])
+        ordinal = dates[row]
+        if row_cells is None or not ordinal:
+            continue
+
+        key = dates_by_ordinal[ordinal].month_index
+        row_cells[key] = row_cells.get(key, 0) + amounts[row]
+
+
+def rollup_totals(data: Dict[str, List[int]], num_months: int) -> Dict[str, List[int]]:
+    """
+    Category name -> monthly totals for every category in ROLLUP_GROUPS.
+
+    The backend is chosen by use_numpy(), as for aggregation, on the number
+    of cells summed.
+    """
+    if use_numpy(len(data) * num_months):
+        return rollup_totals_numpy(data, ROLLUP_GROUPS, num_months)
+
+    totals = {}
+    for name, codes in ROLLUP_GROUPS.items():
+        total = [0] * num_months
+        for code in codes:
+            total = [x + y for x, y in zip(total, data[code])]
+        totals[name] = total
+    return totals
+
+
+def pipeline_step_files(base_dir: Path) -> List[Tuple[str, Path, str]]:
+    """(step name, transaction file, description) for each pipeline step's output."""
+    return [
+        ("step0", base_dir / "input-data" / "all-txn-2024-2025.csv", "Baseline (original data)"),
+        ("step1", base_dir / "output" / "step1_november_revenue.csv", "After adding November Shopify"),
+        ("step2", base_dir / "output" / "step2_reclassified.csv", "After reclassifications"),
+        ("step3", base_dir / "output" / "step3_affiliates_replaced.csv", "After replacing Nov/Dec affiliates"),
+        ("step4", base_dir / "output" / "step4_dates_shifted.csv", "After shifting affiliate dates"),
+        ("step5", base_dir / "output" / "all-txn-2024-2025-transformed.csv", "After smoothing shipping"),
+        ("step6", base_dir / "output" / "all-txn-2024-2025-final.csv", "After applying exclusions"),
+    ]
+
+
+def load_matrix(input_file: Path) -> AccountMonthMatrix:
+    """
+    Aggregate a transaction export into an account x month matrix.
+
+    The export's snapshot is aggregated when it has a fresh one, so the step
+    outputs the pipeline wrote are never parsed again. Otherwise the export
+    is read with export_reader.py, which sums the P&L sections straight from
+    a memory map without building a ledger.
+    """
+    ledger = load_snapshot(input_file)
+    if ledger is None:
+        return AccountMonthMatrix(aggregate_export(input_file, PNL_ACCOUNTS))
+    return aggregate_ledger(ledger)
+
+
 def generate_pnl(input_file: Path, output_file: Path, silent: bool = False) -> Dict[str, float]:
     """
     Generate P&L report from transaction data.
 
     Returns dict with summary totals.
     """
-    with open(input_file, 'r', encoding='utf-8') as f:
-        content = f.read()
-    lines = content.split('\n')
+    return render_pnl_full(load_matrix(input_file), output_file, silent)
 
-    month_cols = get_month_columns()
-    num_months = len(month_cols)
 
-    # Data: account_code -> list of monthly amounts
-    data: Dict[str, List[float]] = {}
-    for code in PNL_ACCOUNTS:
-        data[code] = [0.0] * num_months
+def generate_pnl_from_ledger(ledger: Ledger, output_file: Path, silent: bool = False) -> Dict[str, float]:
+    """
+    Generate P&L report from a ledger already held in memory.
 
-    # Parse transactions
-    current_account_code: Optional[str] = None
+    Returns dict with summary totals.
+    """
+    return render_pnl_full(aggregate_ledger(ledger), output_file, silent)
 
-    for line in lines:
-        section_match = re.match(r'^(\d{4})\s+[^,]', line)
-        if section_match:
-            code = section_match.group(1)
-            current_account_code = code if code in PNL_ACCOUNTS else None
-            continue
 
-        if line.startswith("Total for "):
-            current_account_code = None
-            continue
+def month_end_description(year: int, month: int) -> str:
+    """The last day of a month, e.g. "November 30, 2025"."""
+    return f"{MONTHS[month - 1]} {calendar.monthrange(year, month)[1]}, {year}"
 
-        if current_account_code and line.startswith(","):
-            fields = parse_csv_line(line)
-            if len(fields) < 9:
-                continue
 
-            date_str = fields[1]
-            amount_str = fields[8]
+def period_description(first: Tuple[int, int], last: Tuple[int, int]) -> str:
+    """Date range line for first..last inclusive, e.g. "January 1, 2024-November 30, 2025"."""
+    first_year, first_month = first
+    return f"{MONTHS[first_month - 1]} 1, {first_year}-{month_end_description(*last)}"
 
-            if not date_str or not amount_str:
-                continue
 
-            date_parts = parse_date(date_str)
-            if not date_parts:
-                continue
+def render_pnl_full(
+    matrix: AccountMonthMatrix,
+    output_file: Path,
+    silent: bool = False,
+    first: Tuple[int, int] = FIRST_MONTH,
+    last: Tuple[int, int] = LAST_MONTH,
+) -> Dict[str, float]:
+    """Render the full-range P&L from a matrix (Jan 2024 - Nov 2025 unless given another range)."""
+    summary = render_pnl(
+        matrix.window(first, last),
+        month_columns(first, last),
+        "Profit and Loss by Month",
+        period_description(first, last),
+        output_file,
+    )
+
+    if not silent:
+        print(f"\n  P&L generated: {output_file.name}")
+        print(f"    Net Income: ${summary['net_income']:,.2f}")
+
+    return summary
 
-            year, month = date_parts
-            month_idx = get_month_index(year, month)
-            if month_idx is None:
-                continue
 
-            amount = parse_amount(amount_str)
-            data[current_account_code][month_idx] += amount
+def render_pnl(
+    data: Dict[str, List[int]],
+    month_cols: List[str],
+    title: str,
+    period: str,
+    output_file: Path,
+    total_column: bool = True,
+) -> Dict[str, float]:
+    """
+    Write a P&L report for one period window.
+
+    Args:
+        data: account code -> monthly amounts in cents, one per entry in month_cols
+        month_cols: month column headers
+        title: first header line, e.g. "Profit and Loss by Month"
+        period: date range line, e.g. "January 1, 2024-November 30, 2025"
+        output_file: Path for output P&L CSV
+        total_column: whether to end every row with its total over the columns
+            (off for columns that overlap, such as rolling TTM totals)
+
+    Returns dict with summary totals: over all columns, or of the last column
+    when there is no Total column.
+    """
+    num_months = len(month_cols)
 
     # Generate output
     output: List[str] = []
-    empty_cols = "," * (num_months + 1)
+    empty_cols = "," * (num_months + 1 if total_column else num_months)
 
-    output.append(f"Profit and Loss by Month{empty_cols}")
+    output.append(f"{title}{empty_cols}")
     output.append(f"And Company (Spicy Cubes){empty_cols}")
-    output.append(f'"January 1, 2024-November 30, 2025"{empty_cols}')
+    output.append(f'"{period}"{empty_cols}')
     output.append("")
-    output.append(f"Distribution account,{','.join(month_cols)},Total")
-
-    def output_account_row(code: str) -> List[float]:
-        config = PNL_ACCOUNTS[code]
-        row_data = data[code]
-        row_total = sum(row_data)
-        if row_total != 0 or any(v != 0 for v in row_data):
-            formatted = [format_for_csv(v) for v in row_data]
-            output.append(f"{config.display_name},{','.join(formatted)},{format_for_csv(row_total)}")
-        return row_data
-
-    def output_total(label: str, totals: List[float], is_dollar: bool = True):
+    output.append(f"Distribution account,{','.join(month_cols)}{',Total' if total_column else ''}")
+
+    def output_account_rows(group: str) -> None:
+        for code in ROLLUP_GROUPS[group]:
+            config = PNL_ACCOUNTS[code]
+            row_data = data[code]
+            row_total = sum(row_data)
+            if row_total != 0 or any(v != 0 for v in row_data):
+                formatted = [format_for_csv(v) for v in row_data]
+                if total_column:
+                    formatted.append(format_for_csv(row_total))
+                output.append(f"{config.display_name},{','.join(formatted)}")
+
+    def output_total(label: str, totals: List[int], is_dollar: bool = True):
         total_sum = sum(totals)
         formatted = [format_for_csv(v) for v in totals]
         if is_dollar:
@@ -252,28 +415,28 @@ def generate_pnl(input_file: Path, output_file: Path, silent: bool = False) -> D
                 formatted_sum = f'"${format_number(total_sum)}"'
         else:
             formatted_sum = format_for_csv(total_sum)
-        output.append(f"{label},{','.join(formatted)},{formatted_sum}")
+        if total_column:
+            formatted.append(formatted_sum)
+        output.append(f"{label},{','.join(formatted)}")
 
-    def add_arrays(a: List[float], b: List[float]) -> List[float]:
+    def add_arrays(a: List[int], b: List[int]) -> List[int]:
         return [x + y for x, y in zip(a, b)]
 
-    def subtract_arrays(a: List[float], b: List[float]) -> List[float]:
+    def subtract_arrays(a: List[int], b: List[int]) -> List[int]:
         return [x - y for x, y in zip(a, b)]
 
+    totals = rollup_totals(data, num_months)
+
     # Income
     output.append(f"Income{empty_cols}")
-    income_accounts = ["4000", "4010", "4020", "4030", "4040"]
-    income_total = [0.0] * num_months
-    for code in income_accounts:
-        income_total = add_arrays(income_total, output_account_row(code))
+    output_account_rows("Income")
+    income_total = totals["Income"]
     output_total("Total for Income", income_total)
 
     # COGS
     output.append(f"Cost of Goods Sold{empty_cols}")
-    cogs_accounts = ["5000", "5010", "5030", "5040", "5050"]
-    cogs_total = [0.0] * num_months
-    for code in cogs_accounts:
-        cogs_total = add_arrays(cogs_total, output_account_row(code))
+    output_account_rows("Cost of Goods Sold")
+    cogs_total = totals["Cost of Goods Sold"]
     output_total("Total for Cost of Goods Sold", cogs_total)
 
     # Gross Profit
@@ -284,25 +447,16 @@ def generate_pnl(input_file: Path, output_file: Path, silent: bool = False) -> D
     output.append(f"Expenses{empty_cols}")
     output.append(f"6000 Cost of Sales{empty_cols}")
 
-    cost_of_sales_accounts = ["6010", "6020", "6035", "6040", "6055", "6057", "6065", "6070", "6075"]
-    cost_of_sales_total = [0.0] * num_months
-    for code in cost_of_sales_accounts:
-        cost_of_sales_total = add_arrays(cost_of_sales_total, output_account_row(code))
+    output_account_rows("6000 Cost of Sales")
+    cost_of_sales_total = totals["6000 Cost of Sales"]
     output_total("Total for 6000 Cost of Sales", cost_of_sales_total)
 
-    advertising_accounts = ["6100", "6110", "6120", "6125", "6130", "6140", "6145", "6150"]
-    advertising_total = [0.0] * num_months
-    for code in advertising_accounts:
-        advertising_total = add_arrays(advertising_total, output_account_row(code))
+    output_account_rows("6100 Advertising & Marketing")
+    advertising_total = totals["6100 Advertising & Marketing"]
     output_total("Total for 6100 Advertising & Marketing", advertising_total)
 
-    other_expense_accounts = [
-        "6210", "6240", "6250", "6260", "6290", "6300", "6320", "6330",
-        "6340", "6360", "6375", "6390", "6410", "6450", "6470", "6495"
-    ]
-    other_expense_total = [0.0] * num_months
-    for code in other_expense_accounts:
-        other_expense_total = add_arrays(other_expense_total, output_account_row(code))
+    output_account_rows("Other Operating Expenses")
+    other_expense_total = totals["Other Operating Expenses"]
 
     expenses_total = add_arrays(add_arrays(cost_of_sales_total, advertising_total), other_expense_total)
     output_total("Total for Expenses", expenses_total)
@@ -313,18 +467,14 @@ def generate_pnl(input_file: Path, output_file: Path, silent: bool = False) -> D
 
     # Other Income
     output.append(f"Other Income{empty_cols}")
-    other_income_accounts = ["7000", "7010"]
-    other_income_total = [0.0] * num_months
-    for code in other_income_accounts:
-        other_income_total = add_arrays(other_income_total, output_account_row(code))
+    output_account_rows("Other Income")
+    other_income_total = totals["Other Income"]
     output_total("Total for Other Income", other_income_total)
 
     # Other Expenses
     output.append(f"Other Expenses{empty_cols}")
-    other_expenses_accounts = ["8005"]
-    other_expenses_total = [0.0] * num_months
-    for code in other_expenses_accounts:
-        other_expenses_total = add_arrays(other_expenses_total, output_account_row(code))
+    output_account_rows("Other Expenses")
+    other_expenses_total = totals["Other Expenses"]
     output_total("Total for Other Expenses", other_expenses_total)
 
     # Net Other Income
@@ -348,16 +498,14 @@ def generate_pnl(input_file: Path, output_file: Path, silent: bool = False) -> D
     with open(output_file, 'w', encoding='utf-8') as f:
         f.write('\n'.join(output))
 
+    # Summary totals in dollars (exact to the cent, as the cents are)
+    summarize = sum if total_column else (lambda values: values[-1] if values else 0)
     summary = {
-        "income": sum(income_total),
-        "cogs": sum(cogs_total),
-        "gross_profit": sum(gross_profit),
-        "expenses": sum(expenses_total),
-        "net_income": sum(net_income),
+        "income": summarize(income_total) / 100,
+        "cogs": summarize(cogs_total) / 100,
+        "gross_profit": summarize(gross_profit) / 100,
+        "expenses": summarize(expenses_total) / 100,
+        "net_income": summarize(net_income) / 100,
     }
 
-    if not silent:
-        print(f"\n  P&L generated: {output_file.name}")
-        print(f"    Net Income: ${summary['net_income']:,.2f}")
-
     return summary
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+NumPy P&L Backend
+
+Optional vectorized implementation of the P&L aggregation and roll-ups,
+used by pnl_generator when NumPy is installed (see AGGREGATION_BACKEND).
+
+- Aggregation: the ledger's array columns are viewed as NumPy arrays
+  without copying, reduced to (account index, month index, amount) for the
+  P&L transaction rows, and summed into the account x month matrix with a
+  single bincount. Amounts are integer cents; bincount sums them as
+  float64, which is exact while the absolute amounts add up to less than
+  2**53 cents, and larger ledgers fall back to an int64 np.add.at. Either
+  way the totals equal the pure-Python ones exactly.
+- Roll-ups: category totals are a 0/1 roll-up matrix (categories x
+  accounts) times the account x month matrix, in int64.
+"""
+
+from datetime import date
+from typing import Dict, List
+
+import numpy as np
+
+from ledger import Ledger, LINE_TXN
+
+# Proleptic ordinal of 1970-01-01, the datetime64 epoch
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+# Largest total that float64 (and so bincount) represents exactly
+EXACT_FLOAT_LIMIT = 2 ** 53
+
+
+def aggregate_ledger_numpy(ledger: Ledger, account_codes: List[str]) -> Dict[str, Dict[int, int]]:
+    """
+    Sum P&L transactions into account code -> month key -> total.
+
+    Only months with at least one transaction get a cell, as in the
+    pure-Python aggregation.
+    """
+    cells: Dict[str, Dict[int, int]] = {code: {} for code in account_codes}
+    if not len(ledger):
+        return cells
+
+    kind = np.frombuffer(ledger.kind, dtype=np.int8)
+    account = np.frombuffer(ledger.account, dtype=np.int16)
+    in_section = np.frombuffer(ledger.in_section, dtype=np.int8)
+    ordinals = np.frombuffer(ledger.date, dtype=np.int32)
+    amounts = np.frombuffer(ledger.amount, dtype=np.int64)
+
+    # Account code -> row of the matrix, -1 for accounts outside the P&L
+    account_index = np.full(10000, -1, dtype=np.int64)
+    for i, code in enumerate(account_codes):
+        account_index[int(code)] = i
+
+    rows = np.flatnonzero(
+        (kind == LINE_TXN) & (in_section != 0) & (ordinals != 0) & (account >= 0)
+    )
+    acct = account_index[account[rows]]
+    keep = acct >= 0
+    rows = rows[keep]
+    acct = acct[keep]
+    if not len(rows):
+        return cells
+
+    # Date ordinal -> absolute month key (year * 12 + month - 1)
+    days = (ordinals[rows].astype(np.int64) - EPOCH_ORDINAL).astype('datetime64[D]')
+    keys = days.astype('datetime64[M]').astype(np.int64) + 1970 * 12
+    first_key = int(keys.min())
+    span = int(keys.max()) - first_key + 1
+
+    flat = acct * span + (keys - first_key)
+    size = len(account_codes) * span
+    values = amounts[rows]
+    if int(np.abs(values).sum()) < EXACT_FLOAT_LIMIT:
+        totals = np.bincount(flat, weights=values, minlength=size).astype(np.int64)
+    else:
+        totals = np.zeros(size, dtype=np.int64)
+        np.add.at(totals, flat, values)
+    totals = totals.reshape(-1, span)
+    counts = np.bincount(flat, minlength=size).reshape(-1, span)
+
+    for i, j in zip(*np.nonzero(counts)):
+        cells[account_codes[i]][first_key + int(j)] = int(totals[i, j])
+    return cells
+
+
+def rollup_matrix(groups: Dict[str, List[str]], account_codes: List[str]) -> np.ndarray:
+    """0/1 matrix with one row per category and one column per account."""
+    column = {code: j for j, code in enumerate(account_codes)}
+    matrix = np.zeros((len(groups), len(account_codes)), dtype=np.int64)
+    for i, codes in enumerate(groups.values()):
+        for code in codes:
+            matrix[i, column[code]] = 1
+    return matrix
+
+
+def rollup_totals_numpy(
+    data: Dict[str, List[int]],
+    groups: Dict[str, List[str]],
+    num_months: int,
+) -> Dict[str, List[int]]:
+    """Category name -> monthly totals (cents), for each category in groups."""
+    account_codes = [code for codes in groups.values() for code in codes]
+    values = np.array([data[code] for code in account_codes], dtype=np.int64).reshape(-1, num_months)
+    totals = rollup_matrix(groups, account_codes) @ values
+
+    return {name: totals[i].tolist() for i, name in enumerate(groups)}
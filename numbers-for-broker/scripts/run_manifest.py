@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Run Manifest Module
+
+Per-step metrics for a pipeline run, written by run_pipeline.py as JSON so
+a slow or surprising run can be compared with earlier ones step by step.
+
+For every step the manifest records wall and CPU time, the process's peak
+RSS once the step finished, its line count in and out, the size of its
+output file when it wrote one, how many postings it added and removed
+(in-memory runs, see PostingDelta in ledger.py), and the P&L summary of
+its output.
+
+With diff=True (run_pipeline.py --manifest-diff) a step also records the
+size of its input and output as export text and how many transaction rows
+it added, removed, moved to another section or modified in place. Those
+are worked out by diffing the transaction lines before and after the
+step, which costs more than most steps do, so it is off by default: a
+line that only changed section was moved; a removed and an added line in
+the same section with the same name and memo were one modified row (e.g.
+a shifted date); whatever is left was removed or added.
+"""
+
+import json
+import sys
+import time
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from csv_tokenizer import parse_csv_line
+from ledger import Ledger, LINE_TXN, NO_ACCOUNT, COL_MEMO, COL_NAME
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Peak resident set size of this process so far, in MB."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def ledger_bytes(ledger: Ledger) -> int:
+    """Size of the ledger written out as an export."""
+    return sum(len(line.encode('utf-8')) for line in ledger.raw) + max(len(ledger.raw) - 1, 0)
+
+
+def txn_lines(ledger: Ledger) -> Counter:
+    """(line, section) of every transaction row, as a multiset."""
+    kind = ledger.kind
+    account = ledger.account
+    in_section = ledger.in_section
+    raw = ledger.raw
+    # Rows outside an account section (e.g. under "Credit Card") have no section of their own
+    return Counter(
+        (raw[row], account[row] if in_section[row] else NO_ACCOUNT)
+        for row in range(len(raw)) if kind[row] == LINE_TXN
+    )
+
+
+def modification_key(line: str, account: int) -> Tuple[int, str, str]:
+    fields = parse_csv_line(line)
+    name = fields[COL_NAME] if len(fields) > COL_NAME else ""
+    memo = fields[COL_MEMO] if len(fields) > COL_MEMO else ""
+    return account, name, memo
+
+
+def _take(rows: Counter, count: int) -> Counter:
+    """Remove count rows from a multiset, in any order; returns what was left."""
+    left = Counter(rows)
+    for key in rows:
+        taken = min(left[key], count)
+        left[key] -= taken
+        count -= taken
+        if not count:
+            break
+    return +left
+
+
+def row_changes(before: Counter, after: Counter) -> Dict[str, int]:
+    """Count the transaction rows added, removed, moved and modified between two snapshots."""
+    common = before & after
+    removed: Dict[str, Counter] = {}
+    for (line, account), count in (before - common).items():
+        removed.setdefault(line, Counter())[account] += count
+    added: Dict[str, Counter] = {}
+    for (line, account), count in (after - common).items():
+        added.setdefault(line, Counter())[account] += count
+
+    # The same line in a different section was moved
+    moved = 0
+    for line in removed.keys() & added.keys():
+        count = min(sum(removed[line].values()), sum(added[line].values()))
+        moved += count
+        removed[line] = _take(removed[line], count)
+        added[line] = _take(added[line], count)
+
+    # A removed and an added line with the same section, name and memo were modified
+    left_removed = Counter()
+    for line, accounts in removed.items():
+        for account, count in accounts.items():
+            left_removed[modification_key(line, account)] += count
+    left_added = Counter()
+    for line, accounts in added.items():
+        for account, count in accounts.items():
+            left_added[modification_key(line, account)] += count
+    modified = sum((left_removed & left_added).values())
+
+    return {
+        "added": sum(left_added.values()) - modified,
+        "removed": sum(left_removed.values()) - modified,
+        "moved": moved,
+        "modified": modified,
+    }
+
+
+class StepProbe:
+    """Measures one step: created just before it runs, finished with its output."""
+
+    def __init__(self, ledger: Ledger, diff: bool = False):
+        self.lines_in = len(ledger)
+        self.diff = diff
+        if diff:
+            self.bytes_in = ledger_bytes(ledger)
+            # Taken up front: steps may rewrite the rows of the ledger they are given
+            self.before = txn_lines(ledger)
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.process_time()
+
+    def finish(self, ledger: Ledger, pnl: Dict[str, float], output_file: Optional[Path] = None) -> Dict:
+        wall = time.perf_counter() - self.wall_start
+        cpu = time.process_time() - self.cpu_start
+        metrics = {
+            "wall_seconds": round(wall, 4),
+            "cpu_seconds": round(cpu, 4),
+            "peak_rss_mb": peak_rss_mb(),
+        }
+        rows = {"lines_in": self.lines_in, "lines_out": len(ledger)}
+        if self.diff:
+            metrics["input_bytes"] = self.bytes_in
+            metrics["output_bytes"] = ledger_bytes(ledger)
+            rows.update(row_changes(self.before, txn_lines(ledger)))
+        elif output_file is not None:
+            metrics["output_bytes"] = output_file.stat().st_size
+        metrics["rows"] = rows
+        metrics["pnl"] = pnl
+        return metrics
+
+
+class RunManifest:
+    """
+    The manifest of one pipeline run.
+
+    Steps skipped by the step cache carry their metrics over from the
+    previous manifest when it recorded the same cache key.
+    """
+
+    def __init__(self, manifest_file: Path, mode: str, input_file: Path):
+        self.manifest_file = manifest_file
+        self.started = datetime.now()
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.process_time()
+        self.mode = mode
+        self.input_file = input_file
+        self.steps: list = []
+        self.previous: Dict[str, Dict] = {}
+        try:
+            with open(manifest_file, 'r', encoding='utf-8') as f:
+                self.previous = {entry["step"]: entry for entry in json.load(f)["steps"]}
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    def add_step(self, step_name: str, description: str, status: str, metrics: Dict, key: Optional[str] = None) -> None:
+        entry = {"step": step_name, "description": description, "status": status}
+        if key is not None:
+            entry["cache_key"] = key
+        entry.update(metrics)
+        self.steps.append(entry)
+
+    def add_cached_step(self, step_name: str, description: str, key: str) -> None:
+        previous = self.previous.get(step_name, {})
+        metrics = {}
+        if previous.get("cache_key") == key:
+            metrics = {name: value for name, value in previous.items() if name in ("rows", "postings", "pnl", "output_bytes")}
+        self.add_step(step_name, description, "cached", metrics, key)
+
+    def summary(self) -> Dict:
+        timed = [entry for entry in self.steps if "wall_seconds" in entry]
+        slowest = max(timed, key=lambda entry: entry["wall_seconds"], default=None)
+        final = self.steps[-1] if self.steps else {}
+        return {
+            "mode": self.mode,
+            "started": self.started.isoformat(timespec="seconds"),
+            "input_file": str(self.input_file),
+            "input_bytes": self.input_file.stat().st_size if self.input_file.exists() else None,
+            "wall_seconds": round(time.perf_counter() - self.wall_start, 4),
+            "cpu_seconds": round(time.process_time() - self.cpu_start, 4),
+            "peak_rss_mb": peak_rss_mb(),
+            "steps_run": sum(1 for entry in self.steps if entry["status"] != "cached"),
+            "steps_cached": sum(1 for entry in self.steps if entry["status"] == "cached"),
+            "slowest_step": slowest["step"] if slowest else None,
+            "net_income": final.get("pnl", {}).get("net_income"),
+        }
+
+    def write(self) -> None:
+        self.manifest_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.manifest_file, 'w', encoding='utf-8') as f:
+            json.dump({"summary": self.summary(), "steps": self.steps}, f, indent=2)
+            f.write('\n')
@@ -10,52 +10,160 @@ This script runs all 6 transformation steps in sequence:
 5. Smooth shipping costs
 6. Apply exclusions
 
-Usage: python3 run_pipeline.py
+The steps run in-process: the input export is parsed once into a Ledger
+and the same in-memory ledger is handed from one step to the next. Only the final
+output is written unless --write-intermediates is given. With --reports,
+every report family (TTM, annual, through-October, rolling TTM) is
+rendered from each step's in-memory ledger as well, so no step file has
+to be re-parsed.
+
+Steps whose inputs are unchanged since the last run are skipped: each step
+records a content-hash cache key (see step_cache.py) and the outputs the
+run wrote, and a step whose key still matches reuses its previous output
+and P&L as long as that run wrote every output the current flags ask for
+and none has changed since. The run resumes from the ledger of the last
+skipped step, which each step a later one runs on keeps as a binary
+snapshot in output/.step-cache/. Use --no-cache to re-run everything;
+nothing is cached for resuming then.
+
+Each step's P&L is built from the previous step's account x month matrix
+and the postings the step added and removed (recorded by the ledger while
+the step runs, see PostingDelta in ledger.py), so only the first step run
+aggregates a whole ledger.
+
+Every transaction file written gets a binary columnar snapshot beside it
+(see ledger_snapshot.py), which the report generators load instead of
+parsing the CSV.
+Each step's matrix is also persisted as an account cube with the
+subcategory and category roll-ups (see account_cube.py) beside the file
+its reports are generated from, so the report generators and ad-hoc
+drill-downs never aggregate transactions again.
+
+With --stream, the export is never held in memory: it is read in chunks
+that flow through every step as a chain of generator stages (see
+streaming.py), so peak memory stays flat however large the export is. The
+step cache is not used in this mode.
+
+Every run writes a JSON manifest (output/run-manifest.json by default, see
+run_manifest.py) with each step's wall and CPU time, peak RSS, lines in
+and out, output file size, postings added/removed and P&L summary. With
+--manifest-diff it also records each step's input and output size and the
+rows it added, removed, moved and modified, from a diff of its
+transaction lines. Streamed runs only record each step's output rows and
+P&L, plus run-wide timings.
+
+Usage: python3 run_pipeline.py [--write-intermediates] [--reports] [--no-cache] [--stream]
+                               [--manifest FILE] [--manifest-diff]
 """
 
-import subprocess
-import sys
+import argparse
+import importlib
 from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from account_cube import save_cube
+from ledger import Ledger, PostingDelta, read_lines
+from ledger_snapshot import line_ids, load_standalone_snapshot, save_ledger, save_standalone_snapshot
+from pnl_generator import aggregate_ledger, render_pnl_full
+from generate_reports import REPORT_FAMILIES, render_step_reports
+from run_manifest import RunManifest, StepProbe
+from step_cache import StepCache, input_cache_key, step_cache_key
+from streaming import LineCounter, MatrixAccumulator, read_chunks, write_chunks
 
 SCRIPT_DIR = Path(__file__).parent
+BASE_DIR = SCRIPT_DIR.parent
+INPUT_FILE = BASE_DIR / "input-data" / "all-txn-2024-2025.csv"
+OUTPUT_DIR = BASE_DIR / "output"
+FINAL_OUTPUT_FILE = OUTPUT_DIR / "all-txn-2024-2025-final.csv"
+CACHE_DIR = OUTPUT_DIR / ".step-cache"
+MANIFEST_FILE = OUTPUT_DIR / "run-manifest.json"
 
 STEPS = [
-    ("step0_baseline_pnl.py", "Baseline P&L (Original Data)"),
-    ("step1_add_november_revenue.py", "Add November Shopify Revenue"),
-    ("step2_apply_reclassifications.py", "Apply Reclassifications"),
-    ("step3_replace_nov_dec_affiliates.py", "Replace Nov/Dec Affiliate Payouts"),
-    ("step4_shift_affiliate_dates.py", "Shift Affiliate Dates"),
-    ("step5_smooth_shipping.py", "Smooth Shipping Costs"),
-    ("step6_apply_exclusions.py", "Apply Exclusions"),
+    ("step0_baseline_pnl", "Baseline P&L (Original Data)"),
+    ("step1_add_november_revenue", "Add November Shopify Revenue"),
+    ("step2_apply_reclassifications", "Apply Reclassifications"),
+    ("step3_replace_nov_dec_affiliates", "Replace Nov/Dec Affiliate Payouts"),
+    ("step4_shift_affiliate_dates", "Shift Affiliate Dates"),
+    ("step5_smooth_shipping", "Smooth Shipping Costs"),
+    ("step6_apply_exclusions", "Apply Exclusions"),
 ]
 
 
-def main():
-    print("=" * 80)
-    print("SPICY CUBES P&L TRANSFORMATION PIPELINE")
-    print("=" * 80)
-    print(f"\nRunning {len(STEPS)} transformation steps...\n")
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run the P&L transformation pipeline.")
+    parser.add_argument(
+        "--write-intermediates",
+        action="store_true",
+        help="Also write each step's transaction CSV to output/ (needed by the report generators)",
+    )
+    parser.add_argument(
+        "--reports",
+        action="store_true",
+        help="Also render the TTM, annual, through-October and rolling TTM P&L reports for every step",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Re-run every step even if its cache key is unchanged",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Stream the export through the steps in chunks instead of loading it (constant memory)",
+    )
+    parser.add_argument(
+        "--manifest",
+        type=Path,
+        default=MANIFEST_FILE,
+        help="Where to write the run manifest (default output/run-manifest.json)",
+    )
+    parser.add_argument(
+        "--manifest-diff",
+        action="store_true",
+        help="Also diff every step's transaction lines for the manifest (rows added/removed/moved/modified)",
+    )
+    return parser.parse_args()
 
-    for i, (script, description) in enumerate(STEPS, 1):
-        print(f"\n{'#' * 80}")
-        print(f"# STEP {i}/{len(STEPS)}: {description}")
-        print(f"{'#' * 80}\n")
 
-        script_path = SCRIPT_DIR / script
-        result = subprocess.run(
-            [sys.executable, str(script_path)],
-            capture_output=False
-        )
+def writes_output(step, args) -> bool:
+    """Whether a step's transaction CSV is written to output/."""
+    if not hasattr(step, "transform"):
+        return False
+    return args.write_intermediates or step.OUTPUT_FILE == FINAL_OUTPUT_FILE
+
 
-        if result.returncode != 0:
-            print(f"\nERROR: Step {i} failed with return code {result.returncode}")
-            sys.exit(1)
+def report_file(step, args) -> Optional[Path]:
+    """The transaction file a step's reports are generated from, if the run leaves one."""
+    if not hasattr(step, "transform"):
+        return INPUT_FILE
+    return step.OUTPUT_FILE if writes_output(step, args) else None
 
+
+def save_step_cube(step, args, matrix) -> None:
+    """Persist a step's account cube beside its report file (see account_cube.py)."""
+    csv_file = report_file(step, args)
+    if csv_file is not None:
+        save_cube(csv_file, matrix)
+
+
+def expected_outputs(step, step_name: str, args) -> List[Path]:
+    """Files a step must have left behind for it to be skipped."""
+    outputs = [step.PNL_FILE]
+    if writes_output(step, args):
+        outputs.append(step.OUTPUT_FILE)
+    if args.reports:
+        outputs.extend(OUTPUT_DIR / subdir / f"pnl_{step_name}.csv" for subdir, _ in REPORT_FAMILIES)
+    return outputs
+
+
+def print_summary(args) -> None:
     print("\n" + "=" * 80)
     print("PIPELINE COMPLETE")
     print("=" * 80)
     print("\nOutputs:")
     print("  Transformed data: output/all-txn-2024-2025-final.csv")
+    if args.write_intermediates:
+        print("  Intermediate data: output/step*.csv, output/all-txn-2024-2025-transformed.csv")
     print("\nP&L Reports (one per step):")
     print("  pnl_step0.csv - Baseline (original data)")
     print("  pnl_step1.csv - After November revenue")
@@ -64,6 +172,169 @@ def main():
     print("  pnl_step4.csv - After date shifting")
     print("  pnl_step5.csv - After shipping smoothing")
     print("  pnl_step6.csv - Final (after exclusions)")
+    if args.reports:
+        print("\nPeriod reports: output/pnl-ttm-nov/, pnl-2024/, pnl-2025-ytd/, pnl-thru-oct/, pnl-rolling-ttm/")
+    print(f"\nRun manifest: {args.manifest}")
+
+
+def render_step_pnl(matrix, step_name: str, step, args) -> Dict[str, float]:
+    """Render a step's P&L (and with --reports every report family); returns the full-range summary."""
+    if args.reports:
+        return render_step_reports(matrix, step_name, OUTPUT_DIR)[0][1]
+    return render_pnl_full(matrix, step.PNL_FILE)
+
+
+def run_transform(step, ledger: Ledger) -> Tuple[Ledger, PostingDelta]:
+    """Run a step's transformation, recording the postings it adds and removes."""
+    changes = PostingDelta()
+    ledger.changes = changes
+    try:
+        result = step.transform(ledger)
+    finally:
+        ledger.changes = None
+    result.changes = None
+    return result, changes
+
+
+def run_streaming(steps, args, manifest: RunManifest) -> None:
+    """Run every step as a generator stage over the chunks of the export."""
+    chunks = read_chunks(INPUT_FILE)
+    taps = []
+    for step_name, step, _ in steps:
+        # Step 0 has no transformation, it only reports on the original data
+        if hasattr(step, "stream"):
+            chunks = step.stream(chunks)
+            if writes_output(step, args):
+                chunks = write_chunks(step.OUTPUT_FILE, chunks)
+        counter = LineCounter()
+        accumulator = MatrixAccumulator()
+        chunks = accumulator.tap(counter.tap(chunks))
+        taps.append((counter, accumulator))
+
+    print(f"Streaming {INPUT_FILE} through all steps")
+    for _ in chunks:
+        pass
+
+    for i, ((step_name, step, description), (counter, accumulator)) in enumerate(zip(steps, taps)):
+        print(f"\n{'#' * 80}")
+        print(f"# STEP {i + 1}/{len(STEPS)}: {description}")
+        print(f"{'#' * 80}\n")
+
+        metrics = {"rows": {"lines_out": counter.lines}}
+        if writes_output(step, args):
+            print(f"Output written to: {step.OUTPUT_FILE}")
+            metrics["output_bytes"] = step.OUTPUT_FILE.stat().st_size
+        print(f"Total lines: {counter.lines}")
+
+        matrix = accumulator.matrix()
+        metrics["pnl"] = render_step_pnl(matrix, step_name, step, args)
+        save_step_cube(step, args, matrix)
+        manifest.add_step(step_name, description, "streamed", metrics)
+
+
+def main():
+    args = parse_args()
+
+    print("=" * 80)
+    print("SPICY CUBES P&L TRANSFORMATION PIPELINE")
+    print("=" * 80)
+    print(f"\nRunning {len(STEPS)} transformation steps...\n")
+
+    steps = [
+        (module_name.split("_")[0], importlib.import_module(module_name), description)
+        for module_name, description in STEPS
+    ]
+
+    manifest = RunManifest(args.manifest, "stream" if args.stream else "memory", INPUT_FILE)
+
+    if args.stream:
+        run_streaming(steps, args, manifest)
+        manifest.write()
+        print_summary(args)
+        return
+
+    # Work out each step's cache key and the first step that has to run
+    cache = StepCache(CACHE_DIR)
+    keys = []
+    key = input_cache_key(INPUT_FILE, [Path(step.__file__) for _, step, _ in steps])
+    for step_name, step, _ in steps:
+        key = step_cache_key(key, step)
+        keys.append(key)
+
+    resume_at = 0
+    if not args.no_cache:
+        for step_name, step, _ in steps:
+            if not cache.is_current(step_name, keys[resume_at], expected_outputs(step, step_name, args)):
+                break
+            resume_at += 1
+
+    # The ledger of the last step that changes one is what the next step runs on
+    transforms = [i for i, (_, step, _) in enumerate(steps) if hasattr(step, "transform")]
+    resume_from = max((i for i in transforms if i < resume_at), default=None)
+
+    ledger = None
+    input_ids: Dict[str, int] = {}
+    if resume_at == len(steps):
+        print("All steps are cached - nothing to do")
+    else:
+        # The cached ledgers keep their lines as ids into the export's
+        input_lines = read_lines(INPUT_FILE)
+        if resume_from is not None:
+            step_name = steps[resume_from][0]
+            ledger = load_standalone_snapshot(cache.ledger_dir(step_name), keys[resume_from], input_lines)
+            if ledger is None:
+                print(f"No cached ledger for {step_name} - running every step")
+                resume_at = 0
+            else:
+                print(f"Loaded {len(ledger)} lines from the cached {step_name} ledger")
+        if ledger is None:
+            ledger = Ledger.from_lines(input_lines)
+            print(f"Loaded {len(ledger)} lines from {INPUT_FILE}")
+        if not args.no_cache:
+            input_ids = line_ids(input_lines)
+
+    matrix = None
+    for i, (step_name, step, description) in enumerate(steps):
+        print(f"\n{'#' * 80}")
+        print(f"# STEP {i + 1}/{len(STEPS)}: {description}")
+        print(f"{'#' * 80}\n")
+
+        if i < resume_at:
+            print("  Cached: inputs unchanged, reusing previous output and P&L")
+            manifest.add_cached_step(step_name, description, keys[i])
+            continue
+
+        probe = StepProbe(ledger, diff=args.manifest_diff)
+        # Only the first step run aggregates its input; later ones apply their change sets
+        if matrix is None:
+            matrix = aggregate_ledger(ledger)
+        changes = None
+
+        # Step 0 has no transformation, it only reports on the original data
+        if hasattr(step, "transform"):
+            ledger, changes = run_transform(step, ledger)
+            matrix = matrix.apply(changes)
+
+            if writes_output(step, args):
+                save_ledger(step.OUTPUT_FILE, ledger)
+                print(f"\nOutput written to: {step.OUTPUT_FILE}")
+            print(f"Total lines: {len(ledger)}")
+
+        pnl = render_step_pnl(matrix, step_name, step, args)
+        save_step_cube(step, args, matrix)
+        metrics = probe.finish(ledger, pnl, step.OUTPUT_FILE if writes_output(step, args) else None)
+        if changes is not None:
+            metrics["postings"] = {"added": len(changes.added), "removed": len(changes.removed)}
+        manifest.add_step(step_name, description, "ran", metrics, keys[i])
+
+        # Only a ledger a later step runs on is worth resuming from; it is tagged
+        # with its key, so one left over from another run is never loaded
+        if not args.no_cache and changes is not None and i < transforms[-1]:
+            save_standalone_snapshot(cache.ledger_dir(step_name), ledger, keys[i], input_ids)
+        cache.record(step_name, keys[i], expected_outputs(step, step_name, args))
+
+    manifest.write()
+    print_summary(args)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Section Index Module
+
+Byte-offset index of the account sections of a transaction export, so a
+step or ad-hoc tool that only needs a few accounts can seek straight to
+their rows instead of reading the whole file.
+
+For every section header the index records its four-digit account code,
+its line number, and the byte offsets of the header, of its first
+transaction line and of its "Total for" line. A section's span runs up to
+the next header, so reading it gives exactly the rows a ledger would put
+in that account's section (see Ledger.section_ranges).
+
+The index is built with one regex scan of the file and cached as
+sections.json in the file's snapshot directory (see ledger_snapshot.py),
+where it stays valid while the file's size and modification time do.
+
+Usage: python3 section_index.py FILE [CODE ...] [--lines]
+"""
+
+import argparse
+import json
+import re
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from ledger import Ledger, LINE_TXN, format_cents
+from ledger_snapshot import snapshot_dir, source_stamp
+
+# A section header or a "Total for" line, as the ledger recognises them
+SECTION_OR_TOTAL_RE = re.compile(rb'^[ \t]*(?:(\d{4})[^\S\n]+[^,\n]*,,,,,,,,,|Total for )', re.MULTILINE)
+
+INDEX_VERSION = 1
+
+
+@dataclass
+class SectionSpan:
+    """Where one account section sits in the export."""
+    code: int
+    line: int                 # line number of the header (its row in a ledger)
+    header: int               # byte offset of the header line
+    first_txn: Optional[int]  # byte offset of the first transaction line, None if there is none
+    total: Optional[int]      # byte offset of the "Total for" line, None if there is none
+    end: int                  # byte offset of the next header (or the end of the file)
+
+
+class SectionIndex:
+    """The section spans of one export, in file order."""
+
+    def __init__(self, input_file: Path, spans: List[SectionSpan]):
+        self.input_file = input_file
+        self.spans = spans
+        self.by_code: Dict[int, List[SectionSpan]] = {}
+        for span in spans:
+            self.by_code.setdefault(span.code, []).append(span)
+
+    def read_lines(self, code: int) -> List[str]:
+        """The lines of an account's sections, header to the next header, read with seeks."""
+        lines: List[str] = []
+        with open(self.input_file, 'rb') as f:
+            size = f.seek(0, 2)
+            for span in self.by_code.get(code, []):
+                f.seek(span.header)
+                # Newlines translated as in the text-mode reads of read_lines() in ledger.py
+                text = f.read(span.end - span.header).decode('utf-8').replace('\r\n', '\n').replace('\r', '\n')
+                section_lines = text.split('\n')
+                # A span ending at the next header ends with that header's line break
+                if span.end < size:
+                    section_lines.pop()
+                lines.extend(section_lines)
+        return lines
+
+    def read_section(self, code: int) -> Ledger:
+        """A ledger of just an account's sections."""
+        return Ledger.from_lines(self.read_lines(code))
+
+
+def build_section_index(input_file: Path) -> SectionIndex:
+    """Scan an export once for its section headers and Total lines."""
+    with open(input_file, 'rb') as f:
+        data = f.read()
+
+    spans: List[SectionSpan] = []
+    line = 0
+    counted_to = 0
+    for match in SECTION_OR_TOTAL_RE.finditer(data):
+        if match.group(1) is None:
+            # The first Total line after a header closes its section
+            if spans and spans[-1].total is None and spans[-1].end is None:
+                spans[-1].total = match.start()
+            continue
+        if spans:
+            spans[-1].end = match.start()
+        line += data.count(b'\n', counted_to, match.start())
+        counted_to = match.start()
+        spans.append(SectionSpan(int(match.group(1)), line, match.start(), None, None, None))
+    if spans:
+        spans[-1].end = len(data)
+
+    for span in spans:
+        # Transaction lines start with ","
+        first = data.find(b'\n,', span.header, span.total if span.total is not None else span.end)
+        span.first_txn = first + 1 if first != -1 else None
+    return SectionIndex(input_file, spans)
+
+
+def load_section_index(input_file: Path) -> SectionIndex:
+    """The section index of an export, from its cache when the file is unchanged."""
+    index_file = snapshot_dir(input_file) / "sections.json"
+    stamp = source_stamp(input_file)
+    try:
+        with open(index_file, 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+        if cached["version"] == INDEX_VERSION and cached["source"] == stamp:
+            return SectionIndex(input_file, [SectionSpan(**span) for span in cached["spans"]])
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    index = build_section_index(input_file)
+    index_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(index_file, 'w', encoding='utf-8') as f:
+        json.dump({"version": INDEX_VERSION, "source": stamp, "spans": [asdict(span) for span in index.spans]}, f)
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show the section index of a transaction export, or read single accounts.")
+    parser.add_argument("input_file", type=Path)
+    parser.add_argument("codes", nargs="*", type=int, help="Account codes to read (default: list every section)")
+    parser.add_argument("--lines", action="store_true", help="Print the lines of the requested accounts")
+    args = parser.parse_args()
+
+    index = load_section_index(args.input_file)
+
+    if not args.codes:
+        print(f"{'code':<6}{'line':>8}{'header':>12}{'first txn':>12}{'total':>12}{'bytes':>12}")
+        for span in index.spans:
+            first_txn = span.first_txn if span.first_txn is not None else "-"
+            total = span.total if span.total is not None else "-"
+            print(f"{span.code:<6}{span.line:>8}{span.header:>12}{first_txn:>12}{total:>12}{span.end - span.header:>12}")
+        return
+
+    for code in args.codes:
+        if args.lines:
+            for line in index.read_lines(code):
+                print(line)
+            continue
+        section = index.read_section(code)
+        txns = [row for row in range(len(section)) if section.kind[row] == LINE_TXN and section.in_section[row]]
+        total = sum(section.amount[row] for row in txns)
+        print(f"{code}: {len(txns)} transactions, total ${format_cents(total, grouped=True)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -9,11 +9,12 @@ Input: input-data/all-txn-2024-2025.csv
 Output: output/step1_november_revenue.csv
 """
 
-import re
 from pathlib import Path
-from typing import List
+from typing import Iterable, Iterator
 
-from pnl_generator import generate_pnl
+from ledger import Ledger, LINE_FRAGMENT, load_ledger
+from ledger_snapshot import save_ledger
+from pnl_generator import generate_pnl_from_ledger
 
 # Paths
 SCRIPT_DIR = Path(__file__).parent
@@ -32,29 +33,70 @@ NOVEMBER_ENTRIES = [
     {"account": "5000 Cost of Goods Sold", "memo": "Shopify COGS", "amount": 85199.62},
 ]
 
+# Inputs that determine this step's output (used by the pipeline step cache)
+REFERENCE_FILES = []
+RULE_TABLES = [NOVEMBER_ENTRIES]
 
-def add_november_revenue(lines: List[str]) -> List[str]:
+# Months this step adjusts as a whole (used by monthly_ingest.py)
+ADJUSTED_MONTHS = [(2025, 11)]
+# Each month's adjustment only depends on and posts to that month, so
+# monthly_ingest.py can run the step on the month's own export
+ADJUSTED_MONTHS_SEPARABLE = True
+
+
+class NovemberRevenueStage:
+    """Adds the journal entries; keeps its state across the chunks of a stream."""
+
+    def __init__(self):
+        self.added_accounts = set()
+        self.entries_added = 0
+
+    def process(self, ledger: Ledger) -> Ledger:
+        """Add November Shopify journal entries after matching account section headers."""
+        rows = []
+
+        for row in range(len(ledger)):
+            rows.append(row)
+
+            # Transaction lines start with "," and can never match an account name
+            if ledger.kind[row] >= LINE_FRAGMENT:
+                continue
+            trimmed = ledger.raw[row].strip()
+
+            for entry in NOVEMBER_ENTRIES:
+                if trimmed.startswith(entry["account"] + ",") and entry["account"] not in self.added_accounts:
+                    # Add journal entry after section header
+                    journal_line = f',11/30/2025,Journal Entry,2025_11_Shopify,,Shopify,{entry["memo"]},,{entry["amount"]:.2f},0.00'
+                    rows.append(ledger.append_line(journal_line))
+                    self.added_accounts.add(entry["account"])
+                    self.entries_added += 1
+                    print(f"  Added: {entry['account']}: {entry['memo']} = ${entry['amount']:,.2f}")
+
+        return ledger.select(rows)
+
+    def report(self) -> None:
+        print(f"\nTotal entries added: {self.entries_added}")
+
+
+def add_november_revenue(ledger: Ledger) -> Ledger:
     """Add November Shopify journal entries after matching account section headers."""
-    new_lines = []
-    added_accounts = set()
-    entries_added = 0
+    stage = NovemberRevenueStage()
+    ledger = stage.process(ledger)
+    stage.report()
+    return ledger
+
 
-    for line in lines:
-        new_lines.append(line)
-        trimmed = line.strip()
+def transform(ledger: Ledger) -> Ledger:
+    """Run this step on a ledger already held in memory."""
+    return add_november_revenue(ledger)
 
-        # Check for section headers
-        for entry in NOVEMBER_ENTRIES:
-            if trimmed.startswith(entry["account"] + ",") and entry["account"] not in added_accounts:
-                # Add journal entry after section header
-                journal_line = f',11/30/2025,Journal Entry,2025_11_Shopify,,Shopify,{entry["memo"]},,{entry["amount"]:.2f},0.00'
-                new_lines.append(journal_line)
-                added_accounts.add(entry["account"])
-                entries_added += 1
-                print(f"  Added: {entry['account']}: {entry['memo']} = ${entry['amount']:,.2f}")
 
-    print(f"\nTotal entries added: {entries_added}")
-    return new_lines
+def stream(chunks: Iterable[Ledger]) -> Iterator[Ledger]:
+    """Run this step as a generator stage over ledger chunks."""
+    stage = NovemberRevenueStage()
+    for chunk in chunks:
+        yield stage.process(chunk)
+    stage.report()
 
 
 def main():
@@ -65,25 +107,20 @@ def main():
     print(f"Output: {OUTPUT_FILE}")
 
     # Read input file
-    with open(INPUT_FILE, 'r', encoding='utf-8') as f:
-        content = f.read()
-
-    lines = content.split('\n')
-    print(f"\nLoaded {len(lines)} lines from input file\n")
+    ledger = load_ledger(INPUT_FILE)
+    print(f"\nLoaded {len(ledger)} lines from input file\n")
 
     # Run transformation
-    lines = add_november_revenue(lines)
+    ledger = transform(ledger)
 
     # Write output
-    OUTPUT_FILE.parent.mkdir(parents=True, exist_ok=True)
-    with open(OUTPUT_FILE, 'w', encoding='utf-8') as f:
-        f.write('\n'.join(lines))
+    save_ledger(OUTPUT_FILE, ledger)
 
     print(f"\nOutput written to: {OUTPUT_FILE}")
-    print(f"Total lines: {len(lines)}")
+    print(f"Total lines: {len(ledger)}")
 
     # Generate P&L
-    generate_pnl(OUTPUT_FILE, PNL_FILE)
+    generate_pnl_from_ledger(ledger, PNL_FILE)
 
     print(f"\n{'=' * 80}")
 
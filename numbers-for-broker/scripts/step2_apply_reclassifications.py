@@ -11,10 +11,16 @@ Output: output/step2_reclassified.csv
 
 import re
 from pathlib import Path
-from typing import List, Dict, Tuple
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 from collections import defaultdict
 
-from pnl_generator import generate_pnl
+from ledger import (
+    Ledger, LINE_OTHER, LINE_SECTION, LINE_TOTAL, LINE_FRAGMENT,
+    load_ledger,
+)
+from ledger_snapshot import save_ledger
+from pnl_generator import generate_pnl_from_ledger
+from streaming import chunk_ledgers, spill_files
 
 # Paths
 SCRIPT_DIR = Path(__file__).parent
@@ -24,73 +30,165 @@ OUTPUT_FILE = BASE_DIR / "output" / "step2_reclassified.csv"
 PNL_FILE = BASE_DIR / "output" / "pnl_step2.csv"
 
 
-# Reclassification rules: (from_account, to_account, criteria_function)
+# Matches every transaction in the from_account section
+MATCH_ALL = None
+
+# Reclassification rules: (from_account, to_account, patterns)
+# A transaction line matches a rule if it contains any of the patterns
+# (case-sensitive substrings). For each transaction the first matching rule
+# for its section wins.
 RECLASSIFICATIONS = [
     # 6120 -> 6125: $30 payments, Yvel, Gabriella (affiliate recruitment)
-    ("6120", "6125", lambda line: "$30" in line or "30.00" in line or "Yvel" in line or "Gabriella" in line),
+    ("6120", "6125", ("$30", "30.00", "Yvel", "Gabriella")),
 
     # 6495 -> 6140: eBay (phone farm equipment)
-    ("6495", "6140", lambda line: "eBay" in line.lower() or "ebay" in line),
+    # Only the lowercase spelling: the old `"eBay" in line.lower()` check could never match
+    ("6495", "6140", ("ebay",)),
 
     # 6495 -> 6470: Somos Hospitality (business lodging)
-    ("6495", "6470", lambda line: "Somos Hospitality" in line),
+    ("6495", "6470", ("Somos Hospitality",)),
 
     # 6375 -> 6330: Zamp (sales tax compliance)
-    ("6375", "6330", lambda line: "Zamp" in line or "ZAMP" in line),
+    ("6375", "6330", ("Zamp", "ZAMP")),
 
     # 6390 -> 6120: Luisa Mariana (affiliate payment)
-    ("6390", "6120", lambda line: "Luisa Mariana" in line),
+    ("6390", "6120", ("Luisa Mariana",)),
 
     # 6120 -> 6130: Elena Bastyte (branding work, not affiliate)
-    ("6120", "6130", lambda line: "Elena Bastyte" in line),
+    ("6120", "6130", ("Elena Bastyte",)),
 
-    # 6390 -> 6375: SPICY CUBES, Amazon test (QA testing)
-    ("6390", "6375", lambda line: "SPICY CUBES" in line or "Amazon test" in line.lower()),
+    # 6390 -> 6375: SPICY CUBES (QA testing)
+    # The old `"Amazon test" in line.lower()` check could never match
+    ("6390", "6375", ("SPICY CUBES",)),
 
     # 6340 -> 6470: All meals -> travel
-    ("6340", "6470", lambda line: True),  # All 6340 transactions
+    ("6340", "6470", MATCH_ALL),  # All 6340 transactions
 
     # 6360 -> 6240: Deel, Craigslist (contractor mgmt)
-    ("6360", "6240", lambda line: "Deel" in line or "Craigslist" in line or "CRAIGSLIST" in line),
+    ("6360", "6240", ("Deel", "Craigslist", "CRAIGSLIST")),
 
     # 6240 -> 6140: Creator Contact (software)
-    ("6240", "6140", lambda line: "Creator Contact" in line),
+    ("6240", "6140", ("Creator Contact",)),
 
     # 6240 -> 6330: Catching Numbers (accountant)
-    ("6240", "6330", lambda line: "Catching Numbers" in line),
+    ("6240", "6330", ("Catching Numbers",)),
 
     # 6100 -> 6110: Facebook/Facebk (paid ads)
-    ("6100", "6110", lambda line: "Facebook" in line or "Facebk" in line or "FACEBK" in line),
+    ("6100", "6110", ("Facebook", "Facebk", "FACEBK")),
 
     # 6100 -> 6120: Zelle, PayPal (affiliate payments)
-    ("6100", "6120", lambda line: "Zelle" in line or "PayPal" in line or "PAYPAL" in line),
+    ("6100", "6120", ("Zelle", "PayPal", "PAYPAL")),
 
     # 6100 -> 6120: UPS Store (shipping samples to affiliates)
-    ("6100", "6120", lambda line: "UPS" in line or "THE UPS STORE" in line),
+    ("6100", "6120", ("UPS", "THE UPS STORE")),
 
     # 6100 -> 6120: Vintage Paper Company (affiliate materials)
-    ("6100", "6120", lambda line: "Vintage Paper" in line or "VINTAGE PAPER" in line),
+    ("6100", "6120", ("Vintage Paper", "VINTAGE PAPER")),
 
     # 6100 -> 6120: Printful (affiliate materials)
-    ("6100", "6120", lambda line: "Printful" in line),
+    ("6100", "6120", ("Printful",)),
 
     # 6100 -> 6120: Craigslist (affiliate recruitment)
-    ("6100", "6120", lambda line: "Craigslist" in line or "CRAIGSLIST" in line),
+    ("6100", "6120", ("Craigslist", "CRAIGSLIST")),
 
     # 6145 -> 6140: CREATORHUNTER.IO, MAKEUGC.AI (software, not creatives)
-    ("6145", "6140", lambda line: "CREATORHUNTER" in line or "MAKEUGC" in line),
+    ("6145", "6140", ("CREATORHUNTER", "MAKEUGC")),
 
     # 6150 -> 6120: All Other Adv & Marketing -> Affiliate
-    ("6150", "6120", lambda line: True),
+    ("6150", "6120", MATCH_ALL),
 
     # 6470 -> 6375: Railway (software, not travel)
-    ("6470", "6375", lambda line: "RAILWAY" in line or "Railway" in line),
+    ("6470", "6375", ("RAILWAY", "Railway")),
 
     # 6240 -> 6330: LedgerGurus (accounting services)
-    ("6240", "6330", lambda line: "LedgerGurus" in line or "LEDGERGURUS" in line),
+    ("6240", "6330", ("LedgerGurus", "LEDGERGURUS")),
 ]
 
 
+def trie_regex(patterns: List[str]) -> str:
+    """
+    Regex matching any of the patterns, factored into a prefix trie.
+
+    Each position in a line is then checked by walking the trie along the
+    text (one branch per character), instead of trying every pattern in
+    turn, and the longest pattern starting at that position is matched.
+    """
+    trie: Dict[str, dict] = {}
+    for pattern in patterns:
+        node = trie
+        for char in pattern:
+            node = node.setdefault(char, {})
+        node[""] = {}  # a pattern ends here
+
+    def build(node: Dict[str, dict]) -> str:
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        # Prefer the longer pattern; fall back to ending here
+        return f"(?:{body})?" if "" in node else body
+
+    return build(trie)
+
+
+class AccountRules:
+    """
+    The reclassification rules for one source account, compiled for matching.
+
+    All of the account's patterns go into one prefix-trie regex, so a line is
+    scanned once however many rules there are. A search rejects lines that
+    match nothing; for the rest, a zero-width scan finds the longest pattern
+    starting at each position. Every pattern starting there is a prefix of
+    that match, so each pattern carries the best (lowest) rule index among
+    its own prefixes, and the lowest index over the line wins, exactly as if
+    the rules were tried in order. Rules after the first MATCH_ALL rule can
+    never fire and are dropped; the MATCH_ALL rule itself is the fallback.
+    """
+
+    def __init__(self, rules: List[Tuple[str, Optional[Tuple[str, ...]]]]):
+        self.targets: List[str] = []
+        self.fallback: Optional[str] = None
+        first_rule: Dict[str, int] = {}
+
+        for to_code, patterns in rules:
+            if patterns is MATCH_ALL:
+                self.fallback = to_code
+                break
+            for pattern in patterns:
+                first_rule.setdefault(pattern, len(self.targets))
+            self.targets.append(to_code)
+
+        # pattern -> lowest rule index among the patterns that are its prefixes
+        self.priority = {
+            pattern: min(index for prefix, index in first_rule.items() if pattern.startswith(prefix))
+            for pattern in first_rule
+        }
+
+        regex = trie_regex(list(first_rule))
+        self.search = re.compile(regex).search if regex else None
+        self.scan = re.compile(f"(?=({regex}))").finditer if regex else None
+
+    def match(self, line: str) -> Optional[str]:
+        """Target account of the first rule the line matches, or None."""
+        if self.search is None or not self.search(line):
+            return self.fallback
+        best = len(self.targets)
+        priority = self.priority
+        for m in self.scan(line):
+            best = min(best, priority[m.group(1)])
+            if best == 0:
+                break
+        return self.targets[best]
+
+
+def compile_reclassifications(rules) -> Dict[str, AccountRules]:
+    """Group the rule table by source account, preserving rule order."""
+    by_account: Dict[str, List[Tuple[str, Optional[Tuple[str, ...]]]]] = defaultdict(list)
+    for from_code, to_code, patterns in rules:
+        by_account[from_code].append((to_code, patterns))
+    return {code: AccountRules(account_rules) for code, account_rules in by_account.items()}
+
+
 # Section headers for each account
 SECTION_HEADERS = {
     "6100": "6100 Advertising & Marketing",
@@ -110,101 +208,125 @@ SECTION_HEADERS = {
     "6495": "6495 Discretionary Spending Expense",
 }
 
+# Inputs that determine this step's output (used by the pipeline step cache)
+REFERENCE_FILES = []
+RULE_TABLES = [RECLASSIFICATIONS, SECTION_HEADERS]
+
+
+# Where SectionSplitter.place() puts rows outside any section
+HEADER = "header"
+FOOTER = "footer"
 
-def parse_sections(lines: List[str]) -> Tuple[List[str], Dict[str, List[str]], List[str]]:
-    """
-    Parse file into header, sections dict, and footer.
-    Returns: (header_lines, sections_dict, footer_lines)
-    """
-    header_lines = []
-    sections: Dict[str, List[str]] = defaultdict(list)
-    footer_lines = []
 
-    current_section = None
-    in_header = True
+class SectionSplitter:
+    """Assigns rows to the report header, an account section, or the footer, in file order."""
 
-    for line in lines:
-        trimmed = line.strip()
+    def __init__(self):
+        self.current_section: Optional[str] = None
+        self.in_header = True
+
+    def place(self, ledger: Ledger, row: int) -> Optional[str]:
+        """HEADER, FOOTER, the row's section code, or None to drop the row."""
+        row_kind = ledger.kind[row]
 
         # Check for section header (starts with 4-digit code)
-        section_match = re.match(r'^(\d{4})\s+[^,]', trimmed)
-        if section_match:
-            in_header = False
-            current_section = section_match.group(1)
-            sections[current_section].append(line)
-            continue
+        if row_kind == LINE_SECTION:
+            self.in_header = False
+            self.current_section = ledger.section_code(row)
+            return self.current_section
 
         # Check for total line (ends section)
-        if trimmed.startswith("Total for "):
-            if current_section:
-                sections[current_section].append(line)
-            current_section = None
-            continue
+        if row_kind == LINE_TOTAL:
+            section = self.current_section
+            self.current_section = None
+            return section
 
         # Check for footer (after all sections)
-        if not in_header and current_section is None and trimmed and not trimmed.startswith(","):
+        if not self.in_header and self.current_section is None and row_kind == LINE_OTHER and ledger.raw[row].strip():
             # This could be a non-section line like a report footer
-            footer_lines.append(line)
-            continue
+            return FOOTER
 
-        if in_header:
-            header_lines.append(line)
-        elif current_section:
-            sections[current_section].append(line)
+        if self.in_header:
+            return HEADER
+        elif self.current_section:
+            return self.current_section
         else:
             # Between sections or end of file
-            footer_lines.append(line)
+            return FOOTER
+
+
+def parse_sections(ledger: Ledger) -> Tuple[List[int], Dict[str, List[int]], List[int]]:
+    """
+    Split ledger rows into header, sections dict, and footer.
+    Returns: (header_rows, sections_dict, footer_rows)
+    """
+    header_rows = []
+    sections: Dict[str, List[int]] = defaultdict(list)
+    footer_rows = []
+    splitter = SectionSplitter()
+
+    for row in range(len(ledger)):
+        place = splitter.place(ledger, row)
+        if place == HEADER:
+            header_rows.append(row)
+        elif place == FOOTER:
+            footer_rows.append(row)
+        elif place:
+            sections[place].append(row)
 
-    return header_lines, dict(sections), footer_lines
+    return header_rows, dict(sections), footer_rows
 
 
-def apply_reclassifications(sections: Dict[str, List[str]]) -> Dict[str, List[str]]:
+def apply_reclassifications(ledger: Ledger, sections: Dict[str, List[int]]) -> Dict[str, List[int]]:
     """
     Apply reclassification rules by moving transactions between sections.
     """
     reclassification_counts = defaultdict(int)
-    transactions_to_move: List[Tuple[str, str, str]] = []  # (from_section, to_section, line)
+    transactions_to_move: List[Tuple[str, str, int]] = []  # (from_section, to_section, row)
+    kind = ledger.kind
+    compiled = compile_reclassifications(RECLASSIFICATIONS)
 
     # First pass: identify transactions to move
-    for section_code, section_lines in sections.items():
-        new_section_lines = []
+    for section_code, section_rows in sections.items():
+        rules = compiled.get(section_code)
+        if rules is None:
+            continue
+        new_section_rows = []
 
-        for line in section_lines:
+        for row in section_rows:
             # Keep section headers and totals
-            if not line.strip().startswith(","):
-                new_section_lines.append(line)
+            if kind[row] < LINE_FRAGMENT:
+                new_section_rows.append(row)
                 continue
 
             # Check if this transaction should be reclassified
-            moved = False
-            for from_code, to_code, criteria in RECLASSIFICATIONS:
-                if section_code == from_code and criteria(line):
-                    transactions_to_move.append((from_code, to_code, line))
-                    reclassification_counts[f"{from_code} -> {to_code}"] += 1
-                    moved = True
-                    break
-
-            if not moved:
-                new_section_lines.append(line)
-
-        sections[section_code] = new_section_lines
-
-    # Second pass: add transactions to their new sections
-    for from_code, to_code, line in transactions_to_move:
+            to_code = rules.match(ledger.raw[row])
+            if to_code is not None:
+                transactions_to_move.append((section_code, to_code, row))
+                reclassification_counts[f"{section_code} -> {to_code}"] += 1
+            else:
+                new_section_rows.append(row)
+
+        sections[section_code] = new_section_rows
+
+    # Second pass: buffer moved transactions per target section, in move order
+    incoming: Dict[str, List[int]] = defaultdict(list)
+    for from_code, to_code, row in transactions_to_move:
         if to_code not in sections:
             # Create new section
             header = SECTION_HEADERS.get(to_code, f"{to_code} Unknown")
-            sections[to_code] = [f"{header},,,,,,,,,"]
-
-        # Find insertion point (before Total line if exists)
-        section_lines = sections[to_code]
-        insert_idx = len(section_lines)
-        for i, l in enumerate(section_lines):
-            if l.strip().startswith("Total for "):
+            sections[to_code] = [ledger.append_line(f"{header},,,,,,,,,")]
+        incoming[to_code].append(row)
+
+    # Splice each target's buffer in once, before its Total line if it has one
+    for to_code, moved_rows in incoming.items():
+        section_rows = sections[to_code]
+        insert_idx = len(section_rows)
+        for i, r in enumerate(section_rows):
+            if kind[r] == LINE_TOTAL:
                 insert_idx = i
                 break
-
-        section_lines.insert(insert_idx, line)
+        sections[to_code] = section_rows[:insert_idx] + moved_rows + section_rows[insert_idx:]
 
     print("\nReclassifications applied:")
     for key, count in sorted(reclassification_counts.items()):
@@ -214,28 +336,125 @@ def apply_reclassifications(sections: Dict[str, List[str]]) -> Dict[str, List[st
     return sections
 
 
-def rebuild_file(header_lines: List[str], sections: Dict[str, List[str]], footer_lines: List[str]) -> List[str]:
+def rebuild_file(ledger: Ledger, header_rows: List[int], sections: Dict[str, List[int]], footer_rows: List[int]) -> Ledger:
     """
-    Rebuild the file from header, sections, and footer.
+    Rebuild the ledger from header, sections, and footer.
     Sections are output in account code order.
     """
-    output_lines = header_lines.copy()
+    output_rows = header_rows.copy()
+    kind = ledger.kind
 
     # Sort sections by account code
     for code in sorted(sections.keys()):
-        section_lines = sections[code]
+        section_rows = sections[code]
 
         # Ensure section has a header
-        has_header = any(not l.strip().startswith(",") and not l.strip().startswith("Total")
-                        for l in section_lines)
+        has_header = any(kind[r] in (LINE_SECTION, LINE_OTHER) for r in section_rows)
         if not has_header and code in SECTION_HEADERS:
-            section_lines.insert(0, f"{SECTION_HEADERS[code]},,,,,,,,,")
+            output_rows.append(ledger.append_line(f"{SECTION_HEADERS[code]},,,,,,,,,"))
 
-        output_lines.extend(section_lines)
+        output_rows.extend(section_rows)
 
-    output_lines.extend(footer_lines)
+    output_rows.extend(footer_rows)
 
-    return output_lines
+    return ledger.select(output_rows)
+
+
+def transform(ledger: Ledger) -> Ledger:
+    """Run this step on a ledger already held in memory."""
+    # Parse into sections
+    header_rows, sections, footer_rows = parse_sections(ledger)
+    print(f"Found {len(sections)} sections")
+
+    # Apply reclassifications
+    sections = apply_reclassifications(ledger, sections)
+
+    # Rebuild file
+    return rebuild_file(ledger, header_rows, sections, footer_rows)
+
+
+def stream(chunks: Iterable[Ledger]) -> Iterator[Ledger]:
+    """
+    Run this step as a generator stage over ledger chunks.
+
+    Sections are re-emitted in account code order with moved rows spliced
+    in, so nothing can be passed on until the input is exhausted. Rows are
+    spilled to one temporary file per section (and per moved source/target
+    pair) instead of being held in memory, then read back in output order.
+    """
+    compiled = compile_reclassifications(RECLASSIFICATIONS)
+    splitter = SectionSplitter()
+    reclassification_counts = defaultdict(int)
+    kept: Dict[str, int] = {}          # section code -> rows kept, in order of first appearance
+    first_total: Dict[str, int] = {}   # section code -> kept rows before its first Total line
+    has_header = set()
+    moves: Dict[str, List[str]] = defaultdict(list)  # target -> source sections, in first-move order
+
+    with spill_files() as spills:
+        for chunk in chunks:
+            kind = chunk.kind
+            for row in range(len(chunk)):
+                place = splitter.place(chunk, row)
+                if place is None:
+                    continue
+                line = chunk.raw[row]
+                if place in (HEADER, FOOTER):
+                    spills.write(place, line)
+                    continue
+
+                rules = compiled.get(place)
+                if rules is not None and kind[row] >= LINE_FRAGMENT:
+                    to_code = rules.match(line)
+                    if to_code is not None:
+                        if place not in moves[to_code]:
+                            moves[to_code].append(place)
+                        spills.write(f"{place}->{to_code}", line)
+                        reclassification_counts[f"{place} -> {to_code}"] += 1
+                        continue
+
+                count = kept.setdefault(place, 0)
+                if kind[row] == LINE_TOTAL and place not in first_total:
+                    first_total[place] = count
+                if kind[row] in (LINE_SECTION, LINE_OTHER):
+                    has_header.add(place)
+                spills.write(place, line)
+                kept[place] = count + 1
+
+        print(f"Found {len(kept)} sections")
+        print("\nReclassifications applied:")
+        for key, count in sorted(reclassification_counts.items()):
+            print(f"  {key}: {count} transactions")
+        print(f"\nTotal reclassified: {sum(reclassification_counts.values())}")
+
+        section_order = list(kept)
+
+        def moved_lines(to_code: str) -> Iterator[str]:
+            # Same order as apply_reclassifications: by source section, then file order
+            for from_code in sorted(moves[to_code], key=section_order.index):
+                yield from spills.read(f"{from_code}->{to_code}")
+
+        def output_lines() -> Iterator[str]:
+            yield from spills.read(HEADER)
+            for code in sorted(set(kept) | set(moves)):
+                if code not in kept:
+                    # Create new section
+                    header = SECTION_HEADERS.get(code, f"{code} Unknown")
+                    yield f"{header},,,,,,,,,"
+                    yield from moved_lines(code)
+                    continue
+
+                # Ensure section has a header
+                if code not in has_header and code in SECTION_HEADERS:
+                    yield f"{SECTION_HEADERS[code]},,,,,,,,,"
+
+                # Moved rows go before the section's Total line
+                split = first_total.get(code, kept[code])
+                yield from spills.read(code, limit=split)
+                yield from moved_lines(code)
+                yield from spills.skip_read(code, split)
+            yield from spills.read(FOOTER)
+
+        yield from chunk_ledgers(output_lines())
 
 
 def main():
@@ -246,32 +465,20 @@ def main():
     print(f"Output: {OUTPUT_FILE}")
 
     # Read input file
-    with open(INPUT_FILE, 'r', encoding='utf-8') as f:
-        content = f.read()
+    ledger = load_ledger(INPUT_FILE)
+    print(f"\nLoaded {len(ledger)} lines from input file")
 
-    lines = content.split('\n')
-    print(f"\nLoaded {len(lines)} lines from input file")
-
-    # Parse into sections
-    header_lines, sections, footer_lines = parse_sections(lines)
-    print(f"Found {len(sections)} sections")
-
-    # Apply reclassifications
-    sections = apply_reclassifications(sections)
-
-    # Rebuild file
-    output_lines = rebuild_file(header_lines, sections, footer_lines)
+    # Run transformation
+    ledger = transform(ledger)
 
     # Write output
-    OUTPUT_FILE.parent.mkdir(parents=True, exist_ok=True)
-    with open(OUTPUT_FILE, 'w', encoding='utf-8') as f:
-        f.write('\n'.join(output_lines))
+    save_ledger(OUTPUT_FILE, ledger)
 
     print(f"\nOutput written to: {OUTPUT_FILE}")
-    print(f"Total lines: {len(output_lines)}")
+    print(f"Total lines: {len(ledger)}")
 
     # Generate P&L
-    generate_pnl(OUTPUT_FILE, PNL_FILE)
+    generate_pnl_from_ledger(ledger, PNL_FILE)
 
     print(f"\n{'=' * 80}")
 
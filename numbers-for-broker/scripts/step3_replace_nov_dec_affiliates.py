@@ -11,9 +11,12 @@ Output: output/step3_affiliates_replaced.csv
 
 import re
 from pathlib import Path
-from typing import List, Dict, Tuple
+from typing import Dict, Iterable, Iterator, List, Tuple
 
-from pnl_generator import generate_pnl
+from csv_tokenizer import parse_csv_line
+from ledger import Ledger, LINE_SECTION, LINE_FRAGMENT, load_ledger, date_parts, format_cents, parse_cents
+from ledger_snapshot import save_ledger
+from pnl_generator import generate_pnl_from_ledger
 
 # Paths
 SCRIPT_DIR = Path(__file__).parent
@@ -23,34 +26,15 @@ OUTPUT_FILE = BASE_DIR / "output" / "step3_affiliates_replaced.csv"
 PNL_FILE = BASE_DIR / "output" / "pnl_step3.csv"
 NOV_DEC_PAYOUTS_FILE = BASE_DIR / "reference-data" / "nov-dec-payouts.csv"
 
+# Inputs that determine this step's output (used by the pipeline step cache)
+REFERENCE_FILES = [NOV_DEC_PAYOUTS_FILE]
+RULE_TABLES = []
 
-def parse_csv_line(line: str) -> List[str]:
-    """Parse a CSV line handling quoted fields with commas."""
-    result = []
-    current = ""
-    in_quotes = False
-
-    for char in line:
-        if char == '"':
-            in_quotes = not in_quotes
-        elif char == ',' and not in_quotes:
-            result.append(current.strip())
-            current = ""
-        else:
-            current += char
-    result.append(current.strip())
-    return result
-
-
-def parse_amount(s: str) -> float:
-    """Parse amount string to float."""
-    if not s:
-        return 0.0
-    cleaned = re.sub(r'[$,"\s]', '', s)
-    try:
-        return float(cleaned)
-    except ValueError:
-        return 0.0
+# Months this step adjusts as a whole (used by monthly_ingest.py)
+ADJUSTED_MONTHS = [(2025, 11), (2025, 12)]
+# Each month's adjustment only depends on and posts to that month, so
+# monthly_ingest.py can run the step on the month's own export
+ADJUSTED_MONTHS_SEPARABLE = True
 
 
 def load_nov_dec_payouts() -> Tuple[List[Dict], List[Dict]]:
@@ -81,7 +65,7 @@ def load_nov_dec_payouts() -> Tuple[List[Dict], List[Dict]]:
 
         # Get total (column 10)
         if len(parts) > 10:
-            total = parse_amount(parts[10])
+            total = parse_cents(parts[10])
             if total > 0:
                 payout = {"name": parts[0], "total": total}
                 if current_month == "11":
@@ -92,70 +76,92 @@ def load_nov_dec_payouts() -> Tuple[List[Dict], List[Dict]]:
     return nov_payouts, dec_payouts
 
 
-def replace_nov_dec_affiliates(lines: List[str]) -> List[str]:
-    """Remove Nov/Dec 2025 affiliate transactions and replace with payout data."""
-    nov_payouts, dec_payouts = load_nov_dec_payouts()
+class AffiliateReplacementStage:
+    """Replaces the Nov/Dec affiliate rows; keeps its state across the chunks of a stream."""
+
+    def __init__(self):
+        self.nov_payouts, self.dec_payouts = load_nov_dec_payouts()
+
+        nov_total = sum(p["total"] for p in self.nov_payouts)
+        dec_total = sum(p["total"] for p in self.dec_payouts)
+
+        print(f"\nNovember payouts: {len(self.nov_payouts)} creators, total: ${format_cents(nov_total, grouped=True)}")
+        print(f"December payouts: {len(self.dec_payouts)} creators, total: ${format_cents(dec_total, grouped=True)}")
+
+        self.removed_nov = 0
+        self.removed_dec = 0
+        self.added_payouts = False
+
+    def payout_entries(self) -> List[str]:
+        entries = []
+        # Add November payouts (dated 11/30/2025)
+        for payout in self.nov_payouts:
+            entries.append(f',11/30/2025,Journal Entry,NOV_PAYOUT,,{payout["name"]},Affiliate payout (Nov 2025),6120 Affiliate Marketing Expense,{format_cents(payout["total"])},')
+        # Add December payouts (dated 12/31/2025)
+        for payout in self.dec_payouts:
+            entries.append(f',12/31/2025,Journal Entry,DEC_PAYOUT,,{payout["name"]},Affiliate payout (Dec 2025),6120 Affiliate Marketing Expense,{format_cents(payout["total"])},')
+        return entries
+
+    def process(self, ledger: Ledger) -> Ledger:
+        """
+        Remove Nov/Dec 2025 affiliate transactions and replace with payout data.
+
+        Only the 6120 section's rows are looked at, found through the
+        ledger's section index.
+        """
+        kind = ledger.kind
+        dates = ledger.date
+        removed = []
+        insert_after = None
+
+        for start, end in ledger.section_ranges().get(6120, []):
+            # After the first 6120 section header, add replacement entries (only once)
+            if kind[start] == LINE_SECTION and not self.added_payouts:
+                insert_after = start
+                self.added_payouts = True
+
+            # Remove ALL transactions in 6120 section for Nov/Dec 2025 (they'll be replaced)
+            for row in range(start, end):
+                if kind[row] < LINE_FRAGMENT or not dates[row]:
+                    continue
+                year, month, _ = date_parts(dates[row])
+                if year == 2025 and month in (11, 12):
+                    if month == 11:
+                        self.removed_nov += 1
+                    else:
+                        self.removed_dec += 1
+                    removed.append(row)
 
-    nov_total = sum(p["total"] for p in nov_payouts)
-    dec_total = sum(p["total"] for p in dec_payouts)
+        if not removed and insert_after is None:
+            return ledger
+        return ledger.splice(removed, insert_after, self.payout_entries())
 
-    print(f"\nNovember payouts: {len(nov_payouts)} creators, total: ${nov_total:,.2f}")
-    print(f"December payouts: {len(dec_payouts)} creators, total: ${dec_total:,.2f}")
+    def report(self) -> None:
+        print(f"\nRemoved {self.removed_nov} November 2025 affiliate transactions")
+        print(f"Removed {self.removed_dec} December 2025 affiliate transactions")
+        print(f"Added {len(self.nov_payouts)} November payout entries")
+        print(f"Added {len(self.dec_payouts)} December payout entries")
 
-    new_lines = []
-    current_section_code = ""
-    removed_nov = 0
-    removed_dec = 0
-    added_payouts = False
 
-    for line in lines:
-        trimmed = line.strip()
-
-        # Check for section header
-        section_match = re.match(r'^(\d{4})\s+[^,]*,,,,,,,,,', trimmed)
-        if section_match:
-            current_section_code = section_match.group(1)
-            new_lines.append(line)
-
-            # After 6120 section header, add replacement entries (only once)
-            if current_section_code == "6120" and not added_payouts:
-                # Add November payouts (dated 11/30/2025)
-                for payout in nov_payouts:
-                    entry = f',11/30/2025,Journal Entry,NOV_PAYOUT,,{payout["name"]},Affiliate payout (Nov 2025),6120 Affiliate Marketing Expense,{payout["total"]:.2f},'
-                    new_lines.append(entry)
-
-                # Add December payouts (dated 12/31/2025)
-                for payout in dec_payouts:
-                    entry = f',12/31/2025,Journal Entry,DEC_PAYOUT,,{payout["name"]},Affiliate payout (Dec 2025),6120 Affiliate Marketing Expense,{payout["total"]:.2f},'
-                    new_lines.append(entry)
-
-                added_payouts = True
-            continue
+def replace_nov_dec_affiliates(ledger: Ledger) -> Ledger:
+    """Remove Nov/Dec 2025 affiliate transactions and replace with payout data."""
+    stage = AffiliateReplacementStage()
+    ledger = stage.process(ledger)
+    stage.report()
+    return ledger
 
-        # Check if this is a Nov/Dec 2025 transaction in the 6120 section to remove
-        # Remove ALL transactions in 6120 section for Nov/Dec 2025
-        if current_section_code == "6120":
-            date_match = re.match(r'^,(\d{2})/\d{2}/(\d{4}),', line)
-            if date_match:
-                month = date_match.group(1)
-                year = date_match.group(2)
-
-                # Remove Nov/Dec 2025 transactions (they'll be replaced)
-                if year == "2025" and month in ("11", "12"):
-                    if month == "11":
-                        removed_nov += 1
-                    else:
-                        removed_dec += 1
-                    continue  # Skip this line
 
-        new_lines.append(line)
+def transform(ledger: Ledger) -> Ledger:
+    """Run this step on a ledger already held in memory."""
+    return replace_nov_dec_affiliates(ledger)
 
-    print(f"\nRemoved {removed_nov} November 2025 affiliate transactions")
-    print(f"Removed {removed_dec} December 2025 affiliate transactions")
-    print(f"Added {len(nov_payouts)} November payout entries")
-    print(f"Added {len(dec_payouts)} December payout entries")
 
-    return new_lines
+def stream(chunks: Iterable[Ledger]) -> Iterator[Ledger]:
+    """Run this step as a generator stage over ledger chunks."""
+    stage = AffiliateReplacementStage()
+    for chunk in chunks:
+        yield stage.process(chunk)
+    stage.report()
 
 
 def main():
@@ -166,25 +172,20 @@ def main():
     print(f"Output: {OUTPUT_FILE}")
 
     # Read input file
-    with open(INPUT_FILE, 'r', encoding='utf-8') as f:
-        content = f.read()
-
-    lines = content.split('\n')
-    print(f"\nLoaded {len(lines)} lines from input file")
+    ledger = load_ledger(INPUT_FILE)
+    print(f"\nLoaded {len(ledger)} lines from input file")
 
     # Run transformation
-    lines = replace_nov_dec_affiliates(lines)
+    ledger = transform(ledger)
 
     # Write output
-    OUTPUT_FILE.parent.mkdir(parents=True, exist_ok=True)
-    with open(OUTPUT_FILE, 'w', encoding='utf-8') as f:
-        f.write('\n'.join(lines))
+    save_ledger(OUTPUT_FILE, ledger)
 
     print(f"\nOutput written to: {OUTPUT_FILE}")
-    print(f"Total lines: {len(lines)}")
+    print(f"Total lines: {len(ledger)}")
 
     # Generate P&L
-    generate_pnl(OUTPUT_FILE, PNL_FILE)
+    generate_pnl_from_ledger(ledger, PNL_FILE)
 
     print(f"\n{'=' * 80}")
 
@@ -9,16 +9,25 @@ Exceptions (not shifted):
 - January 2024 transactions
 - December 2024 transactions after the 15th
 
+The shift is a lookup: a month-back table over the days the affiliate
+rows span gives every date its shifted date (or the exception that keeps
+it). The affiliate rows' dates are mapped through the table without any
+per-row date arithmetic, and the shifted rows are rewritten together with
+Ledger.set_dates(), which resplices each line's leading date field.
+
 Input: output/step3_affiliates_replaced.csv
 Output: output/step4_dates_shifted.csv
 """
 
-import re
+import calendar
+from array import array
+from datetime import date
 from pathlib import Path
-from typing import List, Optional
-from datetime import datetime
+from typing import Iterable, Iterator, List
 
-from pnl_generator import generate_pnl
+from ledger import DATES, Ledger, LINE_FRAGMENT, load_ledger
+from ledger_snapshot import save_ledger
+from pnl_generator import generate_pnl_from_ledger
 
 # Paths
 SCRIPT_DIR = Path(__file__).parent
@@ -27,116 +36,156 @@ INPUT_FILE = BASE_DIR / "output" / "step3_affiliates_replaced.csv"
 OUTPUT_FILE = BASE_DIR / "output" / "step4_dates_shifted.csv"
 PNL_FILE = BASE_DIR / "output" / "pnl_step4.csv"
 
-
-def parse_date(date_str: str) -> Optional[datetime]:
-    """Parse MM/DD/YYYY date string."""
-    if not date_str:
-        return None
-    try:
-        return datetime.strptime(date_str.strip(), "%m/%d/%Y")
-    except ValueError:
-        return None
-
-
-def format_date(dt: datetime) -> str:
-    """Format datetime to MM/DD/YYYY."""
-    return dt.strftime("%m/%d/%Y")
-
-
-def shift_date_back_one_month(dt: datetime) -> datetime:
-    """Shift a date back by one month."""
-    if dt.month == 1:
-        return dt.replace(year=dt.year - 1, month=12)
-    else:
-        # Handle end-of-month edge cases
-        new_month = dt.month - 1
-        try:
-            return dt.replace(month=new_month)
-        except ValueError:
-            # Day doesn't exist in previous month, use last day
-            if new_month in (4, 6, 9, 11):
-                return dt.replace(month=new_month, day=30)
-            elif new_month == 2:
-                if dt.year % 4 == 0 and (dt.year % 100 != 0 or dt.year % 400 == 0):
-                    return dt.replace(month=new_month, day=29)
-                else:
-                    return dt.replace(month=new_month, day=28)
-            else:
-                return dt.replace(month=new_month, day=31)
-
-
-def shift_affiliate_dates(lines: List[str]) -> List[str]:
+# Inputs that determine this step's output (used by the pipeline step cache)
+REFERENCE_FILES = []
+RULE_TABLES = []
+
+
+AFFILIATE_ACCOUNTS = (6120, 6125)
+
+# What the month-back table does with a date
+SHIFT = 0
+SKIP_JAN_2024 = 1
+SKIP_DEC_2024_LATE = 2
+
+
+def month_back(ordinal: int) -> int:
+    """The same day one month earlier, or the last day of that month if it is shorter."""
+    info = DATES.by_ordinal[ordinal]
+    year, month = (info.year - 1, 12) if info.month == 1 else (info.year, info.month - 1)
+    return date(year, month, min(info.day, calendar.monthrange(year, month)[1])).toordinal()
+
+
+def shift_outcome(ordinal: int) -> int:
+    """Whether a date is shifted or kept by one of the exceptions."""
+    info = DATES.by_ordinal[ordinal]
+    if info.year == 2024 and info.month == 1:
+        return SKIP_JAN_2024
+    if info.year == 2024 and info.month == 12 and info.day > 15:
+        return SKIP_DEC_2024_LATE
+    return SHIFT
+
+
+class MonthShiftTable:
+    """
+    Shifted date and outcome for every day from first to last ordinal.
+
+    Kept dates map to themselves, so looking a date up gives its new date
+    whatever its outcome.
+    """
+
+    def __init__(self, first: int, last: int):
+        self.first = first
+        self.last = last
+        days = range(first, last + 1)
+        self.outcome = array('b', (shift_outcome(ordinal) for ordinal in days))
+        self.target = array('i', (
+            month_back(ordinal) if outcome == SHIFT else ordinal
+            for ordinal, outcome in zip(days, self.outcome)
+        ))
+
+    def covers(self, first: int, last: int) -> bool:
+        return self.first <= first and last <= self.last
+
+
+def affiliate_rows(ledger: Ledger) -> List[int]:
+    """
+    Dated transaction rows in an affiliate section or referring to an affiliate account.
+
+    The 6120/6125 sections come from the ledger's section index; only the
+    rows outside them have their line searched for an affiliate account.
+    """
+    kind = ledger.kind
+    dates = ledger.date
+    raw = ledger.raw
+    sections = ledger.section_ranges()
+    affiliate_ranges = sorted(r for code in AFFILIATE_ACCOUNTS for r in sections.get(code, []))
+
+    # Only transaction lines carry a date
+    rows = []
+    position = 0
+    for start, end in affiliate_ranges + [(len(ledger), len(ledger))]:
+        rows.extend(
+            row for row in range(position, start)
+            if ("6120 Affiliate" in raw[row] or "6125 Affiliate" in raw[row])
+            and kind[row] >= LINE_FRAGMENT and dates[row]
+        )
+        rows.extend(row for row in range(start, end) if kind[row] >= LINE_FRAGMENT and dates[row])
+        position = end
+    return rows
+
+
+class AffiliateDateShiftStage:
+    """Shifts affiliate dates in place; keeps its counts across the chunks of a stream."""
+
+    def __init__(self):
+        print("\nExceptions (not shifted):")
+        print("  - January 2024 transactions")
+        print("  - December 2024 transactions after the 15th")
+
+        self.shifted_count = 0
+        self.skipped_jan_2024 = 0
+        self.skipped_dec_2024_late = 0
+        self.table = None
+
+    def shift_table(self, ordinals: List[int]) -> MonthShiftTable:
+        """The month-back table, rebuilt when a chunk has dates outside it."""
+        first, last = min(ordinals), max(ordinals)
+        if self.table is None or not self.table.covers(first, last):
+            if self.table is not None:
+                first, last = min(first, self.table.first), max(last, self.table.last)
+            self.table = MonthShiftTable(first, last)
+        return self.table
+
+    def process(self, ledger: Ledger) -> Ledger:
+        """Shift affiliate payment dates to prior month with exceptions."""
+        rows = affiliate_rows(ledger)
+        if not rows:
+            return ledger
+
+        dates = ledger.date
+        table = self.shift_table([dates[row] for row in rows])
+        first = table.first
+        outcome = table.outcome
+        target = table.target
+
+        # Map the rows' dates through the table, then rewrite the shifted ones together
+        offsets = [dates[row] - first for row in rows]
+        shifted = [row for row, offset in zip(rows, offsets) if outcome[offset] == SHIFT]
+        ledger.set_dates(shifted, [target[dates[row] - first] for row in shifted])
+
+        outcomes = [outcome[offset] for offset in offsets]
+        self.shifted_count += len(shifted)
+        self.skipped_jan_2024 += outcomes.count(SKIP_JAN_2024)
+        self.skipped_dec_2024_late += outcomes.count(SKIP_DEC_2024_LATE)
+
+        return ledger
+
+    def report(self) -> None:
+        print(f"\nShifted {self.shifted_count} affiliate transactions to prior month")
+        print(f"Skipped {self.skipped_jan_2024} January 2024 transactions")
+        print(f"Skipped {self.skipped_dec_2024_late} December 2024 (after 15th) transactions")
+
+
+def shift_affiliate_dates(ledger: Ledger) -> Ledger:
     """Shift affiliate payment dates to prior month with exceptions."""
-    print("\nExceptions (not shifted):")
-    print("  - January 2024 transactions")
-    print("  - December 2024 transactions after the 15th")
-
-    new_lines = []
-    shifted_count = 0
-    skipped_jan_2024 = 0
-    skipped_dec_2024_late = 0
-    current_section_code = ""
-
-    for line in lines:
-        trimmed = line.strip()
-
-        # Check for section header
-        section_match = re.match(r'^(\d{4})\s+[^,]*,,,,,,,,,', trimmed)
-        if section_match:
-            current_section_code = section_match.group(1)
-            new_lines.append(line)
-            continue
-
-        # Check if this is an affiliate transaction
-        # Either in 6120/6125 section OR has affiliate account reference in line
-        is_in_affiliate_section = current_section_code in ("6120", "6125")
-        has_affiliate_ref = "6120 Affiliate" in line or "6125 Affiliate" in line
-        is_affiliate = is_in_affiliate_section or has_affiliate_ref
-
-        if not is_affiliate:
-            new_lines.append(line)
-            continue
-
-        # Parse date
-        date_match = re.match(r'^,(\d{2}/\d{2}/\d{4}),', line)
-        if not date_match:
-            new_lines.append(line)
-            continue
-
-        date_str = date_match.group(1)
-        dt = parse_date(date_str)
-
-        if not dt:
-            new_lines.append(line)
-            continue
-
-        # Check exceptions
-        # Exception 1: January 2024 - don't shift
-        if dt.year == 2024 and dt.month == 1:
-            new_lines.append(line)
-            skipped_jan_2024 += 1
-            continue
-
-        # Exception 2: December 2024 after the 15th - don't shift
-        if dt.year == 2024 and dt.month == 12 and dt.day > 15:
-            new_lines.append(line)
-            skipped_dec_2024_late += 1
-            continue
-
-        # Shift the date back one month
-        new_dt = shift_date_back_one_month(dt)
-        new_date_str = format_date(new_dt)
-
-        # Replace the date in the line
-        new_line = line.replace(f",{date_str},", f",{new_date_str},", 1)
-        new_lines.append(new_line)
-        shifted_count += 1
-
-    print(f"\nShifted {shifted_count} affiliate transactions to prior month")
-    print(f"Skipped {skipped_jan_2024} January 2024 transactions")
-    print(f"Skipped {skipped_dec_2024_late} December 2024 (after 15th) transactions")
-
-    return new_lines
+    stage = AffiliateDateShiftStage()
+    ledger = stage.process(ledger)
+    stage.report()
+    return ledger
+
+
+def transform(ledger: Ledger) -> Ledger:
+    """Run this step on a ledger already held in memory."""
+    return shift_affiliate_dates(ledger)
+
+
+def stream(chunks: Iterable[Ledger]) -> Iterator[Ledger]:
+    """Run this step as a generator stage over ledger chunks."""
+    stage = AffiliateDateShiftStage()
+    for chunk in chunks:
+        yield stage.process(chunk)
+    stage.report()
 
 
 def main():
@@ -147,25 +196,20 @@ def main():
     print(f"Output: {OUTPUT_FILE}")
 
     # Read input file
-    with open(INPUT_FILE, 'r', encoding='utf-8') as f:
-        content = f.read()
-
-    lines = content.split('\n')
-    print(f"\nLoaded {len(lines)} lines from input file")
+    ledger = load_ledger(INPUT_FILE)
+    print(f"\nLoaded {len(ledger)} lines from input file")
 
     # Run transformation
-    lines = shift_affiliate_dates(lines)
+    ledger = transform(ledger)
 
     # Write output
-    OUTPUT_FILE.parent.mkdir(parents=True, exist_ok=True)
-    with open(OUTPUT_FILE, 'w', encoding='utf-8') as f:
-        f.write('\n'.join(lines))
+    save_ledger(OUTPUT_FILE, ledger)
 
     print(f"\nOutput written to: {OUTPUT_FILE}")
-    print(f"Total lines: {len(lines)}")
+    print(f"Total lines: {len(ledger)}")
 
     # Generate P&L
-    generate_pnl(OUTPUT_FILE, PNL_FILE)
+    generate_pnl_from_ledger(ledger, PNL_FILE)
 
     print(f"\n{'=' * 80}")
 
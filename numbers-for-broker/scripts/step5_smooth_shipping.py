@@ -5,16 +5,26 @@ Step 5: Smooth Shipping Costs
 Spreads shipping costs (6010, 6020, 6035) pro-rata by revenue
 across Dec 2024 - Sep 2025.
 
+The step works from the ledger's section index: revenue and shipping are
+totalled over the 4000, 4030 and 6010 sections only, the original 6010
+rows in the period are dropped from those ranges, and the smoothed entries
+are spliced in after the 6010 header. Rows elsewhere are only looked at
+if their date falls in the period, for lines that name the 6010 account
+from another section (e.g. a bank or credit card section).
+
 Input: output/step4_dates_shifted.csv
 Output: output/all-txn-2024-2025-transformed.csv
 """
 
-import re
+from datetime import date
 from pathlib import Path
-from typing import List
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 from collections import defaultdict
 
-from pnl_generator import generate_pnl
+from ledger import Ledger, LINE_SECTION, LINE_FRAGMENT, LINE_TXN, load_ledger, date_parts, format_cents
+from ledger_snapshot import save_ledger
+from pnl_generator import generate_pnl_from_ledger
+from streaming import chunk_ledgers, spill_files
 
 # Paths
 SCRIPT_DIR = Path(__file__).parent
@@ -23,180 +33,252 @@ INPUT_FILE = BASE_DIR / "output" / "step4_dates_shifted.csv"
 OUTPUT_FILE = BASE_DIR / "output" / "all-txn-2024-2025-transformed.csv"
 PNL_FILE = BASE_DIR / "output" / "pnl_step5.csv"
 
-
-def parse_csv_line(line: str) -> List[str]:
-    """Parse a CSV line handling quoted fields with commas."""
-    result = []
-    current = ""
-    in_quotes = False
-
-    for char in line:
-        if char == '"':
-            in_quotes = not in_quotes
-        elif char == ',' and not in_quotes:
-            result.append(current.strip())
-            current = ""
-        else:
-            current += char
-    result.append(current.strip())
-    return result
-
-
-def parse_amount(s: str) -> float:
-    """Parse amount string to float."""
-    if not s:
-        return 0.0
-    cleaned = re.sub(r'[$,"\s]', '', s)
-    try:
-        return float(cleaned)
-    except ValueError:
-        return 0.0
-
-
-def smooth_shipping(lines: List[str]) -> List[str]:
+# Inputs that determine this step's output (used by the pipeline step cache)
+REFERENCE_FILES = []
+RULE_TABLES = []
+
+
+def smoothing_month_key(ordinal: int) -> Optional[str]:
+    """Return the MM/YYYY key for dates in Dec 2024 - Sep 2025, else None."""
+    year, month, _ = date_parts(ordinal)
+    if year == 2024 and month == 12:
+        return "12/2024"
+    if year == 2025 and 1 <= month <= 9:
+        return f"{month:02d}/2025"
+    return None
+
+
+# Only smooth 6010 - 6020 and 6035 stay as-is
+SHIPPING_ACCOUNTS = ["6010"]
+SHIPPING_CODES = [int(acc) for acc in SHIPPING_ACCOUNTS]
+REVENUE_ACCOUNTS = [4000, 4030]  # Sales and Shipping Income
+MONTHS_TO_SMOOTH = ["12/2024"] + [f"{m:02d}/2025" for m in range(1, 10)]
+
+# Months this step adjusts as a whole (used by monthly_ingest.py, which cannot
+# run such a month through the pipeline from its own export: the smoothing
+# spreads costs across all of them)
+ADJUSTED_MONTHS = [(2024, 12)] + [(2025, m) for m in range(1, 10)]
+
+# The smoothing period as date ordinals, inclusive
+PERIOD_START = date(2024, 12, 1).toordinal()
+PERIOD_END = date(2025, 9, 30).toordinal()
+
+SectionRanges = Dict[int, List[Tuple[int, int]]]
+
+
+def apportion_cents(total: int, weights: Dict[str, int]) -> Dict[str, int]:
+    """
+    Split total cents pro rata to weights.
+
+    Each share is its exact pro-rata amount rounded to the nearest cent
+    (halves to even), as the float allocation this replaced rounded it, so
+    the entries stay the same; the shares can be a cent or so off total.
+    """
+    weight_total = sum(weights.values())
+    if weight_total == 0:
+        return {key: 0 for key in weights}
+    shares = {}
+    for key, weight in weights.items():
+        share, remainder = divmod(total * weight, weight_total)
+        if 2 * remainder > weight_total or (2 * remainder == weight_total and share % 2):
+            share += 1
+        shares[key] = share
+    return shares
+
+
+class ShippingTotals:
+    """Monthly revenue and shipping over the smoothing period, accumulated row by row."""
+
+    def __init__(self):
+        # Totals in cents
+        self.monthly_revenue = defaultdict(int)
+        self.monthly_shipping = defaultdict(int)
+
+    def add(self, ledger: Ledger, sections: SectionRanges) -> None:
+        """Add the revenue (4000, 4030) and shipping (6010) rows of the given sections."""
+        for code in REVENUE_ACCOUNTS:
+            self._add_section(ledger, sections.get(code, []), self.monthly_revenue)
+        for code in SHIPPING_CODES:
+            self._add_section(ledger, sections.get(code, []), self.monthly_shipping)
+
+    @staticmethod
+    def _add_section(ledger: Ledger, ranges: List[Tuple[int, int]], monthly: Dict[str, int]) -> None:
+        kind = ledger.kind
+        dates = ledger.date
+        amounts = ledger.amount
+        for start, end in ranges:
+            for row in range(start, end):
+                # Only process Dec 2024 through Sep 2025 for smoothing
+                if kind[row] != LINE_TXN or not PERIOD_START <= dates[row] <= PERIOD_END:
+                    continue
+                # Keep sign for reversals
+                monthly[smoothing_month_key(dates[row])] += amounts[row]
+
+    def smoothed_entries(self) -> Optional[List[str]]:
+        """Print the before/after table and return the smoothed journal lines, None if no revenue."""
+        monthly_revenue = self.monthly_revenue
+        monthly_shipping = self.monthly_shipping
+
+        # Calculate total revenue and shipping for smoothing period
+        total_revenue = sum(monthly_revenue[m] for m in MONTHS_TO_SMOOTH)
+        total_shipping = sum(monthly_shipping[m] for m in MONTHS_TO_SMOOTH)
+
+        if total_revenue == 0:
+            print("Warning: No revenue found for smoothing period")
+            return None
+
+        # Calculate pro-rata shipping for each month
+        smoothed_shipping = apportion_cents(
+            total_shipping if total_revenue > 0 else 0,
+            {month_key: monthly_revenue[month_key] for month_key in MONTHS_TO_SMOOTH},
+        )
+
+        print("\nBefore vs After Smoothing:")
+        print(f"{'Month':<12} {'Revenue':>15} {'Original Ship':>15} {'Smoothed Ship':>15}")
+        print("-" * 60)
+        for month_key in MONTHS_TO_SMOOTH:
+            rev = monthly_revenue[month_key]
+            orig = monthly_shipping[month_key]
+            smooth = smoothed_shipping[month_key]
+            print(f"{month_key:<12} ${rev / 100:>13,.0f} ${orig / 100:>13,.0f} ${smooth / 100:>13,.0f}")
+        print("-" * 60)
+        print(f"{'TOTAL':<12} ${total_revenue / 100:>13,.0f} ${total_shipping / 100:>13,.0f} ${total_shipping / 100:>13,.0f}")
+
+        entries = []
+        for month_key in MONTHS_TO_SMOOTH:
+            amount = smoothed_shipping[month_key]
+            if amount > 0:
+                month, year = month_key.split("/")
+                # Use last day of month
+                if month == "12":
+                    date_str = f"12/31/{year}"
+                elif month in ["04", "06", "09", "11"]:
+                    date_str = f"{month}/30/{year}"
+                elif month == "02":
+                    date_str = f"02/28/{year}"
+                else:
+                    date_str = f"{month}/31/{year}"
+
+                entries.append(f',{date_str},Journal Entry,SHIPPING_SMOOTH,,Shipping,Pro-rata shipping allocation,6010 Outbound Shipping & Delivery,{format_cents(amount)},')
+        return entries
+
+
+SHIPPING_REFERENCES = [f"{acc} " for acc in SHIPPING_ACCOUNTS] + [f":{acc}" for acc in SHIPPING_ACCOUNTS]
+
+
+def smoothing_headers(ledger: Ledger, sections: SectionRanges) -> List[int]:
+    """Shipping section header rows, where the smoothed entries go."""
+    return [
+        start for code in SHIPPING_CODES for start, _ in sections.get(code, [])
+        if ledger.kind[start] == LINE_SECTION
+    ]
+
+
+def original_shipping_rows(ledger: Ledger, sections: SectionRanges) -> List[int]:
+    """
+    Original shipping transactions in the smoothing period, in row order.
+
+    That is every dated row in a shipping section, plus rows elsewhere whose
+    line refers to a shipping account.
+    """
+    kind = ledger.kind
+    dates = ledger.date
+    raw = ledger.raw
+    shipping_ranges = sorted(r for code in SHIPPING_CODES for r in sections.get(code, []))
+
+    def in_period(row: int) -> bool:
+        return kind[row] >= LINE_FRAGMENT and PERIOD_START <= dates[row] <= PERIOD_END
+
+    rows = []
+    position = 0
+    for start, end in shipping_ranges + [(len(ledger), len(ledger))]:
+        # Outside the shipping sections: check the date before searching the line
+        for row in range(position, start):
+            if in_period(row) and any(ref in raw[row] for ref in SHIPPING_REFERENCES):
+                rows.append(row)
+        rows.extend(row for row in range(start, end) if in_period(row))
+        position = end
+    return rows
+
+
+def smooth_shipping(ledger: Ledger) -> Ledger:
     """Spread shipping costs pro-rata by revenue across Dec 2024 - Sep 2025."""
-
-    # First pass: calculate monthly revenue and shipping totals
-    monthly_revenue = defaultdict(float)
-    monthly_shipping = defaultdict(float)
-    # Only smooth 6010 - 6020 and 6035 stay as-is
-    shipping_accounts = ["6010"]
-    revenue_accounts = ["4000", "4030"]  # Sales and Shipping Income
-
-    # Track current section
-    current_section_code = ""
-
-    for line in lines:
-        trimmed = line.strip()
-
-        # Check for section header (e.g., "4000 Sales,,,,,,,,,")
-        section_match = re.match(r'^(\d{4})\s+[^,]*,,,,,,,,,', trimmed)
-        if section_match:
-            current_section_code = section_match.group(1)
-            continue
-
-        date_match = re.match(r'^,(\d{2})/\d{2}/(\d{4}),', line)
-        if not date_match:
-            continue
-
-        month = int(date_match.group(1))
-        year = int(date_match.group(2))
-
-        # Only process Dec 2024 through Sep 2025 for smoothing
-        if year == 2024 and month == 12:
-            month_key = "12/2024"
-        elif year == 2025 and 1 <= month <= 9:
-            month_key = f"{month:02d}/2025"
-        else:
-            continue
-
-        # Parse columns - amount is in column 8
-        parts = parse_csv_line(line)
-        if len(parts) < 9:
-            continue
-
-        amount = parse_amount(parts[8])  # Amount is in column 8 (keep sign for reversals)
-
-        # Check if in a revenue section (4000 Sales, 4030 Shipping Income)
-        if current_section_code in revenue_accounts:
-            monthly_revenue[month_key] += amount
-
-        # Check if in a shipping section (6010, 6020, 6035)
-        if current_section_code in shipping_accounts:
-            monthly_shipping[month_key] += amount
-
-    # Calculate total revenue and shipping for smoothing period
-    months_to_smooth = ["12/2024"] + [f"{m:02d}/2025" for m in range(1, 10)]
-    total_revenue = sum(monthly_revenue[m] for m in months_to_smooth)
-    total_shipping = sum(monthly_shipping[m] for m in months_to_smooth)
-
-    if total_revenue == 0:
-        print("Warning: No revenue found for smoothing period")
-        return lines
-
-    # Calculate pro-rata shipping for each month
-    smoothed_shipping = {}
-    for month_key in months_to_smooth:
-        revenue = monthly_revenue[month_key]
-        proportion = revenue / total_revenue if total_revenue > 0 else 0
-        smoothed_shipping[month_key] = total_shipping * proportion
-
-    print("\nBefore vs After Smoothing:")
-    print(f"{'Month':<12} {'Revenue':>15} {'Original Ship':>15} {'Smoothed Ship':>15}")
-    print("-" * 60)
-    for month_key in months_to_smooth:
-        rev = monthly_revenue[month_key]
-        orig = monthly_shipping[month_key]
-        smooth = smoothed_shipping[month_key]
-        print(f"{month_key:<12} ${rev:>13,.0f} ${orig:>13,.0f} ${smooth:>13,.0f}")
-    print("-" * 60)
-    print(f"{'TOTAL':<12} ${total_revenue:>13,.0f} ${total_shipping:>13,.0f} ${total_shipping:>13,.0f}")
-
-    # Second pass: remove original shipping transactions and add smoothed ones
-    new_lines = []
-    removed_count = 0
-    added_smoothed = False
-    current_section_code = ""
-
-    for line in lines:
-        trimmed = line.strip()
-
-        # Check for section header
-        section_match = re.match(r'^(\d{4})\s+[^,]*,,,,,,,,,', trimmed)
-        if section_match:
-            current_section_code = section_match.group(1)
-
-            # Check for 6010 section header to add smoothed entries
-            if current_section_code == "6010" and not added_smoothed:
-                new_lines.append(line)
-
-                # Add smoothed shipping entries
-                for month_key in months_to_smooth:
-                    amount = smoothed_shipping[month_key]
-                    if amount > 0:
-                        month, year = month_key.split("/")
-                        # Use last day of month
-                        if month == "12":
-                            date_str = f"12/31/{year}"
-                        elif month in ["04", "06", "09", "11"]:
-                            date_str = f"{month}/30/{year}"
-                        elif month == "02":
-                            date_str = f"02/28/{year}"
-                        else:
-                            date_str = f"{month}/31/{year}"
-
-                        entry = f',{date_str},Journal Entry,SHIPPING_SMOOTH,,Shipping,Pro-rata shipping allocation,6010 Outbound Shipping & Delivery,{amount:.2f},'
-                        new_lines.append(entry)
-
-                added_smoothed = True
-                continue
-
-            new_lines.append(line)
-            continue
-
-        # Check if this is a shipping transaction to remove
-        # Either in a shipping section OR has shipping account reference
-        is_in_shipping_section = current_section_code in shipping_accounts
-        has_shipping_ref = any(f"{acc} " in line or f":{acc}" in line for acc in shipping_accounts)
-        is_shipping = is_in_shipping_section or has_shipping_ref
-
-        if is_shipping:
-            date_match = re.match(r'^,(\d{2})/\d{2}/(\d{4}),', line)
-            if date_match:
-                month = int(date_match.group(1))
-                year = int(date_match.group(2))
-
-                # Remove if in smoothing period
-                if (year == 2024 and month == 12) or (year == 2025 and 1 <= month <= 9):
+    sections = ledger.section_ranges()
+
+    # Monthly revenue and shipping totals, from the 4000, 4030 and 6010 sections only
+    totals = ShippingTotals()
+    totals.add(ledger, sections)
+    entries = totals.smoothed_entries()
+    if entries is None:
+        return ledger
+
+    # Remove original shipping transactions and add smoothed ones after the first 6010 header
+    removed = original_shipping_rows(ledger, sections)
+    headers = smoothing_headers(ledger, sections)
+    ledger = ledger.splice(removed, min(headers) if headers else None, entries)
+
+    print(f"\nRemoved {len(removed)} original shipping transactions")
+    print(f"Added {len(MONTHS_TO_SMOOTH)} smoothed shipping entries")
+
+    return ledger
+
+
+def transform(ledger: Ledger) -> Ledger:
+    """Run this step on a ledger already held in memory."""
+    return smooth_shipping(ledger)
+
+
+# Row flags in the step 5 spill file
+KEEP = "k"
+REMOVE = "r"
+INSERT_AFTER = "h"
+
+
+def stream(chunks: Iterable[Ledger]) -> Iterator[Ledger]:
+    """
+    Run this step as a generator stage over ledger chunks.
+
+    The smoothed amounts depend on shipping rows that come after the 6010
+    header where the entries are inserted, so the totals are accumulated in
+    a first pass while every row is spilled to disk with a flag (keep,
+    remove, or insert-after); the second pass replays the spill file.
+    """
+    totals = ShippingTotals()
+    with spill_files() as spills:
+        for chunk in chunks:
+            sections = chunk.section_ranges()
+            totals.add(chunk, sections)
+            flags = [KEEP] * len(chunk)
+            for row in original_shipping_rows(chunk, sections):
+                flags[row] = REMOVE
+            for row in smoothing_headers(chunk, sections):
+                flags[row] = INSERT_AFTER
+            for flag, line in zip(flags, chunk.raw):
+                spills.write("rows", flag + line)
+
+        entries = totals.smoothed_entries()
+
+        def output_lines() -> Iterator[str]:
+            removed_count = 0
+            added_smoothed = False
+            for flagged in spills.read("rows"):
+                flag, line = flagged[0], flagged[1:]
+                if entries is None:
+                    yield line
+                    continue
+                if flag == REMOVE:
                     removed_count += 1
                     continue
+                yield line
+                if flag == INSERT_AFTER and not added_smoothed:
+                    yield from entries
+                    added_smoothed = True
 
-        new_lines.append(line)
-
-    print(f"\nRemoved {removed_count} original shipping transactions")
-    print(f"Added {len(months_to_smooth)} smoothed shipping entries")
+            if entries is not None:
+                print(f"\nRemoved {removed_count} original shipping transactions")
+                print(f"Added {len(MONTHS_TO_SMOOTH)} smoothed shipping entries")
 
-    return new_lines
+        yield from chunk_ledgers(output_lines())
 
 
 def main():
@@ -207,25 +289,20 @@ def main():
     print(f"Output: {OUTPUT_FILE}")
 
     # Read input file
-    with open(INPUT_FILE, 'r', encoding='utf-8') as f:
-        content = f.read()
-
-    lines = content.split('\n')
-    print(f"\nLoaded {len(lines)} lines from input file")
+    ledger = load_ledger(INPUT_FILE)
+    print(f"\nLoaded {len(ledger)} lines from input file")
 
     # Run transformation
-    lines = smooth_shipping(lines)
+    ledger = transform(ledger)
 
     # Write output
-    OUTPUT_FILE.parent.mkdir(parents=True, exist_ok=True)
-    with open(OUTPUT_FILE, 'w', encoding='utf-8') as f:
-        f.write('\n'.join(lines))
+    save_ledger(OUTPUT_FILE, ledger)
 
     print(f"\nOutput written to: {OUTPUT_FILE}")
-    print(f"Total lines: {len(lines)}")
+    print(f"Total lines: {len(ledger)}")
 
     # Generate P&L
-    generate_pnl(OUTPUT_FILE, PNL_FILE)
+    generate_pnl_from_ledger(ledger, PNL_FILE)
 
     print(f"\n{'=' * 80}")
 
@@ -11,10 +11,13 @@ Output: output/all-txn-2024-2025-final.csv
 
 import re
 from pathlib import Path
-from typing import List, Dict, Tuple, Optional
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 from dataclasses import dataclass
 
-from pnl_generator import generate_pnl
+from csv_tokenizer import parse_csv_line
+from ledger import DATES, Ledger, LINE_SECTION, LINE_TOTAL, LINE_TXN, load_ledger, format_cents, parse_cents
+from ledger_snapshot import save_ledger
+from pnl_generator import generate_pnl_from_ledger
 
 # Paths
 SCRIPT_DIR = Path(__file__).parent
@@ -32,7 +35,7 @@ class Exclusion:
     memo: str
     account: str
     account_code: str
-    amount: float
+    amount: int  # cents
     category: str
     justification: str
     matched: bool = False
@@ -46,34 +49,9 @@ EXCLUDED_ACCOUNT_CODES = {
     "8005",  # Depreciation (Other Expenses)
 }
 
-
-def parse_csv_line(line: str) -> List[str]:
-    """Parse a CSV line handling quoted fields with commas."""
-    result = []
-    current = ""
-    in_quotes = False
-
-    for char in line:
-        if char == '"':
-            in_quotes = not in_quotes
-        elif char == ',' and not in_quotes:
-            result.append(current.strip())
-            current = ""
-        else:
-            current += char
-    result.append(current.strip())
-    return result
-
-
-def parse_amount(s: str) -> float:
-    """Parse amount string to float."""
-    if not s:
-        return 0.0
-    cleaned = re.sub(r'[$,"\s]', '', s)
-    try:
-        return float(cleaned)
-    except ValueError:
-        return 0.0
+# Inputs that determine this step's output (used by the pipeline step cache)
+REFERENCE_FILES = [EXCLUSIONS_FILE]
+RULE_TABLES = [EXCLUDED_ACCOUNT_CODES]
 
 
 def normalize_date(date_str: str) -> str:
@@ -109,7 +87,7 @@ def load_exclusions(filepath: Path) -> List[Exclusion]:
         memo = parts[2].strip()
         account = parts[3].strip()
         account_code = parts[4].strip()
-        amount = parse_amount(parts[5])
+        amount = parse_cents(parts[5])
         category = parts[6].strip() if len(parts) > 6 else ""
         justification = parts[7].strip() if len(parts) > 7 else ""
 
@@ -132,17 +110,14 @@ def normalize_string(s: str) -> str:
     return ' '.join(s.lower().split())
 
 
-def memo_matches(txn_memo: str, excl_memo: str) -> bool:
-    """Check if transaction memo matches exclusion memo.
+def memo_matches(txn_norm: str, excl_norm: str) -> bool:
+    """Check if a normalized transaction memo matches a normalized exclusion memo.
 
     The exclusion memo may be a substring or simplified version of the transaction memo.
     """
-    if not excl_memo:
+    if not excl_norm:
         return True  # Empty exclusion memo matches anything
 
-    txn_norm = normalize_string(txn_memo)
-    excl_norm = normalize_string(excl_memo)
-
     # Direct substring match
     if excl_norm in txn_norm:
         return True
@@ -156,14 +131,11 @@ def memo_matches(txn_memo: str, excl_memo: str) -> bool:
     return False
 
 
-def vendor_matches(txn_vendor: str, excl_vendor: str) -> bool:
-    """Check if transaction vendor matches exclusion vendor."""
-    if not excl_vendor:
+def vendor_matches(txn_norm: str, excl_norm: str) -> bool:
+    """Check if a normalized transaction vendor matches a normalized exclusion vendor."""
+    if not excl_norm:
         return True  # Empty exclusion vendor matches anything
 
-    txn_norm = normalize_string(txn_vendor)
-    excl_norm = normalize_string(excl_vendor)
-
     # Exact match
     if txn_norm == excl_norm:
         return True
@@ -175,181 +147,243 @@ def vendor_matches(txn_vendor: str, excl_vendor: str) -> bool:
     return False
 
 
-def amount_matches(txn_amount: float, excl_amount: float) -> bool:
-    """Check if transaction amount matches exclusion amount.
+def amount_matches(txn_cents: int, excl_cents: int) -> bool:
+    """Check if transaction amount matches exclusion amount (both in cents).
 
     Exclusion amounts are typically positive, but transaction amounts
     can be negative (expenses) or positive (in expense sections, debits are positive).
     """
-    # Match absolute values with small tolerance for rounding
-    return abs(abs(txn_amount) - abs(excl_amount)) < 0.02
-
-
-def find_matching_exclusion(
-    date: str,
-    vendor: str,
-    memo: str,
-    amount: float,
-    section_code: str,
-    exclusions: List[Exclusion]
-) -> Optional[Exclusion]:
-    """Find an exclusion that matches the transaction.
-
-    First tries exact account code match, then tries matching without account code
-    for cases where the exclusion file has the wrong account categorization.
-    """
+    # Match absolute values with a one-cent tolerance for rounding
+    return abs(abs(txn_cents) - abs(excl_cents)) <= CENT_TOLERANCE
 
-    # First pass: try exact account code match
-    for excl in exclusions:
-        if excl.matched:
-            continue
 
-        if excl.account_code != section_code:
-            continue
+# amount_matches allows amounts up to this many cents apart
+CENT_TOLERANCE = 1
 
-        if excl.date != date:
-            continue
 
-        if not amount_matches(amount, excl.amount):
-            continue
+class ExclusionIndex:
+    """
+    Unmatched exclusions indexed for constant-time candidate lookup.
 
-        if not vendor_matches(vendor, excl.vendor):
-            continue
+    - by (account code, date ordinal) for the exact-account pass
+    - by (date ordinal, absolute amount in cents) for the cross-account 6xxx pass;
+      a lookup probes the buckets within CENT_TOLERANCE of the transaction amount
 
-        if not memo_matches(memo, excl.memo):
-            continue
+    Candidates are returned in exclusions-file order and then checked with
+    the same amount/vendor/memo rules as before, so the first exclusion that
+    matches is still the one removed. Vendors and memos are normalized once,
+    when the index is built.
+    """
 
-        return excl
+    def __init__(self, exclusions: List[Exclusion]):
+        self.exclusions = exclusions
+        self.vendor_norm = [normalize_string(e.vendor) for e in exclusions]
+        self.memo_norm = [normalize_string(e.memo) for e in exclusions]
+        # Rows carry date ordinals, so the exclusions are keyed by the ordinal of their date
+        self.ordinal = [DATES.ordinal(e.date) for e in exclusions]
+        self.by_account_date: Dict[Tuple[str, int], List[int]] = {}
+        self.by_date_cents: Dict[Tuple[int, int], List[int]] = {}
 
-    # Second pass: try without account code match (for misclassified exclusions)
-    # Only match if we're in a P&L expense section (6xxx)
-    if section_code.startswith("6"):
-        for excl in exclusions:
+        for i, excl in enumerate(exclusions):
             if excl.matched:
                 continue
+            self.by_account_date.setdefault((excl.account_code, self.ordinal[i]), []).append(i)
+            if excl.account_code.startswith("6"):
+                self.by_date_cents.setdefault((self.ordinal[i], abs(excl.amount)), []).append(i)
 
-            # Skip if exclusion's account code doesn't start with 6 (expense accounts)
-            if not excl.account_code.startswith("6"):
-                continue
-
-            if excl.date != date:
+    def _first_match(self, candidates: List[int], amount: int, vendor_norm: str, memo_norm: str) -> Optional[int]:
+        for i in candidates:
+            excl = self.exclusions[i]
+            if excl.matched:
                 continue
-
             if not amount_matches(amount, excl.amount):
                 continue
+            if not vendor_matches(vendor_norm, self.vendor_norm[i]):
+                continue
+            if not memo_matches(memo_norm, self.memo_norm[i]):
+                continue
+            return i
+        return None
+
+    def find(self, date: int, vendor_norm: str, memo_norm: str, amount: int, section_code: str) -> Optional[Exclusion]:
+        """Find an exclusion that matches the transaction.
+
+        First tries exact account code match, then tries matching without account code
+        for cases where the exclusion file has the wrong account categorization.
+        """
+        # First pass: exact account code match
+        found = self._first_match(self.by_account_date.get((section_code, date), []), amount, vendor_norm, memo_norm)
+
+        # Second pass: any 6xxx exclusion on that date (for misclassified exclusions)
+        # Only match if we're in a P&L expense section (6xxx)
+        if found is None and section_code.startswith("6"):
+            cents = abs(amount)
+            candidates = []
+            for bucket in range(cents - CENT_TOLERANCE, cents + CENT_TOLERANCE + 1):
+                candidates.extend(self.by_date_cents.get((date, bucket), []))
+            found = self._first_match(sorted(candidates), amount, vendor_norm, memo_norm)
+
+        if found is None:
+            return None
+        self._discard(found)
+        return self.exclusions[found]
+
+    def _discard(self, i: int) -> None:
+        """Drop a matched exclusion from the index."""
+        excl = self.exclusions[i]
+        self.by_account_date[(excl.account_code, self.ordinal[i])].remove(i)
+        if excl.account_code.startswith("6"):
+            self.by_date_cents[(self.ordinal[i], abs(excl.amount))].remove(i)
+
+
+class ExclusionStage:
+    """Removes excluded transactions; keeps its state across the chunks of a stream."""
+
+    def __init__(self, exclusions: List[Exclusion]):
+        self.exclusions = exclusions
+        self.index = ExclusionIndex(exclusions)
+        self.removed_count = 0
+        # Amounts in cents
+        self.removed_by_category: Dict[str, int] = {}
+        self.excluded_section_count = 0
+        self.excluded_section_total = 0
+
+    def process(self, ledger: Ledger) -> Ledger:
+        """Remove excluded transactions from the ledger."""
+        rows = []
+        kind = ledger.kind
+        amounts = ledger.amount
+        pool = ledger.pool.strings
+        normalized: Dict[int, str] = {}
+
+        def normalized_string(string_id: int) -> str:
+            norm = normalized.get(string_id)
+            if norm is None:
+                norm = normalize_string(pool[string_id])
+                normalized[string_id] = norm
+            return norm
+
+        for row in range(len(ledger)):
+            row_kind = kind[row]
+            current_section_code = ledger.section_code(row)
+
+            # Check for section header (e.g., "6140 Advertising Software & Apps,,,,,,,,,")
+            if row_kind == LINE_SECTION:
+                # Skip section header for excluded accounts
+                if current_section_code in EXCLUDED_ACCOUNT_CODES:
+                    continue
+                rows.append(row)
+                continue
 
-            if not vendor_matches(vendor, excl.vendor):
+            # Check for Total line
+            if row_kind == LINE_TOTAL:
+                # Skip total lines for excluded sections
+                if current_section_code in EXCLUDED_ACCOUNT_CODES:
+                    continue
+                rows.append(row)
                 continue
 
-            if not memo_matches(memo, excl.memo):
+            # Only process transaction lines in P&L sections (4xxx-8xxx)
+            if not current_section_code or not current_section_code[0] in "45678":
+                rows.append(row)
                 continue
 
-            return excl
+            # Skip ALL transactions in excluded account sections
+            if current_section_code in EXCLUDED_ACCOUNT_CODES:
+                if row_kind == LINE_TXN:
+                    self.excluded_section_count += 1
+                    self.excluded_section_total += abs(amounts[row])
+                continue
 
-    return None
+            # Parse transaction line
+            if row_kind != LINE_TXN or not ledger.date[row]:
+                rows.append(row)
+                continue
 
+            date = ledger.date[row]
+            vendor = normalized_string(ledger.name[row])  # Name column
+            memo = normalized_string(ledger.memo[row])    # Memo/Description column
+            amount = amounts[row]
 
-def apply_exclusions(lines: List[str], exclusions: List[Exclusion]) -> Tuple[List[str], Dict[str, float]]:
-    """Remove excluded transactions from the transaction list."""
+            # Check if this transaction should be excluded
+            matching_excl = self.index.find(date, vendor, memo, amount, current_section_code)
 
-    new_lines = []
-    current_section_code = ""
-    removed_count = 0
-    removed_by_category: Dict[str, float] = {}
-    excluded_section_count = 0
-    excluded_section_total = 0.0
+            if matching_excl:
+                matching_excl.matched = True
+                self.removed_count += 1
 
-    for line in lines:
-        trimmed = line.strip()
+                # Track by category
+                category = matching_excl.category
+                if category not in self.removed_by_category:
+                    self.removed_by_category[category] = 0
+                self.removed_by_category[category] += abs(amount)
 
-        # Check for section header (e.g., "6140 Advertising Software & Apps,,,,,,,,,")
-        section_match = re.match(r'^(\d{4})\s+[^,]*,,,,,,,,,', trimmed)
-        if section_match:
-            current_section_code = section_match.group(1)
-            # Skip section header for excluded accounts
-            if current_section_code in EXCLUDED_ACCOUNT_CODES:
+                # Skip this row (don't add to rows)
                 continue
-            new_lines.append(line)
-            continue
 
-        # Check for Total line
-        if trimmed.startswith("Total for "):
-            # Skip total lines for excluded sections
-            if current_section_code in EXCLUDED_ACCOUNT_CODES:
-                continue
-            new_lines.append(line)
-            continue
+            rows.append(row)
 
-        # Only process transaction lines in P&L sections (4xxx-8xxx)
-        if not current_section_code or not current_section_code[0] in "45678":
-            new_lines.append(line)
-            continue
+        return ledger.select(rows)
 
-        # Skip ALL transactions in excluded account sections
-        if current_section_code in EXCLUDED_ACCOUNT_CODES:
-            if line.startswith(","):
-                parts = parse_csv_line(line)
-                if len(parts) >= 9:
-                    amount = parse_amount(parts[8])
-                    excluded_section_count += 1
-                    excluded_section_total += abs(amount)
-            continue
+    def report(self) -> None:
+        print(f"\nRemoved {self.removed_count} transactions from exclusions list")
+        if self.excluded_section_count > 0:
+            print(f"Removed {self.excluded_section_count} transactions from excluded account sections (${format_cents(self.excluded_section_total, grouped=True)})")
 
-        # Parse transaction line
-        if not line.startswith(","):
-            new_lines.append(line)
-            continue
-
-        parts = parse_csv_line(line)
-        if len(parts) < 9:
-            new_lines.append(line)
-            continue
+        # Report unmatched exclusions
+        unmatched = [e for e in self.exclusions if not e.matched]
+        if unmatched:
+            print(f"\nWARNING: {len(unmatched)} exclusions could not be matched:")
+            for e in unmatched[:10]:  # Show first 10
+                print(f"  - {e.date} | {e.vendor} | ${format_cents(e.amount)} | {e.account_code}")
+            if len(unmatched) > 10:
+                print(f"  ... and {len(unmatched) - 10} more")
 
-        date_str = parts[1].strip()
-        date_match = re.match(r'^(\d{2})/(\d{2})/(\d{4})$', date_str)
-        if not date_match:
-            new_lines.append(line)
-            continue
+        # Report what was removed
+        if self.removed_by_category:
+            print("\nRemoved amounts by category:")
+            total_removed = 0
+            for cat, amount in sorted(self.removed_by_category.items()):
+                print(f"  {cat}: ${format_cents(amount, grouped=True)}")
+                total_removed += amount
+            print(f"  TOTAL: ${format_cents(total_removed, grouped=True)}")
 
-        date = normalize_date(date_str)
-        vendor = parts[4].strip()  # Name column
-        memo = parts[6].strip()    # Memo/Description column
-        amount = parse_amount(parts[8])
 
-        # Check if this transaction should be excluded
-        matching_excl = find_matching_exclusion(
-            date, vendor, memo, amount, current_section_code, exclusions
-        )
+def load_stage() -> ExclusionStage:
+    """Load the exclusions file, summarize it, and set up the stage."""
+    # Load exclusions
+    exclusions = load_exclusions(EXCLUSIONS_FILE)
+    print(f"\nLoaded {len(exclusions)} exclusions")
 
-        if matching_excl:
-            matching_excl.matched = True
-            removed_count += 1
+    # Summarize exclusions by category
+    by_category: Dict[str, Tuple[int, int]] = {}
+    for e in exclusions:
+        if e.category not in by_category:
+            by_category[e.category] = (0, 0)
+        count, total = by_category[e.category]
+        by_category[e.category] = (count + 1, total + e.amount)
 
-            # Track by category
-            category = matching_excl.category
-            if category not in removed_by_category:
-                removed_by_category[category] = 0.0
-            removed_by_category[category] += abs(amount)
+    print("\nExclusions by category:")
+    for cat, (count, total) in sorted(by_category.items()):
+        print(f"  {cat}: {count} items, ${format_cents(total, grouped=True)}")
 
-            # Skip this line (don't add to new_lines)
-            continue
+    return ExclusionStage(exclusions)
 
-        new_lines.append(line)
 
-    print(f"\nRemoved {removed_count} transactions from exclusions list")
-    if excluded_section_count > 0:
-        print(f"Removed {excluded_section_count} transactions from excluded account sections (${excluded_section_total:,.2f})")
+def transform(ledger: Ledger) -> Ledger:
+    """Run this step on a ledger already held in memory."""
+    stage = load_stage()
+    ledger = stage.process(ledger)
+    stage.report()
+    return ledger
 
-    # Report unmatched exclusions
-    unmatched = [e for e in exclusions if not e.matched]
-    if unmatched:
-        print(f"\nWARNING: {len(unmatched)} exclusions could not be matched:")
-        for e in unmatched[:10]:  # Show first 10
-            print(f"  - {e.date} | {e.vendor} | ${e.amount:.2f} | {e.account_code}")
-        if len(unmatched) > 10:
-            print(f"  ... and {len(unmatched) - 10} more")
 
-    return new_lines, removed_by_category
+def stream(chunks: Iterable[Ledger]) -> Iterator[Ledger]:
+    """Run this step as a generator stage over ledger chunks."""
+    stage = load_stage()
+    for chunk in chunks:
+        yield stage.process(chunk)
+    stage.report()
 
 
 def main():
@@ -360,51 +394,21 @@ def main():
     print(f"Exclusions: {EXCLUSIONS_FILE}")
     print(f"Output:     {OUTPUT_FILE}")
 
-    # Load exclusions
-    exclusions = load_exclusions(EXCLUSIONS_FILE)
-    print(f"\nLoaded {len(exclusions)} exclusions")
-
-    # Summarize exclusions by category
-    by_category: Dict[str, Tuple[int, float]] = {}
-    for e in exclusions:
-        if e.category not in by_category:
-            by_category[e.category] = (0, 0.0)
-        count, total = by_category[e.category]
-        by_category[e.category] = (count + 1, total + e.amount)
-
-    print("\nExclusions by category:")
-    for cat, (count, total) in sorted(by_category.items()):
-        print(f"  {cat}: {count} items, ${total:,.2f}")
-
     # Read input file
-    with open(INPUT_FILE, 'r', encoding='utf-8') as f:
-        content = f.read()
-
-    lines = content.split('\n')
-    print(f"\nLoaded {len(lines)} lines from input file")
-
-    # Apply exclusions
-    new_lines, removed_by_category = apply_exclusions(lines, exclusions)
+    ledger = load_ledger(INPUT_FILE)
+    print(f"\nLoaded {len(ledger)} lines from input file")
 
-    # Report what was removed
-    if removed_by_category:
-        print("\nRemoved amounts by category:")
-        total_removed = 0.0
-        for cat, amount in sorted(removed_by_category.items()):
-            print(f"  {cat}: ${amount:,.2f}")
-            total_removed += amount
-        print(f"  TOTAL: ${total_removed:,.2f}")
+    # Run transformation
+    ledger = transform(ledger)
 
     # Write output
-    OUTPUT_FILE.parent.mkdir(parents=True, exist_ok=True)
-    with open(OUTPUT_FILE, 'w', encoding='utf-8') as f:
-        f.write('\n'.join(new_lines))
+    save_ledger(OUTPUT_FILE, ledger)
 
     print(f"\nOutput written to: {OUTPUT_FILE}")
-    print(f"Total lines: {len(new_lines)}")
+    print(f"Total lines: {len(ledger)}")
 
     # Generate P&L
-    generate_pnl(OUTPUT_FILE, PNL_FILE)
+    generate_pnl_from_ledger(ledger, PNL_FILE)
 
     print(f"\n{'=' * 80}")
 
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Step Cache Module
+
+Content-hash cache for the in-process pipeline runner. Each step's cache key
+covers everything that determines its output:
+- the key of the step before it (which covers the input export and the
+  shared modules the steps and reports run on)
+- the step script itself
+- the reference files it reads (REFERENCE_FILES in the step module)
+- a fingerprint of its rule tables (RULE_TABLES in the step module)
+
+When a step's recorded key matches, the runner skips it and reuses the
+P&L it produced last time, resuming from the ledger of the last skipped
+step, which is kept as a standalone snapshot (see ledger_snapshot.py)
+tagged with its key. Each key is recorded with the files
+the run left behind (the step's output, P&L and reports) and their size
+and modification time, so a step only counts as cached when every output
+the current flags ask for was written by that run and is unchanged since;
+an output an earlier run with other flags left behind is never trusted.
+"""
+
+import ast
+import hashlib
+import json
+import types
+from pathlib import Path
+from typing import Dict, List
+
+SCRIPT_DIR = Path(__file__).parent
+
+# Modules run_pipeline.py renders each step's P&L, reports and cube with,
+# beside the steps themselves
+ENGINE_ROOTS = [SCRIPT_DIR / "generate_reports.py", SCRIPT_DIR / "account_cube.py"]
+
+
+def local_imports(path: Path) -> List[Path]:
+    """The modules in the scripts directory a module imports, at any level of its code."""
+    with open(path, 'r', encoding='utf-8') as f:
+        tree = ast.parse(f.read(), str(path))
+    names = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            names.append(node.module)
+    modules = [SCRIPT_DIR / f"{name.split('.')[0]}.py" for name in names]
+    return [module for module in modules if module.exists()]
+
+
+def engine_files(step_files: List[Path]) -> List[Path]:
+    """
+    Shared modules whose code affects the steps' output, snapshots or reports.
+
+    Everything the steps and ENGINE_ROOTS import, directly or through each
+    other, so a new import is covered without being listed anywhere. The
+    steps themselves are left out: each is part of its own key.
+    """
+    found = set()
+    pending = list(ENGINE_ROOTS) + [module for path in step_files for module in local_imports(path)]
+    while pending:
+        path = pending.pop()
+        if path in found or path in step_files:
+            continue
+        found.add(path)
+        pending.extend(local_imports(path))
+    return sorted(found)
+
+
+def file_digest(path: Path) -> str:
+    """SHA-256 of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_stamp(path: Path) -> List[int]:
+    """Size and modification time of an output file, recorded with a step's key."""
+    stat = path.stat()
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _feed(digest, value) -> None:
+    """Feed a rule-table value into a digest in a stable, type-tagged form."""
+    if isinstance(value, types.FunctionType):
+        _feed(digest, value.__code__)
+    elif isinstance(value, types.CodeType):
+        digest.update(b"code:")
+        digest.update(value.co_code)
+        _feed(digest, value.co_consts)
+        _feed(digest, value.co_names)
+    elif isinstance(value, dict):
+        digest.update(b"dict:")
+        for key in sorted(value, key=repr):
+            _feed(digest, key)
+            _feed(digest, value[key])
+    elif isinstance(value, (set, frozenset)):
+        digest.update(b"set:")
+        for item in sorted(value, key=repr):
+            _feed(digest, item)
+    elif isinstance(value, (list, tuple)):
+        digest.update(f"seq{len(value)}:".encode())
+        for item in value:
+            _feed(digest, item)
+    else:
+        digest.update(f"{type(value).__name__}:{value!r};".encode())
+
+
+def fingerprint(value) -> str:
+    """
+    Stable digest of a rule table.
+
+    Handles the containers the steps use (lists, tuples, dicts, sets) and
+    lambdas, which are fingerprinted by their bytecode and constants.
+    """
+    digest = hashlib.sha256()
+    _feed(digest, value)
+    return digest.hexdigest()
+
+
+def input_cache_key(input_file: Path, step_files: List[Path]) -> str:
+    """Cache key for the raw input export and the shared code the steps run on (see engine_files())."""
+    digest = hashlib.sha256()
+    digest.update(file_digest(input_file).encode())
+    for path in engine_files(step_files):
+        digest.update(file_digest(path).encode())
+    return digest.hexdigest()
+
+
+def step_cache_key(previous_key: str, step: types.ModuleType) -> str:
+    """Cache key for a step given the key of the step that feeds it."""
+    digest = hashlib.sha256()
+    digest.update(previous_key.encode())
+    digest.update(file_digest(Path(step.__file__)).encode())
+    for path in getattr(step, "REFERENCE_FILES", []):
+        digest.update(file_digest(path).encode())
+    for table in getattr(step, "RULE_TABLES", []):
+        digest.update(fingerprint(table).encode())
+    return digest.hexdigest()
+
+
+class StepCache:
+    """Recorded cache keys, one file per step, and the ledgers a later run can resume from."""
+
+    def __init__(self, cache_dir: Path):
+        self.cache_dir = cache_dir
+
+    def ledger_dir(self, step_name: str) -> Path:
+        """Where the standalone snapshot of a step's output ledger is kept."""
+        return self.cache_dir / step_name
+
+    def _key_file(self, step_name: str) -> Path:
+        return self.cache_dir / f"{step_name}.json"
+
+    def _record(self, step_name: str) -> Dict:
+        """What the last run of a step recorded."""
+        key_file = self._key_file(step_name)
+        if not key_file.exists():
+            return {}
+        with open(key_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def is_current(self, step_name: str, key: str, outputs: List[Path]) -> bool:
+        """
+        Whether a step's recorded key is key and the run that recorded it wrote
+        every one of outputs, none of which has changed since.
+        """
+        record = self._record(step_name)
+        if record.get("key") != key:
+            return False
+        written = record.get("outputs", {})
+        for path in outputs:
+            try:
+                stamp = file_stamp(path)
+            except OSError:
+                return False
+            if written.get(str(path)) != stamp:
+                return False
+        return True
+
+    def record(self, step_name: str, key: str, outputs: List[Path]) -> None:
+        """
+        Record the key a step ran with and the outputs that run wrote.
+
+        Outputs an earlier run with the same key wrote stay recorded while they are unchanged.
+        """
+        written: Dict[str, List[int]] = {}
+        record = self._record(step_name)
+        if record.get("key") == key:
+            for path, stamp in record.get("outputs", {}).items():
+                try:
+                    if file_stamp(Path(path)) == stamp:
+                        written[path] = stamp
+                except OSError:
+                    pass
+        written.update((str(path), file_stamp(path)) for path in outputs)
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        with open(self._key_file(step_name), 'w', encoding='utf-8') as f:
+            json.dump({"key": key, "outputs": written}, f, indent=2)
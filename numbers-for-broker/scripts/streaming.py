@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Streaming Module
+
+Constant-memory plumbing for running the pipeline over exports too large to
+hold in memory. An export is read lazily and cut into chunks of at most
+CHUNK_ROWS rows; each chunk is a small Ledger that carries the section
+context of the rows before it, so the step logic written against a Ledger
+works unchanged on a chunk. Steps that only filter, rewrite or insert rows
+expose a stream() generator stage over chunks; steps that reorder rows
+spill them to temporary files instead of holding them (see step2 and step5).
+
+Every chunk gets its own string pool, so nothing grows with the export.
+"""
+
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, TextIO
+
+from ledger import Ledger, NO_ACCOUNT
+from ledger_snapshot import discard_snapshot
+from pnl_generator import AccountMonthMatrix, PNL_ACCOUNTS, accumulate_ledger
+
+CHUNK_ROWS = 5000
+
+
+def iter_lines(input_file: Path) -> Iterator[str]:
+    """Yield an export's lines lazily, exactly as content.split('\\n') would."""
+    with open(input_file, 'r', encoding='utf-8') as f:
+        line = ""
+        for line in f:
+            yield line[:-1] if line.endswith('\n') else line
+        # A trailing newline (or an empty file) leaves one empty last line
+        if line == "" or line.endswith('\n'):
+            yield ""
+
+
+def chunk_ledgers(lines: Iterable[str], chunk_rows: int = CHUNK_ROWS) -> Iterator[Ledger]:
+    """Cut a stream of export lines into ledgers of at most chunk_rows rows."""
+    context = (NO_ACCOUNT, 0)
+    batch: List[str] = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) >= chunk_rows:
+            chunk = Ledger.from_lines(batch, context)
+            context = chunk.end_context()
+            batch = []
+            yield chunk
+    if batch:
+        yield Ledger.from_lines(batch, context)
+
+
+def chunk_lines(chunks: Iterable[Ledger]) -> Iterator[str]:
+    """Flatten chunks back into a stream of lines."""
+    for chunk in chunks:
+        yield from chunk.raw
+
+
+def read_chunks(input_file: Path, chunk_rows: int = CHUNK_ROWS) -> Iterator[Ledger]:
+    """Stream an export as ledger chunks."""
+    return chunk_ledgers(iter_lines(input_file), chunk_rows)
+
+
+class LineCounter:
+    """Pass-through stage counting the rows that flow past it."""
+
+    def __init__(self):
+        self.lines = 0
+
+    def tap(self, chunks: Iterable[Ledger]) -> Iterator[Ledger]:
+        for chunk in chunks:
+            self.lines += len(chunk)
+            yield chunk
+
+
+def write_chunks(output_file: Path, chunks: Iterable[Ledger]) -> Iterator[Ledger]:
+    """Pass-through stage writing the stream out in the export layout (without a snapshot)."""
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+    discard_snapshot(output_file)
+    with open(output_file, 'w', encoding='utf-8') as f:
+        first = True
+        for chunk in chunks:
+            if chunk.raw:
+                if not first:
+                    f.write('\n')
+                f.write('\n'.join(chunk.raw))
+                first = False
+            yield chunk
+
+
+class MatrixAccumulator:
+    """Pass-through stage summing the stream into an account x month matrix."""
+
+    def __init__(self):
+        self.cells: Dict[str, Dict[int, int]] = {code: {} for code in PNL_ACCOUNTS}
+
+    def tap(self, chunks: Iterable[Ledger]) -> Iterator[Ledger]:
+        for chunk in chunks:
+            accumulate_ledger(self.cells, chunk)
+            yield chunk
+
+    def matrix(self) -> AccountMonthMatrix:
+        return AccountMonthMatrix(self.cells)
+
+
+class SpillFiles:
+    """
+    Named temporary line files for rows a stage has to hold back.
+
+    Lines are appended with write() and read back, in order, with read().
+    """
+
+    def __init__(self, spill_dir: Path):
+        self.spill_dir = spill_dir
+        self._files: Dict[str, TextIO] = {}
+        self._paths: Dict[str, Path] = {}
+
+    def write(self, name: str, line: str) -> None:
+        f = self._files.get(name)
+        if f is None:
+            path = self.spill_dir / f"{len(self._paths)}.spill"
+            self._paths[name] = path
+            f = self._files[name] = open(path, 'w', encoding='utf-8', newline='')
+        f.write(line)
+        f.write('\n')
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._paths
+
+    def read(self, name: str, limit: Optional[int] = None) -> Iterator[str]:
+        """Yield the lines written under name (at most limit of them)."""
+        if name not in self._paths:
+            return
+        self._files[name].flush()
+        with open(self._paths[name], 'r', encoding='utf-8', newline='') as f:
+            for count, line in enumerate(f):
+                if limit is not None and count >= limit:
+                    break
+                yield line[:-1]
+
+    def skip_read(self, name: str, skip: int) -> Iterator[str]:
+        """Yield the lines written under name after the first skip."""
+        if name not in self._paths:
+            return
+        self._files[name].flush()
+        with open(self._paths[name], 'r', encoding='utf-8', newline='') as f:
+            for count, line in enumerate(f):
+                if count >= skip:
+                    yield line[:-1]
+
+    def close(self) -> None:
+        for f in self._files.values():
+            f.close()
+
+
+@contextmanager
+def spill_files() -> Iterator[SpillFiles]:
+    """SpillFiles in a temporary directory that is removed afterwards."""
+    with tempfile.TemporaryDirectory(prefix="pnl-spill-") as spill_dir:
+        spills = SpillFiles(Path(spill_dir))
+        try:
+            yield spills
+        finally:
+            spills.close()
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+Synthetic Export Module
+
+Generates synthetic QuickBooks "Transaction Detail by Account" exports of
+any size, laid out like the real input export: the three-line report header
+and column header, a couple of balance-sheet sections, a section for every
+PNL_ACCOUNTS code (sub-accounts nested under 6000 Cost of Sales and 6100
+Advertising & Marketing, with their "with sub-accounts" totals), date-sorted
+transaction lines with running balances, quoted amounts and long bank-feed
+memos, "Total for" lines, the TOTAL line and the Accrual Basis footer.
+
+So that every step has work to do, some rows are planted for the steps to
+find: vendors named by the step 2 reclassification patterns in the accounts
+those rules move from, and the step 6 exclusions at their own dates and
+amounts. Everything else is random but reproducible from --seed.
+
+Usage: python3 synthetic_export.py ROWS [--output FILE] [--seed N]
+       ROWS takes k/M suffixes, e.g. 10k, 100k, 1M, 10M
+"""
+
+import argparse
+import random
+from datetime import date
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+
+from pnl_generator import PNL_ACCOUNTS
+from step2_apply_reclassifications import RECLASSIFICATIONS
+from step6_apply_exclusions import EXCLUSIONS_FILE, load_exclusions
+
+SCRIPT_DIR = Path(__file__).parent
+BASE_DIR = SCRIPT_DIR.parent
+SYNTHETIC_DIR = BASE_DIR / "output" / ".benchmark"
+
+COLUMN_HEADER = ",Transaction date,Transaction type,Num,Name,Class full name,Memo/Description,Account full name,Amount,Balance"
+FOOTER = '"Accrual Basis Monday, January 1, 2024 12:00 AM GMTZ",,,,,,,,,'
+
+FIRST_DATE = date(2024, 1, 1)
+LAST_DATE = date(2025, 11, 30)
+
+BANK_ACCOUNT = "1000 CHASE CHECKING (1906)"
+CARD_ACCOUNT = "2110 R. NOEL (8277) - 1"
+
+# Share of the transaction rows each section gets; P&L codes not listed get 1
+SECTION_WEIGHTS: Dict[str, float] = {
+    BANK_ACCOUNT: 25,
+    CARD_ACCOUNT: 8,
+    "4000": 2, "4020": 1.5, "4040": 1,
+    "6010": 2, "6020": 1, "6055": 2, "6065": 2, "6075": 6,
+    "6100": 2, "6110": 2, "6120": 7, "6130": 1, "6140": 3,
+    "6210": 2, "6240": 0.5, "6375": 4, "6470": 1, "6495": 0.5,
+}
+
+# Parent accounts whose sub-accounts are nested under a parent header
+PARENT_WITH_OWN_SECTION = "6100 Advertising & Marketing"
+PARENT_HEADER_ONLY = "6000 Cost of Sales"
+
+# Accounts whose activity is mostly negative (contra-income)
+NEGATIVE_ACCOUNTS = {"4010", "4020", "4040"}
+
+TRANSACTION_TYPES = [
+    ("Expense", 60), ("Deposit", 12), ("Journal Entry", 10), ("Credit Card Payment", 2),
+    ("Credit Card Credit", 1), ("Transfer", 1), ("Check", 1), ("Bill", 1),
+]
+
+VENDORS = [
+    "Ship Dudes", "Google Ads", "Meta Platforms", "Shopify", "Amazon", "PAYPAL", "AUTHNET GATEWAY",
+    "TikTok Ads", "Klaviyo", "Gusto", "Upwork", "Canva", "Uber", "Delta Air Lines", "ShipBob",
+    'MB ""Kvadratai""', "Spinners ODJ Ind", "Stripe", "FedEx", "UPS", "Notion Labs", "Zapier",
+]
+
+LONG_MEMO_RATE = 0.5
+RULE_MATCH_RATE = 0.05
+NAME_RATE = 0.8
+
+
+def parse_size(text: str) -> int:
+    """'10k' -> 10000, '1M' -> 1000000."""
+    multipliers = {"k": 1_000, "m": 1_000_000}
+    suffix = text[-1:].lower()
+    if suffix in multipliers:
+        return int(float(text[:-1]) * multipliers[suffix])
+    return int(text)
+
+
+def format_size(rows: int) -> str:
+    """1000000 -> '1M', 10000 -> '10k'."""
+    if rows % 1_000_000 == 0:
+        return f"{rows // 1_000_000}M"
+    if rows % 1_000 == 0:
+        return f"{rows // 1_000}k"
+    return str(rows)
+
+
+def csv_field(value: str) -> str:
+    """Quote a field the way QuickBooks does: only when it holds a comma or quote."""
+    if ',' in value or '"' in value:
+        return f'"{value}"'
+    return value
+
+
+def format_amount(amount: float) -> str:
+    return csv_field(f"{amount:,.2f}")
+
+
+def format_total(amount: float) -> str:
+    sign = "-" if amount < 0 else ""
+    return csv_field(f"{sign}${abs(amount):,.2f}")
+
+
+def account_full_name(code: str) -> str:
+    """'6110' -> '6100 Advertising & Marketing:6110 Paid Advertising'."""
+    config = PNL_ACCOUNTS[code]
+    if config.subcategory and config.subcategory != config.display_name:
+        return f"{config.subcategory}:{config.display_name}"
+    return config.display_name
+
+
+def export_layout() -> List[Tuple[str, str]]:
+    """
+    (kind, name) lines of the section skeleton, in export order.
+
+    kind is "section" (a header whose transactions follow, name is the
+    account or P&L code), "header" (a parent header with no transactions
+    of its own) or "total" (a parent's "with sub-accounts" total).
+    """
+    layout = [("section", BANK_ACCOUNT), ("section", CARD_ACCOUNT)]
+    codes = sorted(PNL_ACCOUNTS, key=lambda code: PNL_ACCOUNTS[code].order)
+    cost_of_sales = [code for code in codes if PNL_ACCOUNTS[code].subcategory == PARENT_HEADER_ONLY]
+    advertising = [code for code in codes if PNL_ACCOUNTS[code].subcategory == PARENT_WITH_OWN_SECTION]
+
+    for code in codes:
+        if code in cost_of_sales:
+            continue
+        layout.append(("section", code))
+        if code == advertising[-1]:
+            layout.append(("total", PARENT_WITH_OWN_SECTION))
+
+    # QuickBooks lists 6000 Cost of Sales last, under a bare parent header
+    layout.append(("header", PARENT_HEADER_ONLY))
+    layout.extend(("section", code) for code in cost_of_sales)
+    layout.append(("total", PARENT_HEADER_ONLY))
+    return layout
+
+
+def section_title(name: str) -> str:
+    return PNL_ACCOUNTS[name].display_name if name in PNL_ACCOUNTS else name
+
+
+class SyntheticExport:
+    """Generator for one synthetic export; all randomness comes from seed."""
+
+    def __init__(self, rows: int, seed: int = 0):
+        self.rows = rows
+        self.rng = random.Random(seed)
+        self.layout = export_layout()
+        self.first_ordinal = FIRST_DATE.toordinal()
+        self.last_ordinal = LAST_DATE.toordinal()
+        self.types = [name for name, _ in TRANSACTION_TYPES]
+        self.type_weights = [weight for _, weight in TRANSACTION_TYPES]
+        self.pnl_names = [account_full_name(code) for code in PNL_ACCOUNTS]
+
+        self.rule_vendors: Dict[str, List[str]] = {}
+        for from_code, _, patterns in RECLASSIFICATIONS:
+            if patterns:
+                self.rule_vendors.setdefault(from_code, []).extend(patterns)
+
+        self.exclusions: Dict[str, List[Tuple[int, str, str, float]]] = {}
+        for excl in load_exclusions(EXCLUSIONS_FILE):
+            month, day, year = (int(part) for part in excl.date.split('/'))
+            self.exclusions.setdefault(excl.account_code, []).append(
+                (date(year, month, day).toordinal(), excl.vendor, excl.memo, excl.amount / 100)
+            )
+
+        # Date text by ordinal, formatted once: (MM/DD/YYYY, YYMMDD)
+        planted = [txn[0] for txns in self.exclusions.values() for txn in txns]
+        self.date_text = {
+            ordinal: (date.fromordinal(ordinal).strftime("%m/%d/%Y"), date.fromordinal(ordinal).strftime("%y%m%d"))
+            for ordinal in range(min([self.first_ordinal] + planted), max([self.last_ordinal] + planted) + 1)
+        }
+
+    def section_rows(self) -> Dict[str, int]:
+        """How many transaction lines each section gets."""
+        sections = [name for kind, name in self.layout if kind == "section"]
+        structure = len(sections) + len(self.layout) + 10
+        txn_rows = max(self.rows - structure, 0)
+        weights = [SECTION_WEIGHTS.get(name, 1) for name in sections]
+        total = sum(weights)
+        counts = {name: int(txn_rows * weight / total) for name, weight in zip(sections, weights)}
+        counts[BANK_ACCOUNT] += txn_rows - sum(counts.values())
+        return counts
+
+    def memo(self, vendor: str, ordinal: int) -> str:
+        rng = self.rng
+        if rng.random() >= LONG_MEMO_RATE:
+            return csv_field(f"{vendor.upper()} *{rng.randrange(10**8):08d}")
+        stamp = self.date_text[ordinal][1]
+        return csv_field(
+            f"ORIG CO NAME:{vendor} ORIG ID:XXXXXX{rng.randrange(10**4):04d} DESC DATE:{stamp} "
+            f"CO ENTRY DESCR:PAYMENTS SEC:CCD TRACE#:XXXXXXXX{rng.randrange(10**7):07d} EED:{stamp} "
+            f"IND ID:ST-{rng.randrange(16**8):08X} IND NAME:& COMPANY, LLC TRN: XXXXXX{rng.randrange(10**4):04d} TC"
+        )
+
+    def section_lines(self, name: str, count: int) -> Tuple[List[str], float]:
+        """A section's transaction lines and its total."""
+        rng = self.rng
+        is_pnl = name in PNL_ACCOUNTS
+        counterpart = BANK_ACCOUNT if is_pnl else None
+        rule_vendors = self.rule_vendors.get(name, [])
+        planted = self.exclusions.get(name, []) if is_pnl else []
+
+        txns = []
+        for _ in range(max(count - len(planted), 0)):
+            ordinal = rng.randint(self.first_ordinal, self.last_ordinal)
+            if rule_vendors and rng.random() < RULE_MATCH_RATE:
+                vendor = rng.choice(rule_vendors)
+            else:
+                vendor = rng.choice(VENDORS) if rng.random() < NAME_RATE else ""
+            amount = round(rng.lognormvariate(4.5, 1.6), 2)
+            if (name in NEGATIVE_ACCOUNTS) != (rng.random() < 0.1):
+                amount = -amount
+            txns.append((ordinal, vendor, self.memo(vendor or "ONLINE TRANSFER", ordinal), amount))
+        txns.extend((ordinal, vendor, csv_field(memo), amount) for ordinal, vendor, memo, amount in planted)
+        txns.sort(key=lambda txn: txn[0])
+
+        lines = []
+        balance = 0.0
+        txn_types = rng.choices(self.types, self.type_weights, k=len(txns))
+        for (ordinal, vendor, memo, amount), txn_type in zip(txns, txn_types):
+            balance += amount
+            other = counterpart or rng.choice(self.pnl_names)
+            lines.append(
+                f",{self.date_text[ordinal][0]},{txn_type},,{csv_field(vendor)},,"
+                f"{memo},{csv_field(other)},{format_amount(amount)},{format_amount(balance)}"
+            )
+        return lines, balance
+
+    def lines(self) -> Iterator[str]:
+        yield "Transaction Detail by Account,,,,,,,,,"
+        yield "And Company (Synthetic),,,,,,,,,"
+        yield '"January 1, 2024-November 30, 2025",,,,,,,,,'
+        yield ""
+        yield COLUMN_HEADER
+
+        counts = self.section_rows()
+        grand_total = 0.0
+        group_totals: Dict[str, float] = {}
+        for kind, name in self.layout:
+            if kind == "header":
+                yield f"{name},,,,,,,,,"
+            elif kind == "total":
+                yield f"Total for {name} with sub-accounts,,,,,,,,{format_total(group_totals.get(name, 0.0))},"
+            else:
+                title = section_title(name)
+                yield f"{title},,,,,,,,,"
+                lines, total = self.section_lines(name, counts[name])
+                yield from lines
+                yield f"Total for {title},,,,,,,,{format_total(total)},"
+                if name in PNL_ACCOUNTS and PNL_ACCOUNTS[name].subcategory:
+                    group = PNL_ACCOUNTS[name].subcategory
+                    group_totals[group] = group_totals.get(group, 0.0) + total
+                grand_total += total
+
+        yield f",TOTAL,,,,,,,{format_total(grand_total)},"
+        yield ""
+        yield ""
+        yield ""
+        yield FOOTER
+
+    def write(self, output_file: Path) -> int:
+        """Write the export (with the CRLF line endings of a real one); returns the line count."""
+        output_file.parent.mkdir(parents=True, exist_ok=True)
+        count = 0
+        with open(output_file, 'w', encoding='utf-8', newline='\r\n') as f:
+            batch = []
+            for line in self.lines():
+                batch.append(line)
+                if len(batch) >= 10000:
+                    f.write('\n'.join(batch))
+                    f.write('\n')
+                    count += len(batch)
+                    batch = []
+            if batch:
+                f.write('\n'.join(batch))
+                f.write('\n')
+                count += len(batch)
+        return count
+
+
+def generate_export(output_file: Path, rows: int, seed: int = 0) -> int:
+    """Write a synthetic export of about rows lines; returns the exact line count."""
+    return SyntheticExport(rows, seed).write(output_file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic Transaction Detail by Account export.")
+    parser.add_argument("rows", help="Approximate number of lines, e.g. 10k, 100k, 1M, 10M")
+    parser.add_argument("--output", type=Path, help="Output file (default output/.benchmark/synthetic-<rows>.csv)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (default 0)")
+    args = parser.parse_args()
+
+    rows = parse_size(args.rows)
+    output_file = args.output or SYNTHETIC_DIR / f"synthetic-{format_size(rows)}.csv"
+    count = generate_export(output_file, rows, args.seed)
+    print(f"Wrote {count:,} lines to {output_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Conformance tests for csv_tokenizer.parse_csv_line.
+
+The fast path is checked against the original character-by-character
+tokenizer on edge cases and on every line of the input and reference files.
+"""
+
+from pathlib import Path
+from typing import List
+
+import pytest
+
+from csv_tokenizer import parse_csv_line
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+DATA_FILES = sorted((BASE_DIR / "input-data").glob("*.csv")) + sorted((BASE_DIR / "reference-data").glob("*.csv"))
+
+
+def parse_csv_line_reference(line: str) -> List[str]:
+    """The original character-by-character tokenizer."""
+    result = []
+    current = ""
+    in_quotes = False
+
+    for char in line:
+        if char == '"':
+            in_quotes = not in_quotes
+        elif char == ',' and not in_quotes:
+            result.append(current.strip())
+            current = ""
+        else:
+            current += char
+    result.append(current.strip())
+    return result
+
+
+CASES = [
+    "",
+    ",",
+    ",,,,,,,,,",
+    "a,b,c",
+    "  a , b\t,c  ",
+    ",01/15/2024,Expense,,Vendor,,memo,,123.45\r",
+    ',01/15/2024,Expense,,Vendor,,memo,,"1,234.56"\r',
+    ',01/15/2024,Expense,,Vendor,,"memo, with, commas",,"-1,234.56"',
+    '"quoted","fields"',
+    '"a""b",c',
+    '""',
+    '"',
+    'a"b,c"d,e',
+    '"unterminated, quote',
+    '" padded ", x',
+    'x" , "y',
+    '"",,""',
+    ',"multi-line memo starts here',
+    'continues here",,12.00\r',
+    "6120 Affiliate Marketing Expense,,,,,,,,,\r",
+    '"Total for 6120 Affiliate Marketing Expense",,,,,,,,"$1,000.00"',
+]
+
+
+@pytest.mark.parametrize("line", CASES)
+def test_case_matches_reference(line):
+    assert parse_csv_line(line) == parse_csv_line_reference(line)
+
+
+def test_known_fields():
+    assert parse_csv_line(',01/15/2024,Expense,,Vendor,,"memo, with, commas",,"-1,234.56"') == [
+        "", "01/15/2024", "Expense", "", "Vendor", "", "memo, with, commas", "", "-1,234.56",
+    ]
+    assert parse_csv_line('"a""b",c') == ["ab", "c"]
+
+
+@pytest.mark.skipif(not DATA_FILES, reason="no input or reference data")
+@pytest.mark.parametrize("path", DATA_FILES, ids=lambda path: path.name)
+def test_data_file_matches_reference(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        lines = f.read().split('\n')
+    mismatches = [
+        (number, line) for number, line in enumerate(lines, 1)
+        if parse_csv_line(line) != parse_csv_line_reference(line)
+    ]
+    assert not mismatches, f"{len(mismatches)} of {len(lines)} lines differ, first: {mismatches[0]}"